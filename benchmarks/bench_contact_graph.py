@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Transitive exposure query cost on a synthetic contact graph.
+
+Builds a graph of --edges time-ordered contacts between --people people, then
+times ContactGraph.exposure from random sources for 1 to --max-hops hops.
+
+Usage: python benchmarks/bench_contact_graph.py [--edges 1000000] [--people 100000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from contact_graph import ContactGraph
+from contact_store import EncounterTable
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edges', type=int, default=1_000_000)
+    parser.add_argument('--people', type=int, default=100_000)
+    parser.add_argument('--max-hops', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=50, help='Queries per hop count')
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    people = range(args.people) # Interned person ids, as stored by ContactStore
+    table = EncounterTable()
+    graph = ContactGraph(table)
+
+    start = time.perf_counter()
+    for i in range(args.edges):
+        person1, person2 = rng.sample(people, 2)
+        graph.add(table.append(person1, person2, 0, 0, i), person1, person2) # One contact per second
+    build_time = time.perf_counter() - start
+    print(f"built {len(graph)} edges between {args.people} people in {build_time:.1f}s "
+          f"({args.edges / build_time:,.0f} edges/s)")
+
+    print(f"{'hops':>4} {'mean ms':>9} {'p95 ms':>9} {'mean exposed':>13}")
+    for hops in range(1, args.max_hops + 1):
+        durations, exposed = [], []
+        for _ in range(args.queries):
+            source = rng.choice(people)
+            since = rng.randrange(args.edges // 2) # Start somewhere in the first half of the history
+            start = time.perf_counter()
+            result = graph.exposure(source, since, hops)
+            durations.append(time.perf_counter() - start)
+            exposed.append(len(result))
+        durations.sort()
+        p95 = durations[int(len(durations) * 0.95) - 1]
+        print(f"{hops:>4} {statistics.mean(durations) * 1000:9.2f} {p95 * 1000:9.2f} {statistics.mean(exposed):13.0f}")
+
+if __name__ == '__main__':
+    main()
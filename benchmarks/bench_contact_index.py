@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Per-update cost of contact detection as the tracked population grows.
+
+Compares the SpatialIndex used by ContactTracker against the original full scan
+of every tracked position. The scan is skipped above --max-scan people because
+it becomes too slow to be worth measuring.
+
+Usage: python benchmarks/bench_contact_index.py [--grid 100000] [--radius 0] [--metric chebyshev]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from contact_index import SpatialIndex
+
+def random_step(position, grid_size, rng):
+    # Same random walk as Person.move
+    x, y = position
+    x = max(0, min(x + rng.choice((-1, 0, 1)), grid_size - 1))
+    y = max(0, min(y + rng.choice((-1, 0, 1)), grid_size - 1))
+    return x, y
+
+def bench_index(population, grid_size, radius, metric, updates, rng):
+    index = SpatialIndex(radius, metric)
+    people = [f'person{i}' for i in range(population)]
+    for person in people:
+        index.move(person, (rng.randrange(grid_size), rng.randrange(grid_size)))
+
+    moves = [rng.choice(people) for _ in range(updates)]
+    contacts = 0
+    start = time.perf_counter()
+    for person in moves:
+        position = random_step(index.positions[person], grid_size, rng)
+        index.move(person, position)
+        contacts += len(index.nearby(person, position))
+    elapsed = time.perf_counter() - start
+    return elapsed / updates, contacts
+
+def bench_scan(population, grid_size, updates, rng):
+    positions = {f'person{i}': (rng.randrange(grid_size), rng.randrange(grid_size)) for i in range(population)}
+    people = list(positions)
+
+    moves = [rng.choice(people) for _ in range(updates)]
+    contacts = 0
+    start = time.perf_counter()
+    for person in moves:
+        position = random_step(positions[person], grid_size, rng)
+        positions[person] = position
+        for other_person, other_position in positions.items():
+            if other_person != person and other_position == position:
+                contacts += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / updates, contacts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', type=int, default=100_000, help='Grid side length')
+    parser.add_argument('--radius', type=int, default=0, help='Contact radius (0 = exact cell)')
+    parser.add_argument('--metric', default='chebyshev', choices=['chebyshev', 'euclidean'])
+    parser.add_argument('--updates', type=int, default=20_000, help='Position updates timed per population')
+    parser.add_argument('--populations', default='10,100,1000,10000,100000')
+    parser.add_argument('--max-scan', type=int, default=10_000, help='Largest population to run the full scan for')
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+
+    print(f"grid={args.grid}x{args.grid} radius={args.radius} metric={args.metric} updates={args.updates}")
+    print(f"{'people':>10} {'index us/update':>16} {'scan us/update':>15}")
+    for population in [int(p) for p in args.populations.split(',')]:
+        index_cost, _ = bench_index(population, args.grid, args.radius, args.metric, args.updates, random.Random(args.seed))
+        if population <= args.max_scan:
+            scan_updates = max(100, min(args.updates, 2_000_000 // population))
+            scan_cost, _ = bench_scan(population, args.grid, scan_updates, random.Random(args.seed))
+            scan_column = f'{scan_cost * 1e6:15.2f}'
+        else:
+            scan_column = f'{"skipped":>15}'
+        print(f'{population:>10} {index_cost * 1e6:16.2f} {scan_column}')
+
+if __name__ == '__main__':
+    main()
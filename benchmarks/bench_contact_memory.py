@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Memory used per recorded contact: the original nested-dict structure versus ContactStore.
+
+The original structure is rebuilt exactly as ContactTracker.record_contact used to
+store it: both directions, each with a (x, y, formatted timestamp) tuple.
+
+Usage: python benchmarks/bench_contact_memory.py [--contacts 1000000] [--people 1000]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from contact_store import TIMESTAMP_FORMAT, ContactStore
+
+def synthetic_contacts(count, people, grid, seed):
+    rng = random.Random(seed)
+    names = [f'person{i}' for i in range(people)]
+    start = int(time.time())
+    for i in range(count):
+        person1, person2 = rng.sample(names, 2)
+        yield person1, person2, (rng.randrange(grid), rng.randrange(grid)), start + i // 10
+
+def nested_dict_contacts(contacts):
+    store = {}
+    for person1, person2, position, ts in contacts:
+        timestamp = datetime.fromtimestamp(ts).strftime(TIMESTAMP_FORMAT) # A new string per contact, as before
+        for p1, p2 in [(person1, person2), (person2, person1)]:
+            if p1 not in store:
+                store[p1] = {}
+            if p2 not in store[p1]:
+                store[p1][p2] = {'count': 0, 'locations': []}
+            store[p1][p2]['count'] += 1
+            store[p1][p2]['locations'].append((position[0], position[1], timestamp))
+    return store
+
+def contact_store_contacts(contacts):
+    store = ContactStore()
+    for person1, person2, position, ts in contacts:
+        store.record(person1, person2, position, ts)
+    return store
+
+def measure(build, contacts):
+    gc.collect()
+    tracemalloc.start()
+    result = build(contacts)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contacts', type=int, default=1_000_000)
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument('--grid', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+
+    print(f"{args.contacts} contacts between {args.people} people")
+    for label, build in (('nested dict', nested_dict_contacts), ('ContactStore', contact_store_contacts)):
+        used = measure(build, synthetic_contacts(args.contacts, args.people, args.grid, args.seed))
+        print(f"{label:>13}: {used / 1e6:8.1f} MB, {used / args.contacts:6.1f} bytes per contact")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Per-call latency of the management API publish call: a fresh connection per
+request (plain requests.post, as the scripts used to do) versus the pooled
+keep-alive RabbitMQClient.
+
+Runs against a local stand-in for the /exchanges/.../publish endpoint, so it
+measures connection and request overhead rather than broker work.
+
+Usage: python benchmarks/bench_http_client.py [--calls 2000]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.auth import HTTPBasicAuth
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from http_client import RabbitMQClient
+
+PAYLOAD = {'properties': {}, 'routing_key': 'position', 'payload': '{"person": "bench", "x": 1, "y": 2}',
+           'payload_encoding': 'string'}
+
+class PublishHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real management API
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        body = b'{"routed": true}'
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def time_calls(call, calls):
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations
+
+def report(label, durations):
+    p99 = durations[int(len(durations) * 0.99) - 1]
+    print(f"{label:>16}: mean {statistics.mean(durations) * 1000:6.3f} ms, "
+          f"p50 {durations[len(durations) // 2] * 1000:6.3f} ms, p99 {p99 * 1000:6.3f} ms, "
+          f"{len(durations) / sum(durations):8,.0f} calls/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PublishHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f'http://127.0.0.1:{server.server_address[1]}/api'
+    path = 'exchanges/%2F/bench/publish'
+
+    auth = HTTPBasicAuth('guest', 'guest')
+    headers = {'content-type': 'application/json'}
+    def unpooled():
+        requests.post(f'{api_url}/{path}', auth=auth, headers=headers, data=json.dumps(PAYLOAD)).json()
+
+    client = RabbitMQClient(api_url, 'guest', 'guest')
+    def pooled():
+        client.post(path, PAYLOAD).json()
+
+    print(f"{args.calls} publish calls per client")
+    report('requests.post', time_calls(unpooled, args.calls))
+    report('RabbitMQClient', time_calls(pooled, args.calls))
+
+    client.close()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Tracker index memory and contact check cost on a large, sparsely occupied grid.
+
+Places --people people at random on a --grid x --grid grid and reports, for each
+topology and contact radius:
+  - the memory held by the SpatialIndex per person, against the earlier layout
+    that kept a set for every occupied cell (set-per-cell)
+  - the cost of one position update (move plus contact check), which depends on
+    the occupants of the neighbourhood and not on the grid area
+Then times one step of the simulator's random walk for the whole population
+(numpy when installed).
+
+Usage: python benchmarks/bench_large_grid.py [--grid 100000] [--people 1000000] [--radius 0 2 10]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from contact_index import SpatialIndex
+from topology import Topology
+import simulate
+
+class SetPerCellIndex(SpatialIndex):
+    """The index before lone occupants were stored without a set"""
+
+    def move(self, person, cell):
+        old_cell = self.positions.get(person)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._discard(person, old_cell)
+        self.positions[person] = cell
+        self.cells.setdefault(cell, set()).add(person)
+
+    def _discard(self, person, cell):
+        occupants = self.cells[cell]
+        occupants.discard(person)
+        if not occupants:
+            del self.cells[cell]
+
+def build(index_class, topology, radius, people, seed):
+    rng = random.Random(seed)
+    tracemalloc.start()
+    index = index_class(radius, 'chebyshev', topology)
+    for person in people:
+        index.move(person, (rng.randrange(topology.size), rng.randrange(topology.size)))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return index, memory
+
+def time_updates(index, topology, people, updates, seed):
+    rng = random.Random(seed)
+    moves = [(rng.choice(people), rng.choice((-1, 0, 1)), rng.choice((-1, 0, 1))) for _ in range(updates)]
+    contacts = 0
+    started = time.perf_counter()
+    for person, dx, dy in moves:
+        cell = topology.step(*index.positions[person], dx, dy)
+        index.move(person, cell)
+        contacts += len(index.nearby(person, cell))
+    return (time.perf_counter() - started) / updates, contacts
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracker index memory and contact cost on a large sparse grid")
+    parser.add_argument('--grid', type=int, default=100_000, help="Grid side length")
+    parser.add_argument('--people', type=int, default=1_000_000)
+    parser.add_argument('--radius', type=int, nargs='+', default=[0, 2, 10])
+    parser.add_argument('--updates', type=int, default=100_000, help="Position updates timed per configuration")
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+
+    people = [f'person{i}' for i in range(args.people)]
+    print(f"{args.people:,} people on a {args.grid:,}x{args.grid:,} grid")
+    print(f"{'topology':<9} {'radius':>6} {'layout':<13} {'bytes/person':>13} {'us/update':>10} {'contacts':>9}")
+    for kind in ('bounded', 'toroidal'):
+        topology = Topology(args.grid, kind)
+        for radius in args.radius:
+            for label, index_class in (('set-per-cell', SetPerCellIndex), ('sparse', SpatialIndex)):
+                index, memory = build(index_class, topology, radius, people, args.seed)
+                cost, contacts = time_updates(index, topology, people, args.updates, args.seed)
+                print(f"{kind:<9} {radius:>6} {label:<13} {memory / args.people:>13.0f} {cost * 1e6:>10.2f} {contacts:>9}")
+                del index
+
+    walk = simulate.RandomWalk(args.people, Topology(args.grid, 'toroidal'), args.seed)
+    started = time.perf_counter()
+    walk.step()
+    print(f"Random walk step for {args.people:,} people: {(time.perf_counter() - started) * 1000:.1f}ms "
+          f"({'numpy' if simulate.np is not None else 'pure Python'})")
+
+if __name__ == '__main__':
+    main()
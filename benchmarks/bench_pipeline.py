@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+End-to-end throughput and latency of the contact tracing pipeline.
+
+Runs a ContactTracker on the in-process broker (TRANSPORT=local) and drives it
+with the simulation driver's random walk: --population people moving --tick-rate
+times a second on a --grid-size grid, plus a query client sending --query-rate
+queries a second (contacts, top and location queries in turn).
+
+Every --sample-interval seconds it records positions/s and contacts/s processed,
+the position queue depth and process RSS. At the end it reports per-call timings
+of process_position (the work behind track_position), record_contact and
+answer_query (the work behind handle_query), publish-to-detection latency and
+query round-trip percentiles. Everything is written to --output as JSON. The
+driver and broker share the tracker's process, so RSS includes them.
+
+Compare two result files, e.g. from two commits:
+    python benchmarks/bench_pipeline.py --compare old.json new.json
+
+Usage: python benchmarks/bench_pipeline.py [--population 2000] [--tick-rate 5] [--duration 30] [--output pipeline.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from metrics import LatencyHistogram
+
+CALL_BUCKETS = tuple(1e-6 * 2 ** i for i in range(24))  # 1us to ~8s, per-call timings are far below the default buckets
+TIMED_CALLS = ('process_position', 'record_contact', 'answer_query')
+COMPARED = (
+    ('positions_per_s', True), ('contacts_per_s', True), ('query_latency.p50', False), ('query_latency.p95', False),
+    ('query_latency.p99', False), ('detection_latency.p95', False), ('rss_peak_bytes', False)
+) + tuple((f'calls.{name}.{key}', False) for name in TIMED_CALLS for key in ('mean', 'p99'))
+
+def rss_bytes():
+    """Current resident set size, or the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def percentiles(values):
+    if not values:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q / 100))]
+    return {'count': len(values), 'mean': sum(values) / len(values), 'p50': pick(50), 'p95': pick(95),
+            'p99': pick(99), 'max': values[-1]}
+
+def timed(function, histogram):
+    """Wrap a tracker method so every call is observed in histogram"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+def drive_positions(simulation, tick_rate, stop_event, counter):
+    """Publish every agent's position once per tick until stop_event is set"""
+    interval = 1 / tick_rate if tick_rate > 0 else 0
+    next_tick = time.monotonic()
+    while not stop_event.is_set():
+        simulation.walk.step()
+        messages = simulation.tick_messages()
+        simulation.publish(messages)
+        counter[0] += len(messages) # Unsharded, one message per agent
+        next_tick += interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            stop_event.wait(delay)
+        else:
+            next_tick = time.monotonic()
+
+def drive_queries(transport, config, names, grid_size, query_rate, stop_event, latencies, timeouts, seed):
+    """Send queries at query_rate and time each until its last response chunk arrives"""
+    rng = random.Random(seed)
+    kinds = ('contacts', 'top', 'location')
+    sent = 0
+    while not stop_event.wait(1 / query_rate):
+        kind = kinds[sent % len(kinds)]
+        sent += 1
+        query_id = str(uuid.uuid4())
+        request = {'query_id': query_id, 'type': kind, 'query_person': rng.choice(names)}
+        if kind == 'top':
+            request['k'] = 5
+        elif kind == 'location':
+            request.update({'x': rng.randrange(grid_size), 'y': rng.randrange(grid_size)})
+
+        start = time.perf_counter()
+        transport.publish(config.ROUTING_KEY_QUERY, json.dumps(request))
+        received, expected = 0, 1
+        deadline = time.monotonic() + 5
+        while received < expected and time.monotonic() < deadline:
+            deliveries = transport.get(config.QUEUE_RESPONSE, 100)
+            if not deliveries:
+                transport.broker.wait(config.QUEUE_RESPONSE, timeout=0.05)
+            for delivery in deliveries:
+                body = json.loads(delivery.body)
+                if body.get('query_id') == query_id:
+                    received += 1
+                    expected = body.get('chunks', 1)
+        if received < expected:
+            timeouts[0] += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+
+def run(args):
+    store_dir = None if args.memory_only else tempfile.mkdtemp(prefix='bench_pipeline_')
+    os.environ.setdefault('RABBITMQ_USERNAME', 'guest')
+    os.environ.setdefault('RABBITMQ_PASSWORD', 'guest')
+    os.environ.update({
+        'TRANSPORT': 'local',
+        'RUNTIME': args.runtime,
+        'POSITION_BATCH_SIZE': str(args.batch_size),
+        'CONTACT_RADIUS': str(args.radius),
+        'GRID_SIZE': str(args.grid_size),
+        'CONTACT_STORE_DIR': store_dir or '',
+        'LATENCY_REPORT_INTERVAL': '0',
+        'METRICS_PORT': '0',
+        'SHARD_COLUMNS': '1',
+        'SHARD_ROWS': '1'
+    })
+
+    import query # The tracker modules need requests and dotenv, --compare does not
+    import simulate
+    import tracker
+    from transport import create_transport
+
+    contact_tracker = tracker.ContactTracker(tracker.Config())
+    if not args.log:
+        logging.disable(logging.INFO)
+    calls = {name: LatencyHistogram(CALL_BUCKETS) for name in TIMED_CALLS}
+    for name in TIMED_CALLS:
+        setattr(contact_tracker, name, timed(getattr(contact_tracker, name), calls[name]))
+
+    simulation = simulate.Simulation(simulate.Config(), args.population, args.tick_rate, args.grid_size, args.seed)
+    query_config = query.Config()
+    published = [0]
+    latencies, timeouts = [], [0]
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=contact_tracker.run, daemon=True),
+        threading.Thread(target=drive_positions, args=(simulation, args.tick_rate, stop_event, published), daemon=True),
+    ]
+    if args.query_rate > 0:
+        threads.append(threading.Thread(target=drive_queries, daemon=True, args=(
+            create_transport(query_config), query_config, simulation.names, args.grid_size,
+            args.query_rate, stop_event, latencies, timeouts, args.seed)))
+
+    samples = []
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    last = (start, 0, 0)
+    try:
+        while time.monotonic() - start < args.duration:
+            time.sleep(args.sample_interval)
+            now, processed, contacts = time.monotonic(), contact_tracker.detection_latency.count, len(contact_tracker.store)
+            elapsed = now - last[0]
+            sample = {
+                't': round(now - start, 3),
+                'positions_per_s': (processed - last[1]) / elapsed,
+                'contacts_per_s': (contacts - last[2]) / elapsed,
+                'queue_depth': contact_tracker.transport.broker.depth(contact_tracker.config.QUEUE_POSITION),
+                'rss_bytes': rss_bytes()
+            }
+            samples.append(sample)
+            last = (now, processed, contacts)
+            print(f"{sample['t']:7.1f}s {sample['positions_per_s']:10,.0f} positions/s {sample['contacts_per_s']:9,.0f} contacts/s "
+                  f"depth {sample['queue_depth']:8} rss {(sample['rss_bytes'] or 0) / 1e6:7.1f} MB")
+    finally:
+        stop_event.set()
+        drain_deadline = time.monotonic() + 30
+        while contact_tracker.detection_latency.count < published[0] and time.monotonic() < drain_deadline:
+            time.sleep(0.05)
+        elapsed = time.monotonic() - start
+        contact_tracker.shutdown()
+        for thread in threads:
+            thread.join(timeout=10)
+        logging.disable(logging.NOTSET)
+        simulation.transport.close()
+        if store_dir:
+            shutil.rmtree(store_dir, ignore_errors=True)
+
+    processed, contacts = contact_tracker.detection_latency.count, len(contact_tracker.store)
+    rss_samples = [sample['rss_bytes'] for sample in samples if sample['rss_bytes']]
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('compare', 'output')},
+        'summary': {
+            'elapsed_s': elapsed,
+            'positions_published': published[0],
+            'positions_processed': processed,
+            'positions_per_s': processed / elapsed,
+            'contacts': contacts,
+            'contacts_per_s': contacts / elapsed,
+            'detection_latency': contact_tracker.detection_latency.snapshot(),
+            'query_latency': dict(percentiles(latencies), timeouts=timeouts[0]),
+            'rss_peak_bytes': max(rss_samples) if rss_samples else None,
+            'calls': {name: histogram.snapshot() for name, histogram in calls.items()}
+        },
+        'samples': samples
+    }
+
+def lookup(summary, path):
+    value = summary
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+def compare(old_path, new_path):
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print(f"{'metric':<28} {old.get('commit') or old_path:>14} {new.get('commit') or new_path:>14} {'change':>9}")
+    for path, higher_is_better in COMPARED:
+        before, after = lookup(old['summary'], path), lookup(new['summary'], path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = '  worse' if worse and abs(change) >= 10 else ''
+        print(f"{path:<28} {before:14.6g} {after:14.6g} {change:+8.1f}%{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--population', type=int, default=2000)
+    parser.add_argument('--tick-rate', type=float, default=5.0, help='Moves per person per second (0 runs flat out)')
+    parser.add_argument('--grid-size', type=int, default=100)
+    parser.add_argument('--radius', type=int, default=0, help='CONTACT_RADIUS')
+    parser.add_argument('--query-rate', type=float, default=5.0, help='Queries per second (0 disables)')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load')
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--runtime', choices=('threads', 'asyncio'), default='threads')
+    parser.add_argument('--batch-size', type=int, default=1, help='POSITION_BATCH_SIZE')
+    parser.add_argument('--memory-only', action='store_true', help='Do not persist contacts to a temporary store')
+    parser.add_argument('--log', action='store_true', help='Keep the per-position INFO logging')
+    parser.add_argument('--seed', type=int, default=205)
+    parser.add_argument('--output', default='pipeline.json', help='Result file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args)
+    summary = results['summary']
+    query_latency = summary['query_latency']
+    print(f"\n{summary['positions_processed']}/{summary['positions_published']} positions in {summary['elapsed_s']:.1f}s: "
+          f"{summary['positions_per_s']:,.0f} positions/s, {summary['contacts_per_s']:,.0f} contacts/s")
+    if query_latency['count']:
+        print(f"query latency: p50 {query_latency['p50'] * 1000:.2f} ms, p95 {query_latency['p95'] * 1000:.2f} ms, "
+              f"p99 {query_latency['p99'] * 1000:.2f} ms ({query_latency['timeouts']} timeouts)")
+    for name, snapshot in summary['calls'].items():
+        if snapshot['count']:
+            print(f"{name:>16}: {snapshot['count']:9} calls, mean {snapshot['mean'] * 1e6:8.1f} us, p99 {snapshot['p99'] * 1e6:8.1f} us")
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f"results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Repeated query cost with and without the tracker's query cache (QUERY_CACHE_BYTES).
+
+Records --contacts encounters for --heavy heavy-contact people among --people
+people, then sends each heavy person's contacts and top queries --repeats times
+through ContactTracker.answer_query, which builds the response chunks, then
+encodes the chunks for publishing as process_query does. With --churn, every
+round records a new contact for one heavy person, so their cached answers are
+invalidated and rebuilt. Reports the mean and median time per query, the hit
+rate and how many chunks were serialized.
+
+Usage: python benchmarks/bench_query_cache.py [--contacts 200000] [--repeats 20]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+os.environ.setdefault('RABBITMQ_USERNAME', 'guest')
+os.environ.setdefault('RABBITMQ_PASSWORD', 'guest')
+os.environ['TRANSPORT'] = 'local'
+os.environ['CONTACT_STORE_DIR'] = '' # In memory only
+os.environ['METRICS_PORT'] = '0'
+os.environ['CONTACT_COMPACT_INTERVAL'] = '0'
+
+import tracker
+
+class CountingJson:
+    """Stands in for tracker's json module and counts the chunks it serializes"""
+
+    def __init__(self):
+        self.dumps_calls = 0
+        self.loads = json.loads
+
+    def dumps(self, obj, **kwargs):
+        self.dumps_calls += 1
+        return json.dumps(obj, **kwargs)
+
+def build_tracker(cache_bytes, args):
+    os.environ['QUERY_CACHE_BYTES'] = str(cache_bytes)
+    contact_tracker = tracker.ContactTracker(tracker.Config())
+    rng = random.Random(args.seed)
+    start = time.time() - args.contacts
+    for i in range(args.contacts):
+        person = f'heavy{rng.randrange(args.heavy)}'
+        contact_tracker.store.record(person, f'person{rng.randrange(args.people)}',
+                                     (rng.randrange(100), rng.randrange(100)), start + i)
+    return contact_tracker
+
+def run(cache_bytes, args):
+    contact_tracker = build_tracker(cache_bytes, args)
+    counting = tracker.json = CountingJson()
+    queries = [{'type': query_type, 'query_person': f'heavy{person}'}
+               for person in range(args.heavy) for query_type in ('contacts', 'top')]
+    logging.disable(logging.INFO)
+    timings, query_id = [], 0
+    try:
+        for round_number in range(args.repeats):
+            if args.churn: # A new contact for one heavy person invalidates their cached answers
+                contact_tracker.record_contact(f'heavy{round_number % args.heavy}', 'newcomer', (0, 0), [])
+            for query in queries:
+                query_id += 1
+                message = json.dumps(dict(query, query_id=f'q{query_id}'))
+                started = time.perf_counter()
+                for response in contact_tracker.answer_query(message):
+                    contact_tracker.encode_message(*response)
+                timings.append(time.perf_counter() - started)
+    finally:
+        logging.disable(logging.NOTSET)
+        tracker.json = json
+        contact_tracker.store.close()
+    hits = contact_tracker.query_cache_hits_total.value
+    timings.sort()
+    return {
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'median_ms': timings[len(timings) // 2] * 1000,
+        'hit_rate': hits / len(timings),
+        'serialized': counting.dumps_calls,
+        'cache_bytes': contact_tracker.query_cache.bytes
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Repeated query cost with and without the query cache")
+    parser.add_argument('--contacts', type=int, default=200000)
+    parser.add_argument('--people', type=int, default=50000)
+    parser.add_argument('--heavy', type=int, default=10, help="People the contacts are spread over")
+    parser.add_argument('--repeats', type=int, default=20, help="Times each query is sent")
+    parser.add_argument('--churn', action='store_true', help="Record a contact for one heavy person every round")
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+
+    print(f"{args.contacts} contacts over {args.heavy} heavy people, {args.repeats} rounds of contacts and top queries"
+          f"{' with churn' if args.churn else ''}")
+    print(f"{'cache':<6} {'mean':>10} {'median':>10} {'hit rate':>9} {'chunks serialized':>18} {'cache size':>11}")
+    for label, cache_bytes in (('off', 0), ('on', 256 * 1024 * 1024)):
+        result = run(cache_bytes, args)
+        print(f"{label:<6} {result['mean_ms']:>8.3f}ms {result['median_ms']:>8.3f}ms {result['hit_rate']:>8.0%} "
+              f"{result['serialized']:>18} {result['cache_bytes'] / 1e6:>9.1f}MB")
+
+if __name__ == '__main__':
+    main()
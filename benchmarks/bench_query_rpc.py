@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Query round-trip latency under concurrency: correlated replies versus the old polling loop.
+
+Starts a tracker on the in-process broker with --contacts recorded contacts, then
+sends --queries queries in waves of --concurrency at a time.
+  - rpc:    one QueryClient sends every query in a wave and waits for them all.
+            Replies come back on the client's own queue, matched by correlation_id
+  - legacy: one thread per query in a wave, each publishing without reply_to and
+            polling the shared query_response_queue once a second. As query.py
+            used to do, a response for a different query is consumed and discarded
+Reports the round-trip latency percentiles, queries/s and how many queries never
+got their answer (legacy waits at most --legacy-timeout seconds per query).
+
+Usage: python benchmarks/bench_query_rpc.py [--queries 2000] [--concurrency 1 16 128]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+os.environ.setdefault('RABBITMQ_USERNAME', 'guest')
+os.environ.setdefault('RABBITMQ_PASSWORD', 'guest')
+os.environ['TRANSPORT'] = 'local'
+os.environ['CONTACT_STORE_DIR'] = '' # In memory only
+os.environ['METRICS_PORT'] = '0'
+os.environ['LATENCY_REPORT_INTERVAL'] = '0'
+os.environ['RUNTIME'] = 'threads'
+
+import query
+import tracker
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+def start_tracker(args):
+    contact_tracker = tracker.ContactTracker(tracker.Config())
+    rng = random.Random(args.seed)
+    now = time.time() - args.contacts
+    for i in range(args.contacts):
+        contact_tracker.store.record(f'person{rng.randrange(args.people)}', f'person{rng.randrange(args.people)}',
+                                     (rng.randrange(100), rng.randrange(100)), now + i)
+    thread = threading.Thread(target=contact_tracker.run)
+    thread.start()
+    return contact_tracker, thread
+
+def run_rpc(config, people, waves, concurrency):
+    latencies, lost = [], 0
+    with query.QueryClient(config) as client:
+        for _ in range(waves):
+            sent = [(time.perf_counter(), client.send(f'person{random.randrange(people)}')) for _ in range(concurrency)]
+            for started, pending in sent:
+                body = pending.result()
+                if 'error' in body:
+                    lost += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+    return latencies, lost
+
+def legacy_query(config, transport, person, timeout):
+    """query.py's former publish_query and collect_response, for a single unsharded chunk"""
+    query_id = str(uuid.uuid4())
+    transport.publish(config.ROUTING_KEY_QUERY, json.dumps({'query_id': query_id, 'query_person': person}))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        deliveries = transport.get(config.QUEUE_RESPONSE, count=1)
+        if deliveries and json.loads(deliveries[0].body).get('query_id') == query_id:
+            return True
+        time.sleep(1) # Any other query's response was consumed above and is lost
+    return False
+
+def run_legacy(config, people, waves, concurrency, timeout):
+    latencies, lost = [], [0]
+    transport = query.create_transport(config)
+
+    def one():
+        started = time.perf_counter()
+        if legacy_query(config, transport, f'person{random.randrange(people)}', timeout):
+            latencies.append(time.perf_counter() - started)
+        else:
+            lost[0] += 1
+
+    for _ in range(waves):
+        threads = [threading.Thread(target=one) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return latencies, lost[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Query round-trip latency under concurrency")
+    parser.add_argument('--queries', type=int, default=2000, help="Queries per concurrency level for rpc")
+    parser.add_argument('--legacy-queries', type=int, default=64, help="Queries per concurrency level for legacy")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 128])
+    parser.add_argument('--contacts', type=int, default=20000)
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument('--legacy-timeout', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+
+    contact_tracker, thread = start_tracker(args)
+    logging.disable(logging.INFO)
+    config = query.Config()
+    print(f"{'client':<7} {'concurrent':>10} {'queries':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'queries/s':>10} {'lost':>6}")
+    try:
+        for mode, total in (('rpc', args.queries), ('legacy', args.legacy_queries)):
+            for concurrency in args.concurrency:
+                waves = max(1, total // concurrency)
+                started = time.perf_counter()
+                if mode == 'rpc':
+                    latencies, lost = run_rpc(config, args.people, waves, concurrency)
+                else:
+                    latencies, lost = run_legacy(config, args.people, waves, concurrency, args.legacy_timeout)
+                elapsed = time.perf_counter() - started
+                latencies.sort()
+                print(f"{mode:<7} {concurrency:>10} {waves * concurrency:>8} {percentile(latencies, 0.5) * 1000:>7.1f}ms "
+                      f"{percentile(latencies, 0.95) * 1000:>7.1f}ms {percentile(latencies, 0.99) * 1000:>7.1f}ms "
+                      f"{waves * concurrency / elapsed:>10.0f} {lost:>6}")
+    finally:
+        contact_tracker.shutdown()
+        thread.join()
+        logging.disable(logging.NOTSET)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Sharded trackers against one unsharded tracker on the same position stream.
+
+Builds one ContactTracker per region of a --columns x --rows partition and one
+unsharded tracker, then feeds both the same updates on a simulated clock: each
+update goes to the unsharded tracker as it is, and to the shards as the primary,
+ghost and leave messages sharding.position_messages builds for it. Two runs:
+  - boundary: pairs standing still on either side of every region boundary,
+    which must give exactly the unsharded encounters
+  - walk: --people people on a random walk for --ticks ticks. Every contact must
+    be found, with the same sighting times, but an encounter whose pair crosses
+    into another region together is split between the two shards' stores
+Reports the encounters stored and the time per update, and fails if the shards
+record a pair twice at once, miss one, or disagree on when they were together.
+
+Usage: python benchmarks/bench_sharding.py [--grid 20] [--columns 2] [--rows 2] [--radius 1] [--people 60] [--ticks 200]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+START = 1_700_000_000  # Simulated clock, one tick a second
+
+def make_trackers(args):
+    """Return (unsharded tracker, list of shard trackers)"""
+    import tracker
+    os.environ.setdefault('RABBITMQ_USERNAME', 'guest')
+    os.environ.setdefault('RABBITMQ_PASSWORD', 'guest')
+    os.environ.update({
+        'TRANSPORT': 'local', 'CONTACT_STORE_DIR': '', 'METRICS_PORT': '0', 'POSITION_TTL': '0',
+        'CONTACT_COMPACT_INTERVAL': '0', 'CONTACT_MIN_DWELL': '0', 'CONTACT_MERGE_GAP': str(args.merge_gap),
+        'GRID_SIZE': str(args.grid), 'CONTACT_RADIUS': str(args.radius), 'GRID_TOPOLOGY': args.topology,
+        'SHARD_COLUMNS': '1', 'SHARD_ROWS': '1', 'TRACKER_SHARD': ''
+    })
+    single = tracker.ContactTracker(tracker.Config())
+    shards = []
+    for shard in range(args.columns * args.rows):
+        config = tracker.Config()
+        config.SHARD_COLUMNS, config.SHARD_ROWS = args.columns, args.rows
+        config.use_shard(shard)
+        shards.append(tracker.ContactTracker(config))
+    return single, shards
+
+def feed(single, shards, moves, partition, clock):
+    """Apply (tick, person, position) moves to both setups, returns seconds spent in each"""
+    from sharding import position_messages
+    from wire import encode_position
+    held = {}  # Person -> regions holding them, as a Person keeps it
+    seqs = {}
+    spent = [0.0, 0.0]
+    routing_key = 'position'  # Only the region suffix is used here
+    for tick, person, (x, y) in moves:
+        clock.now = START + tick
+        seq = seqs[person] = seqs.get(person, 0) + 1
+        body, _ = encode_position('json', person, x, y, clock.now, seq)
+        started = time.perf_counter()
+        single.apply_position(body, [])
+        spent[0] += time.perf_counter() - started
+        messages, held[person] = position_messages(partition, routing_key, person, (x, y), clock.now,
+                                                   held.get(person, set()), seq)
+        started = time.perf_counter()
+        for key, body, _ in messages:
+            shards[int(key.rsplit('.', 1)[1])].apply_position(body, [])
+        spent[1] += time.perf_counter() - started
+    for tracker in [single] + shards:
+        tracker.close_encounters()
+    return spent
+
+def encounters(stores, people, timestamp_format):
+    """Pair -> sorted (start, end) encounters held by the stores"""
+    parse = lambda text: int(datetime.strptime(text, timestamp_format).timestamp())
+    found = {}
+    for store in stores:
+        for person in people:
+            for contact, entry in store.contacts_of(person).items():
+                if person < contact:
+                    found.setdefault((person, contact), []).extend(
+                        (parse(start), parse(end)) for _, _, start, end in entry['locations'])
+    return {pair: sorted(intervals) for pair, intervals in found.items()}
+
+def together(intervals, gap):
+    """Coalesce encounters less than gap apart, the time a pair spent together whichever store split it"""
+    merged = []
+    for start, end in intervals:
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def check(name, args, moves, people, exact):
+    from sharding import GridPartition
+    single, shards = make_trackers(args)
+    partition = GridPartition(args.grid, args.columns, args.rows, args.radius, args.topology == 'toroidal')
+    clock = mock.Mock(now=START)
+    with mock.patch('time.time', lambda: clock.now):
+        spent = feed(single, shards, moves, partition, clock)
+    timestamp_format = single.config.TIMESTAMP_FORMAT
+    expected = encounters([single.store], people, timestamp_format)
+    actual = encounters([shard.store for shard in shards], people, timestamp_format)
+    stored = (sum(map(len, expected.values())), sum(map(len, actual.values())))
+    print(f"{name:<9} {len(moves):>8} {stored[0]:>10} {stored[1]:>10} "
+          f"{spent[0] / len(moves) * 1e6:>12.1f} {spent[1] / len(moves) * 1e6:>12.1f}")
+
+    assert expected.keys() == actual.keys(), f"{name}: sharded pairs differ by {set(expected) ^ set(actual)}"
+    for pair, intervals in actual.items():
+        for (_, end), (start, _) in zip(intervals, intervals[1:]):
+            # A handoff within one tick ends one shard's encounter at the second the next shard's starts
+            assert start >= end, f"{name}: {pair} recorded twice at once by the shards"
+        if exact:
+            assert intervals == expected[pair], f"{name}: {pair} {intervals} != unsharded {expected[pair]}"
+        else:
+            assert together(intervals, args.merge_gap) == together(expected[pair], args.merge_gap), \
+                f"{name}: {pair} together {together(intervals, args.merge_gap)} != unsharded {together(expected[pair], args.merge_gap)}"
+
+def boundary_moves(args):
+    """Pairs either side of each region boundary, each person republishing where they stand"""
+    moves, people = [], []
+    columns = {args.grid * column // args.columns for column in range(1, args.columns)}
+    rows = {args.grid * row // args.rows for row in range(1, args.rows)}
+    cells = [((x - 1, y), (x, y)) for x in columns for y in range(0, args.grid, 3)]
+    cells += [((x, y - 1), (x, y)) for y in rows for x in range(1, args.grid, 3)]
+    for number, (a, b) in enumerate(cells):
+        people += [f'a{number}', f'b{number}']
+    for tick in range(args.ticks // 10 or 1):
+        for number, (a, b) in enumerate(cells):
+            moves += [(tick, f'a{number}', a), (tick, f'b{number}', b)]
+    return moves, people
+
+def walk_moves(args):
+    from topology import Topology
+    rng = random.Random(args.seed)
+    topology = Topology(args.grid, args.topology)
+    people = [f'person{i}' for i in range(args.people)]
+    positions = {person: topology.random_cell(rng) for person in people}
+    moves = []
+    for tick in range(args.ticks):
+        for person in people:
+            positions[person] = topology.step(*positions[person], rng.choice((-1, 0, 1)), rng.choice((-1, 0, 1)))
+            moves.append((tick, person, positions[person]))
+    return moves, people
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded against unsharded contact tracking on one position stream")
+    parser.add_argument('--grid', type=int, default=20, help="Grid side length")
+    parser.add_argument('--columns', type=int, default=2, help="SHARD_COLUMNS")
+    parser.add_argument('--rows', type=int, default=2, help="SHARD_ROWS")
+    parser.add_argument('--radius', type=int, default=1, help="CONTACT_RADIUS")
+    parser.add_argument('--topology', choices=('bounded', 'toroidal'), default='bounded')
+    parser.add_argument('--merge-gap', type=float, default=5.0, help="CONTACT_MERGE_GAP")
+    parser.add_argument('--people', type=int, default=60)
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{args.columns}x{args.rows} shards on a {args.grid}x{args.grid} {args.topology} grid, radius {args.radius}")
+    print(f"{'run':<9} {'updates':>8} {'unsharded':>10} {'sharded':>10} {'us/update 1':>12} {'us/update N':>12}")
+    check('boundary', args, *boundary_moves(args), exact=True)
+    check('walk', args, *walk_moves(args), exact=False)
+    print("Sharded trackers found every contact once")
+
+if __name__ == '__main__':
+    main()
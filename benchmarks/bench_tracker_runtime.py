@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+End-to-end tracker throughput on one core: the threaded runtime versus RUNTIME=asyncio.
+
+Pre-loads --positions position updates for --people people on a --grid x --grid
+grid into the in-process broker, starts a tracker and times until every position
+has been processed and every contact notification published (shutdown drains
+in-flight work). Each publish or bulk publish waits --publish-rtt seconds, standing
+in for the broker round trip of a confirmed AMQP publish or transaction commit.
+Per-position INFO logging is disabled so the runtimes rather than the log
+handlers are measured.
+
+Usage: python benchmarks/bench_tracker_runtime.py [--positions 100000] [--batch-size 100]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+os.environ.setdefault('RABBITMQ_USERNAME', 'guest')
+os.environ.setdefault('RABBITMQ_PASSWORD', 'guest')
+os.environ['TRANSPORT'] = 'local'
+os.environ['CONTACT_STORE_DIR'] = '' # In memory only
+os.environ['LATENCY_REPORT_INTERVAL'] = '0'
+os.environ['METRICS_PORT'] = '0'
+
+import tracker
+import transport
+
+class RoundTripTransport(transport.LocalTransport):
+    """LocalTransport whose publishes block for a fixed round trip, releasing the GIL like a socket wait.
+       A bulk publish costs one round trip, like the AMQP transport's transactional batches."""
+    rtt = 0.0
+
+    def publish(self, routing_key, body, properties=None, exchange=None):
+        time.sleep(self.rtt)
+        super().publish(routing_key, body, properties, exchange)
+
+    def publish_batch(self, messages):
+        time.sleep(self.rtt)
+        for routing_key, body, properties in messages:
+            super().publish(routing_key, body, properties)
+
+def load_positions(config, count, people, grid, seed):
+    rng = random.Random(seed)
+    publisher = transport.LocalTransport(config.EXCHANGE_NAME)
+    now = time.time()
+    for seq in range(count):
+        body = json.dumps({'person': f'person{rng.randrange(people)}', 'x': rng.randrange(grid),
+                           'y': rng.randrange(grid), 'ts': now, 'seq': seq})
+        publisher.publish('position', body, {'content_type': 'application/json'})
+
+def run(runtime, batch_size, args):
+    os.environ['RUNTIME'] = runtime
+    os.environ['POSITION_BATCH_SIZE'] = str(batch_size)
+    config = tracker.Config()
+    contact_tracker = tracker.ContactTracker(config)
+    logging.disable(logging.INFO)
+    contact_tracker.transport = RoundTripTransport(config.EXCHANGE_NAME)
+    contact_tracker.transport.rtt = args.publish_rtt
+    load_positions(config, args.positions, args.people, args.grid, args.seed)
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=contact_tracker.run)
+    thread.start()
+    while contact_tracker.detection_latency.count < args.positions:
+        time.sleep(0.01)
+    contact_tracker.shutdown()
+    thread.join()
+    elapsed = time.perf_counter() - start
+    logging.disable(logging.NOTSET)
+    return elapsed, len(contact_tracker.store)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--positions', type=int, default=100_000)
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument('--grid', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=100, help='POSITION_BATCH_SIZE for the batched runs')
+    parser.add_argument('--publish-rtt', type=float, default=0.0001, help='Seconds each publish waits')
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))}) # One core
+
+    print(f"{args.positions} positions, {args.people} people on a {args.grid}x{args.grid} grid, "
+          f"{args.publish_rtt * 1e6:.0f}us publish round trip")
+    for runtime, batch_size in (('threads', 1), ('threads', args.batch_size), ('asyncio', 1), ('asyncio', args.batch_size)):
+        elapsed, contacts = run(runtime, batch_size, args)
+        print(f"{runtime:>8} batch {batch_size:>4}: {elapsed:6.2f}s, {args.positions / elapsed:9,.0f} positions/s, "
+              f"{contacts} contacts")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Encode and decode cost and size of the position and notification wire formats.
+
+Times wire.py's JSON and binary encodings of typical messages and reports the
+bytes per message body, plus the size of the HTTP management API publish
+envelope that wraps it (binary bodies are base64 encoded there). Then sends a
+sample of each format through HttpTransport and a local stand-in for the
+management API's publish and /get endpoints, and checks every message decodes
+back to what was sent.
+
+Usage: python benchmarks/bench_wire.py [--messages 200000]
+"""
+import argparse
+import base64
+import gc
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from transport import HttpTransport
+from wire import WIRE_FORMATS, decode_notification, decode_position, encode_notification, encode_position
+
+def sample_positions(count, rng):
+    now = time.time()
+    return [
+        (f'person{rng.randrange(100000)}', rng.randrange(1000), rng.randrange(1000), now + i / 1000, 1_700_000_000_000 + i)
+        for i in range(count)
+    ]
+
+def sample_notifications(count, rng):
+    return [
+        {
+            'person': f'person{rng.randrange(100000)}',
+            'contact_person': f'person{rng.randrange(100000)}',
+            'location': (rng.randrange(1000), rng.randrange(1000)),
+            'timestamp': '17-10-2026 12:00:00'
+        }
+        for _ in range(count)
+    ]
+
+def http_envelope_size(body):
+    # Size of the management API publish request body, as built by HttpTransport.publish
+    if isinstance(body, bytes):
+        payload, encoding = base64.b64encode(body).decode('ascii'), 'base64'
+    else:
+        payload, encoding = body, 'string'
+    return len(json.dumps({'properties': {}, 'routing_key': 'position', 'payload': payload, 'payload_encoding': encoding}))
+
+def body_size(body):
+    return len(body.encode('utf-8') if isinstance(body, str) else body)
+
+def bench(encode, decode, messages):
+    gc.disable() # Keeping every decoded message alive would otherwise time cyclic GC passes rather than the codecs
+    try:
+        start = time.perf_counter()
+        bodies = [encode(message)[0] for message in messages]
+        encoded = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = [decode(body) for body in bodies]
+        decode_time = time.perf_counter() - start
+    finally:
+        gc.enable()
+    sizes = [body_size(body) for body in bodies]
+    envelopes = [http_envelope_size(body) for body in bodies[:1000]]
+    return {
+        'encode_us': encoded / len(messages) * 1e6,
+        'decode_us': decode_time / len(messages) * 1e6,
+        'bytes': sum(sizes) / len(sizes),
+        'http_bytes': sum(envelopes) / len(envelopes),
+        'decoded': decoded
+    }
+
+class ManagementApi(BaseHTTPRequestHandler):
+    """Stand-in for the publish and /get endpoints, queues are keyed by routing key.
+    /get answers like RabbitMQ: 'auto' returns a body as text whenever it is valid UTF-8."""
+    queues = defaultdict(deque)
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('content-length', 0))))
+        parts = self.path.split('/')
+        if parts[-1] == 'publish':
+            payload = request['payload']
+            body = base64.b64decode(payload) if request['payload_encoding'] == 'base64' else payload.encode('utf-8')
+            self.queues[request['routing_key']].append(body)
+            self.reply({'routed': True})
+            return
+        queue = self.queues[parts[-2]]
+        messages = []
+        for body in [queue.popleft() for _ in range(min(request['count'], len(queue)))]:
+            try:
+                if request['encoding'] != 'auto':
+                    raise UnicodeDecodeError('utf-8', body, 0, 0, 'base64 requested')
+                payload, encoding = body.decode('utf-8'), 'string'
+            except UnicodeDecodeError:
+                payload, encoding = base64.b64encode(body).decode('ascii'), 'base64'
+            messages.append({'payload': payload, 'payload_encoding': encoding, 'routing_key': parts[-2], 'properties': {}})
+        self.reply(messages)
+
+    def reply(self, message):
+        body = json.dumps(message).encode('utf-8')
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def http_round_trip(cases, count=200):
+    """Publish count messages of every case and format through HttpTransport, get them back and decode them"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ManagementApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = HttpTransport(f'http://127.0.0.1:{server.server_address[1]}/api', 'guest', 'guest', 'bench')
+    try:
+        for name, messages, encoder, decoder in cases:
+            for wire_format in WIRE_FORMATS:
+                encode = encoder(wire_format)
+                expected = [decoder(encode(message)[0]) for message in messages[:count]]
+                queue = f'{name}-{wire_format}'
+                for message in messages[:count]:
+                    transport.publish(queue, *encode(message))
+                received = [decoder(delivery.body) for delivery in transport.get(queue, count)]
+                assert received == expected, f"{name} {wire_format} messages changed on the way through HttpTransport"
+    finally:
+        transport.close()
+        server.shutdown()
+    print(f"HttpTransport round trip: {count} messages per case and format decoded intact")
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire format encode/decode cost and size")
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=205)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    positions = sample_positions(args.messages, rng)
+    notifications = sample_notifications(args.messages, rng)
+    cases = [
+        ('position', positions,
+         lambda wire_format: lambda p: encode_position(wire_format, p[0], p[1], p[2], p[3], p[4]), decode_position),
+        ('notification', notifications,
+         lambda wire_format: lambda n: encode_notification(wire_format, n), decode_notification),
+    ]
+
+    print(f"{args.messages} messages per case")
+    print(f"{'message':<13} {'format':<7} {'encode':>10} {'decode':>10} {'body':>10} {'http body':>10}")
+    for name, messages, encoder, decoder in cases:
+        results = {}
+        for wire_format in WIRE_FORMATS:
+            result = results[wire_format] = bench(encoder(wire_format), decoder, messages)
+            print(f"{name:<13} {wire_format:<7} {result['encode_us']:>8.2f}us {result['decode_us']:>8.2f}us "
+                  f"{result['bytes']:>8.1f}B {result['http_bytes']:>8.1f}B")
+        # Both formats must decode to the same message
+        assert results['json']['decoded'][:1000] == results['binary']['decoded'][:1000], f"{name} formats disagree"
+    http_round_trip(cases)
+
+if __name__ == '__main__':
+    main()
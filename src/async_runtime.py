@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+asyncio runtime for the contact tracker, selected with RUNTIME=asyncio.
+
+Replaces the position and query threads with coroutines joined by bounded queues:
+  ingest (position queue) -> detect -> notify
+  ingest (query queue)    -> serve  -> notify
+
+Only detect mutates the spatial index and the contact store, and serve runs on the
+same event loop, so tracker state is never touched by two tasks at once. Transport
+calls block, so each consumer and the publisher run on their own worker thread and
+hand work to the loop. A full queue blocks the consumer before it acknowledges the
+batch, so the broker stops delivering once PREFETCH_COUNT messages are outstanding.
+The publisher coalesces every notification waiting in the queue into one bulk
+publish, and detection keeps running while it waits on the broker.
+
+On shutdown the consumers stop first, then every queued position, query and
+notification is processed and published before run() returns.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from transport import Delivery
+
+DONE = None  # Queue sentinel, the producer has finished
+
+class AsyncTrackerRuntime:
+    def __init__(self, tracker, queue_size: int = 100, publish_batch_size: int = 1000):
+        self.tracker = tracker
+        self.config = tracker.config
+        self.queue_size = queue_size  # Batches held between two stages before the earlier stage waits
+        self.publish_batch_size = publish_batch_size  # Most notifications coalesced into one bulk publish
+
+    async def run(self):
+        """Run every stage until the tracker's shutdown_event is set and the queues have drained"""
+        config = self.config
+        positions = asyncio.Queue(self.queue_size)  # Lists of position deliveries
+        queries = asyncio.Queue(self.queue_size)  # Lists of query deliveries, their reply_to says where the answer goes
+        outbox = asyncio.Queue(self.queue_size)  # Lists of (routing_key, message[, properties]) to publish
+        consumers = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tracker-consumer')
+        publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tracker-publisher')
+
+        notifier = asyncio.ensure_future(self.notify(outbox, publisher))
+        try:
+            await asyncio.gather(
+                # Takes whatever positions have arrived, up to the prefetch window, and only
+                # lingers for a batch to fill when POSITION_BATCH_SIZE asks for batching
+                self.ingest(config.QUEUE_POSITION, positions, consumers,
+                            max(config.POSITION_BATCH_SIZE, config.PREFETCH_COUNT),
+                            config.POSITION_BATCH_LINGER if config.POSITION_BATCH_SIZE > 1 else 0, "position"),
+                self.ingest(config.QUEUE_QUERY, queries, consumers, 1, 0, "query"),
+                self.detect(positions, outbox),
+                self.serve(queries, outbox),
+                self.report_latency()
+            )
+        finally:
+            await outbox.put(DONE)
+            await notifier
+            consumers.shutdown()
+            publisher.shutdown()
+
+    async def ingest(self, queue_name: str, queue: asyncio.Queue, executor: ThreadPoolExecutor,
+                     batch_size: int, linger: float, name: str):
+        """Consume queue_name on a worker thread and pass each batch of deliveries into queue"""
+        loop = asyncio.get_running_loop()
+        shutdown_event = self.tracker.shutdown_event
+
+        def on_batch(deliveries: List[Delivery]):
+            # Runs on the consumer thread, waits while the queue is full
+            asyncio.run_coroutine_threadsafe(queue.put(list(deliveries)), loop).result()
+
+        try:
+            while not shutdown_event.is_set():
+                with self.tracker.error_handling(f"{name} consumer"):
+                    await loop.run_in_executor(executor, self.tracker.transport.consume_batch, queue_name, on_batch,
+                                               shutdown_event, batch_size, linger, self.config.PREFETCH_COUNT)
+                if not shutdown_event.is_set():
+                    await asyncio.sleep(1) # Back off before reconnecting
+        finally:
+            await queue.put(DONE)
+
+    async def detect(self, positions: asyncio.Queue, outbox: asyncio.Queue):
+        """Apply position batches to the tracker state and queue their contact notifications"""
+        while True:
+            deliveries = await positions.get()
+            if deliveries is DONE:
+                return
+            notifications = []
+            for delivery in deliveries:
+                with self.tracker.error_handling("processing position"):
+                    self.tracker.process_position(delivery.body, notifications)
+            if notifications:
+                await outbox.put(notifications)
+            await asyncio.sleep(0) # Let the other stages run between batches
+
+    async def serve(self, queries: asyncio.Queue, outbox: asyncio.Queue):
+        """Answer queries between detection batches and queue their response chunks"""
+        while True:
+            deliveries = await queries.get()
+            if deliveries is DONE:
+                return
+            for delivery in deliveries:
+                with self.tracker.error_handling("processing query"):
+                    await outbox.put(self.tracker.answer_query(delivery.body, delivery.properties))
+
+    async def notify(self, outbox: asyncio.Queue, executor: ThreadPoolExecutor):
+        """Publish queued messages, coalescing whatever is waiting into one bulk publish"""
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            messages = await outbox.get()
+            if messages is DONE:
+                return
+            messages = list(messages)
+            while len(messages) < self.publish_batch_size and not outbox.empty():
+                more = outbox.get_nowait()
+                if more is DONE:
+                    finished = True
+                    break
+                messages.extend(more)
+            await loop.run_in_executor(executor, self.tracker.publish_messages, messages)
+
+    async def report_latency(self):
+        """Log detection latency every LATENCY_REPORT_INTERVAL seconds until shutdown"""
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while not self.tracker.shutdown_event.is_set():
+            await asyncio.sleep(0.1)
+            interval = self.config.LATENCY_REPORT_INTERVAL
+            if interval and loop.time() - last_report >= interval:
+                self.tracker.report_latency()
+                last_report = loop.time()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Contact graph with time-ordered edges for transitive exposure queries.
+
+Edges are the rows of the contact store's encounter table, by row number (see
+EncounterTable.index for where a row sits in the columns). Each person has an
+array of the rows they appear in, in start time order. An encounter lasts from its start to its end, so the edges overlapping a
+time window are a bisect away: rows starting before the window are only looked
+at as far back as the person's longest encounter.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+EMPTY_ROWS = array('I')
+
+class Exposure:
+    """How and when a person could first have been exposed"""
+    __slots__ = ('person', 'time', 'hops', 'via')
+
+    def __init__(self, person, time: int, hops: int, via):
+        self.person = person
+        self.time = time  # Earliest time the exposure could have reached this person
+        self.hops = hops  # Contacts between the source and this person on that earliest path
+        self.via = via  # Previous person on that path
+
+class ContactGraph:
+    def __init__(self, table):
+        self.table = table  # EncounterTable whose rows are the edges
+        self.rows: Dict[int, array] = {}  # Person id -> encounter rows in start time order
+        self.spans: Dict[int, int] = {}  # Person id -> longest encounter (end - start) among their rows
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def add(self, row: int, person1: int, person2: int):
+        """Add encounter row as an undirected edge between person1 and person2"""
+        for person in (person1, person2):
+            rows = self.rows.get(person)
+            if rows is None:
+                rows = self.rows[person] = array('I')
+            rows.append(row)
+        self.widen(row)
+
+    def widen(self, row: int):
+        """Account for the duration of row, call again once its end is set"""
+        table, spans = self.table, self.spans
+        i = table.index(row)
+        span = table.end[i] - table.ts[i]
+        for person in (table.person1[i], table.person2[i]):
+            if span > spans.get(person, 0):
+                spans[person] = span
+
+    def rows_between(self, person: int, start: Optional[int] = None, end: Optional[int] = None) -> Sequence[int]:
+        """Return person's encounters overlapping start..end, in start time order"""
+        return overlapping(self.rows.get(person, EMPTY_ROWS), self.table, start, end, self.spans.get(person, 0))
+
+    def expand(self, sources: Dict[int, int], until: Optional[int] = None) -> Dict[int, Tuple[int, int]]:
+        """
+        One hop of exposure: for each source exposed at sources[source], everyone they
+        were in contact with at or after that time, including encounters already under
+        way then. A contact is exposed from the later of the encounter's start and the
+        source's exposure. Returns {contact: (earliest time, source)}.
+        """
+        table = self.table
+        person1, person2, times = table.person1, table.person2, table.ts
+        base, split, tail = table.base, table.split, table.base + table.gap
+        reached: Dict[int, Tuple[int, int]] = {}
+        for source, since in sources.items():
+            seen = set()
+            for row in self.rows_between(source, since, until):
+                i = row - base if row < split else row - tail
+                contact = person2[i] if person1[i] == source else person1[i]
+                if contact in seen:
+                    continue # Later edges to the same contact can't give an earlier exposure
+                seen.add(contact)
+                ts = max(times[i], since)
+                current = reached.get(contact)
+                if current is None or ts < current[0]:
+                    reached[contact] = (ts, source)
+        return reached
+
+    def exposure(self, source: int, since: int, max_hops: int, until: Optional[int] = None) -> List[Exposure]:
+        """
+        Time-respecting k-hop reachability: everyone who could have been exposed
+        through a chain of at most max_hops contacts that starts with source at or
+        after since, where each contact in the chain lasts until at least the time
+        the previous person was exposed.
+
+        Runs a bounded label-correcting BFS: each round only expands people whose
+        earliest exposure time improved in the previous round, and each expansion
+        only visits that person's edges after their exposure time.
+        """
+        if source not in self.rows or max_hops < 1:
+            return []
+
+        reached: Dict[int, Exposure] = {source: Exposure(source, since, 0, None)}
+        frontier = [source]
+        for hop in range(1, max_hops + 1):
+            improved = {}
+            for contact, (ts, via) in self.expand({person: reached[person].time for person in frontier}, until).items():
+                current = reached.get(contact)
+                if current is None or ts < current.time:
+                    improved[contact] = Exposure(contact, ts, hop, via)
+            improved.pop(source, None)
+            if not improved:
+                break
+            reached.update(improved)
+            frontier = list(improved)
+
+        del reached[source]
+        return sorted(reached.values(), key=lambda exposure: (exposure.time, exposure.hops, exposure.person))
+
+def overlapping(rows: array, table, since: Optional[int], until: Optional[int], span: int) -> Sequence[int]:
+    """Rows of table (kept in start order) whose start..end overlaps since..until.
+    span is the longest encounter among rows, so no row starting earlier than since - span can overlap."""
+    starts, ends, index = table.ts, table.end, table.index
+    start_of = (lambda row: starts[index(row)]) if table.base or table.gap else starts.__getitem__
+    last = len(rows) if until is None else bisect_right(rows, until, key=start_of)
+    if since is None:
+        return rows[:last]
+    first = bisect_left(rows, since - span, key=start_of)
+    if not span:
+        return rows[first:last]
+    middle = bisect_left(rows, since, lo=first, hi=max(first, last), key=start_of)
+    # Rows starting before since only count if they were still going on at since
+    return [row for row in rows[first:middle] if ends[index(row)] >= since] + list(rows[middle:last])
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Spatial hash index used by the tracker for contact detection.
+Maps each occupied cell to the people in it so a position update only
+looks at the cells in the mover's neighbourhood instead of every tracked person.
+Only occupied cells are stored, and a cell with a single occupant holds just
+their name rather than a set, so memory follows the number of people however
+large the grid is. On a toroidal grid neighbourhoods wrap around the edges.
+"""
+import math
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from topology import Topology
+
+Cell = Tuple[int, int]
+
+METRICS = ('chebyshev', 'euclidean')
+
+def neighbourhood_offsets(radius: int, metric: str = 'chebyshev') -> List[Cell]:
+    """Return the (dx, dy) offsets within radius of a cell, including (0, 0)"""
+    if radius < 0:
+        raise ValueError("Contact radius cannot be negative")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown contact metric '{metric}', expected one of {', '.join(METRICS)}")
+
+    offsets = []
+    for dx in range(-radius, radius + 1):
+        for dy in range(-radius, radius + 1):
+            if metric == 'euclidean' and math.hypot(dx, dy) > radius:
+                continue
+            offsets.append((dx, dy))
+    return offsets
+
+class SpatialIndex:
+    """
+    Cell -> occupants index maintained incrementally as people move.
+    A radius of 0 gives exact-cell matching; larger radii match any occupant
+    within that Chebyshev (square) or Euclidean (circular) distance.
+    """
+
+    def __init__(self, radius: int = 0, metric: str = 'chebyshev', topology: Optional[Topology] = None):
+        self.radius = radius
+        self.metric = metric
+        self.offsets = neighbourhood_offsets(radius, metric)
+        self.wrap = topology.size if topology is not None and topology.wraps else 0  # Grid size on a torus, else 0
+        # Offsets modulo the grid for neighbourhoods that cross an edge of a torus, each cell is visited once
+        self.wrapped_offsets = list(dict.fromkeys((dx % self.wrap, dy % self.wrap) for dx, dy in self.offsets)) if self.wrap else []
+        self.topology = topology
+        self.cells: Dict[Cell, Union[str, Set[str]]] = {}  # Occupied cells only, a lone occupant is stored without a set
+        self.positions: Dict[str, Cell] = {}  # Current cell of every tracked person
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, person: str) -> bool:
+        return person in self.positions
+
+    def move(self, person: str, cell: Cell):
+        """Place person in cell, removing them from their previous cell"""
+        old_cell = self.positions.get(person)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._discard(person, old_cell)
+        self.positions[person] = cell
+        occupants = self.cells.get(cell)
+        if occupants is None:
+            self.cells[cell] = person
+        elif isinstance(occupants, str):
+            self.cells[cell] = {occupants, person}
+        else:
+            occupants.add(person)
+
+    def remove(self, person: str):
+        """Stop tracking person"""
+        cell = self.positions.pop(person, None)
+        if cell is not None:
+            self._discard(person, cell)
+
+    def _discard(self, person: str, cell: Cell):
+        occupants = self.cells[cell]
+        if isinstance(occupants, str):
+            del self.cells[cell]  # Keep memory proportional to occupied cells
+            return
+        occupants.discard(person)
+        if len(occupants) == 1:
+            self.cells[cell] = occupants.pop()
+
+    def occupants(self, cell: Cell) -> Set[str]:
+        occupants = self.cells.get(cell)
+        if occupants is None:
+            return set()
+        return {occupants} if isinstance(occupants, str) else set(occupants)
+
+    def nearby(self, person: str, cell: Cell) -> List[str]:
+        """Return everyone other than person within the contact radius of cell"""
+        x, y = cell
+        cells = self.cells
+        found = []
+        if not self.radius:
+            occupants = cells.get(cell)
+            if occupants is not None:
+                _add_occupants(found, occupants, person)
+            return found
+
+        if len(self.offsets) > len(cells):
+            # Sparse grid with a wide radius: fewer occupied cells than cells in the neighbourhood
+            for other_cell, occupants in cells.items():
+                if self._within(cell, other_cell):
+                    _add_occupants(found, occupants, person)
+            return found
+        size, radius = self.wrap, self.radius
+        if size and not (radius <= x < size - radius and radius <= y < size - radius):
+            for dx, dy in self.wrapped_offsets:
+                occupants = cells.get(((x + dx) % size, (y + dy) % size))
+                if occupants is not None:
+                    _add_occupants(found, occupants, person)
+            return found
+        for dx, dy in self.offsets:
+            occupants = cells.get((x + dx, y + dy))
+            if occupants is not None:
+                _add_occupants(found, occupants, person)
+        return found
+
+    def _within(self, cell: Cell, other: Cell) -> bool:
+        if self.topology is not None:
+            dx, dy = self.topology.offset(cell[0], other[0]), self.topology.offset(cell[1], other[1])
+        else:
+            dx, dy = abs(cell[0] - other[0]), abs(cell[1] - other[1])
+        if self.metric == 'euclidean':
+            return math.hypot(dx, dy) <= self.radius
+        return max(dx, dy) <= self.radius
+
+def _add_occupants(found: List[str], occupants: Union[str, Set[str]], person: str):
+    if isinstance(occupants, str):
+        if occupants != person:
+            found.append(occupants)
+    else:
+        found.extend(other for other in occupants if other != person)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Query engine over the ContactStore.
+
+Answers the query types sent by query.py and splits each answer into chunks so
+no single response message grows with a person's full history:
+  - contacts: contact history of a person, optionally between start and end
+  - top:      a person's top-K contacts by encounter count (K <= 0 for all of them)
+  - location: every contact recorded at a cell, optionally between start and end
+  - exposure: everyone reachable from a person through up to `hops` time-ordered
+              contacts still going on at or after start. With `sources` ({person: since})
+              it answers a single hop, so query.py can run the rounds across shards
+  - bulk:     contact histories of a list of `people`, optionally between start and
+              end, answered in one pass over the store and streamed as chunks of
+              {person: contacts}
+
+Start and end are epoch seconds, and an encounter is included when any part of
+it falls between them, including one that was already under way at start.
+Every chunk carries the query_id, its chunk number and the total number of
+chunks so the client can reassemble them.
+"""
+import heapq
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from contact_store import ContactStore
+
+QUERY_TYPES = ('contacts', 'top', 'location', 'exposure', 'bulk')
+
+class QueryError(ValueError):
+    """Raised for malformed query requests"""
+
+class ContactQueryEngine:
+    def __init__(self, store: ContactStore, page_size: int = 500, max_hops: int = 3, max_bulk: int = 5000):
+        self.store = store
+        self.page_size = max(1, page_size)
+        self.max_hops = max_hops
+        self.max_bulk = max_bulk
+
+    def execute(self, request: dict) -> List[dict]:
+        """Run a query request and return its response chunks"""
+        query_type = request.get('type', 'contacts')
+        page_size = max(1, min(int(request.get('page_size') or self.page_size), self.page_size))
+        start, end = _optional_int(request.get('start')), _optional_int(request.get('end'))
+
+        if query_type == 'contacts':
+            person = _person(request)
+            return self._paginate_contacts(self.store.contacts_of(person, start, end), page_size)
+
+        if query_type == 'top':
+            person = _person(request)
+            k = int(request.get('k', 10))
+            counts = self.store.contact_counts(person, start, end)
+            if k <= 0: # Every contact, used by sharded queries which rank after merging
+                top = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+            else:
+                top = heapq.nlargest(k, counts.items(), key=lambda item: item[1])
+            return self._paginate_list('top', 'top', [{'contact': name, 'count': count} for name, count in top], page_size)
+
+        if query_type == 'location':
+            try:
+                position = (int(request['x']), int(request['y']))
+            except (KeyError, TypeError, ValueError):
+                raise QueryError("Location queries need integer x and y")
+            encounters = [
+                {'person': person1, 'contact_person': person2, 'timestamp': self.store.format_timestamp(ts),
+                 'end': self.store.format_timestamp(end_ts)}
+                for person1, person2, ts, end_ts in self.store.contacts_at(position, start, end)
+            ]
+            chunks = self._paginate_list('location', 'encounters', encounters, page_size)
+            for chunk in chunks:
+                chunk['location'] = list(position)
+            return chunks
+
+        if query_type == 'exposure':
+            person = _person(request)
+            hops = int(request.get('hops', 2))
+            if not 1 <= hops <= self.max_hops:
+                raise QueryError(f"hops must be between 1 and {self.max_hops}")
+            if 'sources' in request: # One hop of a sharded exposure query, query.py runs the rounds
+                exposures = [
+                    {'person': contact, 'via': source, 'time': ts, 'timestamp': self.store.format_timestamp(ts)}
+                    for contact, ts, source in self.store.exposure_step(_sources(request), end)
+                ]
+                return self._paginate_list('exposure', 'exposures', exposures, page_size)
+            exposures = [
+                {
+                    'person': exposure.person,
+                    'hops': exposure.hops,
+                    'via': exposure.via,
+                    'timestamp': self.store.format_timestamp(exposure.time)
+                }
+                for exposure in self.store.exposure(person, start or 0, hops, end)
+            ]
+            return self._paginate_list('exposure', 'exposures', exposures, page_size)
+
+        if query_type == 'bulk':
+            people = _people(request)
+            if len(people) > self.max_bulk:
+                raise QueryError(f"Bulk queries are limited to {self.max_bulk} people, got {len(people)}")
+            return self._paginate_bulk(self.store.contacts_of_many(people, start, end), page_size)
+
+        raise QueryError(f"Unknown query type '{query_type}', expected one of {', '.join(QUERY_TYPES)}")
+
+    def cache_key(self, request: dict) -> Optional[Tuple[Hashable, Tuple[Hashable, ...]]]:
+        """Return (key, dependencies) for caching the response to request, see query_cache.py.
+        Returns None for queries that are not cached: exposure queries, which depend on everyone's
+        contacts, and malformed ones."""
+        query_type = request.get('type', 'contacts')
+        try:
+            page_size = max(1, min(int(request.get('page_size') or self.page_size), self.page_size))
+            start, end = _optional_int(request.get('start')), _optional_int(request.get('end'))
+            if query_type == 'contacts':
+                person = _person(request)
+                return (query_type, person, start, end, page_size), (person,)
+            if query_type == 'top':
+                person = _person(request)
+                k = int(request.get('k', 10))
+                return (query_type, person, start, end, k, page_size), (person,)
+            if query_type == 'location':
+                position = (int(request['x']), int(request['y']))
+                return (query_type, position, start, end, page_size), (position,)
+        except (KeyError, TypeError, ValueError):
+            return None
+        return None
+
+    def _paginate_contacts(self, contacts: Dict[str, Dict], page_size: int) -> List[dict]:
+        """Split a contact history into chunks of at most page_size locations.
+        A contact with more locations than fit in one chunk continues in the next."""
+        if not contacts:
+            return self._number([{'type': 'contacts', 'contacts': 'no contact'}])
+
+        chunks, current, used = [], {}, 0
+        for name, details in contacts.items():
+            locations = details['locations']
+            offset = 0
+            while True:
+                room = page_size - used
+                part = locations[offset:offset + room]
+                current[name] = {'count': details['count'], 'locations': part}
+                used += len(part)
+                offset += len(part)
+                if used >= page_size:
+                    chunks.append(current)
+                    current, used = {}, 0
+                if offset >= len(locations):
+                    break
+        if current or not chunks:
+            chunks.append(current)
+        return self._number([{'type': 'contacts', 'contacts': chunk} for chunk in chunks])
+
+    def _paginate_bulk(self, results: Dict[str, Dict[str, Dict]], page_size: int) -> List[dict]:
+        """Split bulk results into chunks of at most page_size locations, like _paginate_contacts.
+        Every person appears in some chunk, with an empty dict when they have no contacts."""
+        chunks, current, used = [], {}, 0
+        for person, contacts in results.items():
+            if not contacts:
+                current[person] = {}
+            for name, details in contacts.items():
+                locations = details['locations']
+                offset = 0
+                while True:
+                    part = locations[offset:offset + page_size - used]
+                    current.setdefault(person, {})[name] = {'count': details['count'], 'locations': part}
+                    used += len(part)
+                    offset += len(part)
+                    if used >= page_size:
+                        chunks.append(current)
+                        current, used = {}, 0
+                    if offset >= len(locations):
+                        break
+        if current or not chunks:
+            chunks.append(current)
+        return self._number([{'type': 'bulk', 'results': chunk} for chunk in chunks])
+
+    def _paginate_list(self, query_type: str, key: str, items: List, page_size: int) -> List[dict]:
+        pages = [items[i:i + page_size] for i in range(0, len(items), page_size)] or [[]]
+        return self._number([{'type': query_type, key: page} for page in pages])
+
+    @staticmethod
+    def _number(chunks: List[dict]) -> List[dict]:
+        for number, chunk in enumerate(chunks):
+            chunk['chunk'] = number
+            chunk['chunks'] = len(chunks)
+        return chunks
+
+def _person(request: dict) -> str:
+    person = (request.get('query_person') or '').strip().lower()
+    if not person:
+        raise QueryError("Query is missing query_person")
+    return person
+
+def _people(request: dict) -> List[str]:
+    people = request.get('people')
+    if isinstance(people, list): # Names are matched like query_person, each person is answered once
+        people = list(dict.fromkeys(str(person).strip().lower() for person in people if str(person).strip()))
+    if not people:
+        raise QueryError("Bulk queries need a non-empty list of people")
+    return people
+
+def _sources(request: dict) -> Dict[str, int]:
+    sources = request['sources']
+    if not isinstance(sources, dict):
+        raise QueryError("sources must map person names to epoch seconds")
+    return {str(person).lower(): _optional_int(since) or 0 for person, since in sources.items()}
+
+def _optional_int(value) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"Expected epoch seconds, got {value!r}")
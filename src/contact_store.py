@@ -0,0 +1,786 @@
+#!/usr/bin/env python
+"""
+Durable storage for the tracker's contact history.
+
+Contacts are kept in memory in a compact columnar form:
+  - people are interned to integer ids
+  - each encounter is one row of an EncounterTable (person1, person2, x, y, start and end
+    epoch seconds), recorded once per pair rather than once per direction
+  - per-person row arrays (the ContactGraph) and per-cell row arrays index the table
+    by person, time and location, so contact_query never scans every encounter.
+    A time window selects the encounters overlapping it, not only those starting in it
+
+Timestamps are formatted with TIMESTAMP_FORMAT only when a query is answered.
+When a directory is given the store is persisted with:
+  - contacts.log:      append-only log of fixed-size binary records, one per encounter
+                       and one more when an encounter that lasted ends
+  - contacts.names:    append-only list of person names, line n is person id n
+  - contacts.snapshot: periodic pickle of the in-memory state and its sequence number
+
+Log writes and snapshots happen on a background writer thread so the
+position-processing thread only appends to a queue. On startup the snapshot is
+loaded and the log tail after the snapshot's sequence number is replayed.
+
+Every compact_interval seconds the background thread also applies the retention
+policy: encounters that ended more than `retention` seconds ago are dropped, and
+encounters older than `compact_age` between the same two people on the same cell
+less than merge_gap apart (such as the per-tick rows of older logs) are collapsed
+into one encounter from the first start to the last end. Compaction works in
+slices of at most compact_slice rows and never looks at a row twice for merging:
+each run drops the expired rows among the oldest slice of the compacted front,
+then takes the next slice of rows it has not looked at yet, merging them with
+each other or with the pair's latest encounter already in the front, and moves
+the rest onto the end of the front. Both passes work out the rows to keep, their
+index entries and the widened spans off the lock, then swap in only the slice
+and the index entries of the people and cells in it. Row numbers from the first
+row not yet looked at on never change (see EncounterTable). Runs follow each
+other until the backlog is done, with the lock free in between. The log stays
+valid, so no snapshot is needed; a restart before the next snapshot simply
+compacts again.
+"""
+import gc
+import json
+import logging
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
+
+from contact_graph import EMPTY_ROWS, ContactGraph, Exposure, overlapping
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+LOG_MAGIC = b'CTLOG\x00\x00\x01'
+LOG_HEADER = struct.Struct('<8sQ')  # magic, sequence number of the first record
+LOG_RECORD = struct.Struct('<IIiiq')  # person1 id, person2 id, x, y, epoch seconds
+END_RECORD = 0xFFFFFFFF  # person1 id of a record ending an encounter: (END_RECORD, row, 0, 0, end)
+ROW_BYTES = 4 * 4 + 2 * 8 + 3 * 4  # Table columns of one encounter plus its two person and one cell index entries
+
+class EncounterTable:
+    """Columnar encounter storage, one row per contact between two people.
+    Compaction renumbers the rows it keeps into a compacted front, numbered from base, and leaves
+    the gap row numbers below split unused, so rows from split on (the ones the log can still
+    refer to) keep their numbers. index() turns a row number into a position in the columns."""
+
+    def __init__(self):
+        self.base = 0  # Row number of the first row kept
+        self.split = 0  # First row number compaction has not looked at yet
+        self.gap = 0  # Unused row numbers just below split
+        self.person1 = array('I')
+        self.person2 = array('I')
+        self.x = array('i')
+        self.y = array('i')
+        self.ts = array('q')  # Start time, rows are kept in this order
+        self.end = array('q')
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def append(self, person1: int, person2: int, x: int, y: int, ts: int) -> int:
+        """Append an encounter and return its row number, it ends when it starts until end() is called"""
+        self.person1.append(person1)
+        self.person2.append(person2)
+        self.x.append(x)
+        self.y.append(y)
+        self.ts.append(ts)
+        self.end.append(ts)
+        return self.base + self.gap + len(self.ts) - 1
+
+    def index(self, row: int) -> int:
+        """Position of row in the columns"""
+        return row - self.base if row < self.split else row - self.base - self.gap
+
+    def row_numbers(self):
+        """Every row number in use, in order"""
+        return chain(range(self.base, self.split - self.gap), range(max(self.split, self.base), self.base + self.gap + len(self.ts)))
+
+    def copy(self) -> 'EncounterTable':
+        copied = EncounterTable()
+        copied.base, copied.split, copied.gap = self.base, self.split, self.gap
+        for name in ('person1', 'person2', 'x', 'y', 'ts', 'end'):
+            setattr(copied, name, getattr(self, name)[:])
+        return copied
+
+    def nbytes(self) -> int:
+        return sum(len(column) * column.itemsize for column in (self.person1, self.person2, self.x, self.y, self.ts, self.end))
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if 'end' not in state: # Snapshot from before encounters had an end time
+            self.end = array('q', self.ts)
+        self.__dict__.setdefault('base', 0)
+        self.__dict__.setdefault('split', self.base)
+        self.__dict__.setdefault('gap', 0)
+
+class ContactStore:
+    """In-memory contact history with an optional append-only log and snapshots"""
+
+    def __init__(self, directory: Optional[str] = None, snapshot_interval: float = 300.0,
+                 timestamp_format: str = TIMESTAMP_FORMAT, retention: float = 0.0, compact_age: float = 0.0,
+                 compact_interval: float = 0.0, merge_gap: float = 0.0, compact_slice: int = 50000):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.timestamp_format = timestamp_format
+        self.retention = retention  # Seconds after its end an encounter is dropped, 0 keeps everything
+        self.compact_age = compact_age  # Seconds after its start an encounter can be merged with the pair's next one, 0 never merges
+        self.compact_interval = compact_interval  # Seconds between compaction runs, 0 disables compaction
+        self.merge_gap = merge_gap
+        self.compact_slice = max(1, compact_slice)  # New rows looked at by one compaction run
+        self._merge_tails: Dict[Tuple[int, int, int, int], Tuple[int, int, int]] = {}  # See _compact_slice
+        self._compaction_pending = False
+        self.table = EncounterTable()
+        self.graph = ContactGraph(self.table)  # Person id -> encounter rows
+        self.cells: Dict[Tuple[int, int], array] = {}  # Cell -> encounter rows
+        self.cell_spans: Dict[Tuple[int, int], int] = {}  # Cell -> longest encounter (end - start) recorded there
+        self._lock = threading.Lock()  # Guards the in-memory state between the processing, query and writer threads
+        self._names: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+        self._last_ts = 0  # Rows are kept in time order so the indexes can be bisected
+        self._seq = 0  # Records applied, encounters and their ends
+        self._bytes = 0  # Running total behind memory_usage(), kept up to date by _apply and compact
+        self._ongoing: Dict[int, int] = {}  # Encounter handle -> row, for encounters still waiting for end()
+        self._next_handle = 0
+        self.compaction_stats = {'runs': 0, 'dropped': 0, 'merged': 0, 'bytes_reclaimed': 0}
+        self._compactor: Optional[threading.Thread] = None
+        self._stop_compactor = threading.Event()
+        self._written_names = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._snapshot_requested = threading.Event()
+        self._final_snapshot = True
+        self._last_timestamp: Tuple[int, str] = (-1, '')
+
+        if directory:
+            self.log_path = os.path.join(directory, 'contacts.log')
+            self.names_path = os.path.join(directory, 'contacts.names')
+            self.snapshot_path = os.path.join(directory, 'contacts.snapshot')
+
+    @property
+    def seq(self) -> int:
+        """Number of contact records applied to memory"""
+        return self._seq
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    # In-memory state
+
+    def format_timestamp(self, ts: int) -> str:
+        # Consecutive contacts usually share a second, so reuse the last formatted value
+        last = self._last_timestamp
+        if last[0] != ts:
+            last = self._last_timestamp = (ts, datetime.fromtimestamp(ts).strftime(self.timestamp_format))
+        return last[1]
+
+    def _apply(self, person1: int, person2: int, x: int, y: int, ts: int) -> Optional[int]:
+        # Apply one log record, returns the new row of an encounter
+        self._seq += 1
+        if person1 == END_RECORD:
+            if person2 < self.table.split:
+                return None # Ongoing rows are never compacted, so this is a log written before the row was
+            i = self.table.index(person2)
+            self.table.end[i] = max(ts, self.table.ts[i])
+            self.graph.widen(person2)
+            _widen_cell(self.cell_spans, self.table, person2)
+            return
+        if ts < self._last_ts:
+            ts = self._last_ts # Wall clock stepped back or encounters were confirmed out of order, keep rows sorted by time
+        self._last_ts = ts
+        row = self.table.append(person1, person2, x, y, ts)
+        _index_row(self.graph, self.cells, self.cell_spans, self.table, row)
+        self._bytes += ROW_BYTES
+        return row
+
+    def _name_id(self, name: str) -> int:
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+
+    def record(self, person1: str, person2: str, position: Tuple[int, int], ts: float, ongoing: bool = False) -> int:
+        """Record an encounter starting at epoch time ts and return a handle for it.
+        An ongoing encounter is kept out of compaction until its handle is passed to end()."""
+        ts = int(ts)
+        x, y = position
+        with self._lock:
+            id1, id2 = self._name_id(person1), self._name_id(person2)
+            seq = self._seq
+            row = self._apply(id1, id2, x, y, ts)
+            if self._writer is not None:
+                self._queue.put((seq, id1, id2, x, y, ts))
+            handle = self._next_handle
+            self._next_handle += 1
+            if ongoing:
+                self._ongoing[handle] = row
+            return handle
+
+    def end(self, handle: int, ts: float):
+        """Set the end time of an ongoing encounter"""
+        ts = int(ts)
+        with self._lock:
+            row = self._ongoing.pop(handle, None)
+            if row is None:
+                return
+            seq = self._seq
+            self._apply(END_RECORD, row, 0, 0, ts)
+            if self._writer is not None:
+                self._queue.put((seq, END_RECORD, row, 0, 0, ts))
+
+    def contacts_of(self, person: str, start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, Dict]:
+        """Return one person's contacts as {contact: {'count', 'locations': [(x, y, start, end timestamp)]}},
+        optionally limited to encounters overlapping start..end"""
+        table = self.table
+        grouped: Dict[int, List[Tuple[int, int, int, int]]] = {}
+        with self._lock:
+            person_id = self._name_ids.get(person)
+            if person_id is None:
+                return {}
+            person1, person2, xs, ys, times, ends = table.person1, table.person2, table.x, table.y, table.ts, table.end
+            base, split, tail = table.base, table.split, table.base + table.gap
+            for row in self.graph.rows_between(person_id, start, end):
+                i = row - base if row < split else row - tail
+                other = person2[i] if person1[i] == person_id else person1[i]
+                grouped.setdefault(other, []).append((xs[i], ys[i], times[i], ends[i]))
+            names = self._names
+
+        return {
+            names[other]: {
+                'count': len(locations),
+                'locations': [(x, y, self.format_timestamp(ts), self.format_timestamp(end_ts)) for x, y, ts, end_ts in locations]
+            }
+            for other, locations in grouped.items()
+        }
+
+    def contacts_of_many(self, people: List[str], start: Optional[int] = None,
+                         end: Optional[int] = None) -> Dict[str, Dict[str, Dict]]:
+        """contacts_of for several people in one pass: the lock is taken once, an encounter between two
+        of the people is visited once for both of them, and each timestamp is formatted once.
+        People with no contacts map to an empty dict"""
+        table = self.table
+        grouped: Dict[str, Dict[int, List[Tuple[int, int, int, int]]]] = {person: {} for person in people}
+        with self._lock:
+            ids = {self._name_ids[person]: person for person in grouped if person in self._name_ids}
+            person1, person2, xs, ys, times, ends = table.person1, table.person2, table.x, table.y, table.ts, table.end
+            base, split, tail = table.base, table.split, table.base + table.gap
+            for person_id, person in ids.items():
+                own = grouped[person]
+                for row in self.graph.rows_between(person_id, start, end):
+                    i = row - base if row < split else row - tail
+                    other = person2[i] if person1[i] == person_id else person1[i]
+                    other_person = ids.get(other)
+                    if other_person is not None and other < person_id:
+                        continue # Already added for both people from the other side
+                    location = (xs[i], ys[i], times[i], ends[i])
+                    own.setdefault(other, []).append(location)
+                    if other_person is not None and other != person_id:
+                        grouped[other_person].setdefault(person_id, []).append(location)
+            names = self._names
+
+        formatted: Dict[int, str] = {}
+        def timestamp(ts: int) -> str:
+            text = formatted.get(ts)
+            if text is None:
+                text = formatted[ts] = self.format_timestamp(ts)
+            return text
+
+        results = {}
+        for person, contacts in grouped.items():
+            results[person] = {}
+            for other, locations in contacts.items():
+                results[person][names[other]] = {
+                    'count': len(locations),
+                    'locations': [(x, y, timestamp(ts), timestamp(end_ts)) for x, y, ts, end_ts in locations]
+                }
+        return results
+
+    def contact_counts(self, person: str, start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, int]:
+        """Return encounter counts per contact without building any locations"""
+        counts: Dict[int, int] = {}
+        with self._lock:
+            person_id = self._name_ids.get(person)
+            if person_id is None:
+                return {}
+            table = self.table
+            person1, person2, base, split, tail = table.person1, table.person2, table.base, table.split, table.base + table.gap
+            for row in self.graph.rows_between(person_id, start, end):
+                i = row - base if row < split else row - tail
+                other = person2[i] if person1[i] == person_id else person1[i]
+                counts[other] = counts.get(other, 0) + 1
+            names = self._names
+        return {names[other]: count for other, count in counts.items()}
+
+    def contacts_at(self, position: Tuple[int, int], start: Optional[int] = None,
+                    end: Optional[int] = None) -> List[Tuple[str, str, int, int]]:
+        """Return (person1, person2, start, end epoch time) for every contact recorded at position
+        that overlaps start..end"""
+        position = tuple(position)
+        with self._lock:
+            table = self.table
+            rows = overlapping(self.cells.get(position, EMPTY_ROWS), table, start, end, self.cell_spans.get(position, 0))
+            names, person1, person2, times, ends = self._names, table.person1, table.person2, table.ts, table.end
+            return [(names[person1[i]], names[person2[i]], times[i], ends[i]) for i in map(table.index, rows)]
+
+    def exposure(self, person: str, since: int, max_hops: int, until: Optional[int] = None) -> List[Exposure]:
+        """People who could have been exposed through person after since, see ContactGraph.exposure"""
+        with self._lock:
+            person_id = self._name_ids.get(person)
+            if person_id is None:
+                return []
+            exposures = self.graph.exposure(person_id, since, max_hops, until)
+            names = self._names
+        for exposure in exposures:
+            exposure.person = names[exposure.person]
+            exposure.via = names[exposure.via]
+        return exposures
+
+    def exposure_step(self, sources: Dict[str, int], until: Optional[int] = None) -> List[Tuple[str, int, str]]:
+        """One hop of exposure from several people, each exposed from their own time.
+        Returns (contact, earliest time, source) for everyone they met, see ContactGraph.expand"""
+        with self._lock:
+            ids = {self._name_ids[person]: since for person, since in sources.items() if person in self._name_ids}
+            reached = self.graph.expand(ids, until)
+            names = self._names
+        return [(names[contact], ts, names[source]) for contact, (ts, source) in reached.items()]
+
+    def memory_usage(self) -> int:
+        """Approximate bytes used by the encounter table and its indexes.
+        Read from a running total, so metrics scrapes neither take the lock nor walk the indexes."""
+        return self._bytes
+
+    def _memory_usage(self) -> int:
+        # Counted from the arrays, sets the running total after a snapshot is loaded
+        index_arrays = list(self.graph.rows.values()) + list(self.cells.values())
+        return self.table.nbytes() + sum(len(rows) * rows.itemsize for rows in index_arrays)
+
+    # Retention and compaction
+
+    def compact(self, now: Optional[float] = None) -> bool:
+        """Apply the retention policy to the next slice of the compacted front and merge old encounters
+        in the next slice of new rows, returns True if anything changed. See the module docstring."""
+        now = time.time() if now is None else now
+        drop_before = now - self.retention if self.retention else None
+        merge_before = now - self.compact_age if self.compact_age else None
+        if drop_before is None and merge_before is None:
+            return False
+        started = time.perf_counter()
+        dropped = merged = removed = 0
+        if drop_before is not None:
+            dropped, front_pending = self._release_front(drop_before)
+            removed += dropped
+        else:
+            front_pending = False
+        slice_dropped, merged, slice_pending = self._compact_slice(drop_before, merge_before)
+        dropped += slice_dropped
+        removed += slice_dropped + merged
+        self._compaction_pending = front_pending or slice_pending
+        if not removed:
+            return False
+
+        # Each row released frees its six columns, its two person index entries and its cell index entry
+        reclaimed = removed * ROW_BYTES
+        stats = self.compaction_stats
+        stats['dropped'] += dropped
+        stats['merged'] += merged
+        stats['bytes_reclaimed'] += reclaimed
+        logger.info(f"Contact store compacted: dropped {dropped} expired and merged {merged} encounters, "
+                    f"reclaimed {reclaimed} bytes in {time.perf_counter() - started:.2f}s")
+        return True
+
+    def _release_front(self, drop_before: float) -> Tuple[int, bool]:
+        """Drop expired rows from the next slice of the compacted front, returns (rows dropped, more to look at)"""
+        with self._lock:
+            table = self.table
+            base = table.base
+            expired = bisect_left(table.ts, drop_before, 0, table.split - table.gap - base) # Front rows that may have ended
+            n = min(expired, self.compact_slice)
+            if not n:
+                return 0, False
+            p1, p2, xs, ys, ts, ends = (column[:n] for column in _columns(table))
+
+        # Front rows only change here, so the survivors are worked out off the lock
+        kept = EncounterTable()
+        survivors = []
+        for i in range(n):
+            if ends[i] >= drop_before: # Started long ago but still going on within the retention period
+                kept.append(p1[i], p2[i], xs[i], ys[i], ts[i])
+                kept.end[-1] = ends[i]
+                survivors.append(base + i)
+        dropped = n - len(kept)
+        if not dropped:
+            return 0, False
+
+        # The survivors take the last row numbers of the slice, so the rest of the front keeps its numbers
+        high = base + n
+        new_base = high - len(kept)
+        person_rows, cell_rows = _index_rows(kept, new_base, p1, p2, zip(xs, ys))
+        renumbered = dict(zip(survivors, range(new_base, high)))  # Merge tails among the survivors follow them
+        self._merge_tails = {key: (renumbered[tail[0]], *tail[1:]) if tail[0] < high else tail
+                             for key, tail in self._merge_tails.items() if tail[0] >= high or tail[0] in renumbered}
+
+        with self._lock:
+            for column, kept_column in zip(_columns(table), _columns(kept)):
+                column[:n] = kept_column
+            table.base = new_base
+            _swap_rows(self.graph.rows, person_rows, base, high)
+            _swap_rows(self.cells, cell_rows, base, high)
+            self._bytes -= dropped * ROW_BYTES
+            self.compaction_stats['runs'] += 1  # Counted with the swap so readers can tell which table they saw
+        return dropped, expired > n
+
+    def _compact_slice(self, drop_before: Optional[float], merge_before: Optional[float]):
+        """Compact the next slice of rows compaction has not looked at yet into the front.
+        Returns (rows dropped, rows merged, more to look at)"""
+        with self._lock:
+            table = self.table
+            split, front_end = table.split, table.split - table.gap
+            first = front_end - table.base # Position of split in the columns
+            # Rows starting after both thresholds cannot be dropped or merged, and ongoing rows are never moved
+            limit = bisect_left(table.ts, max(t for t in (drop_before, merge_before) if t is not None), first) + split - first
+            if self._ongoing:
+                limit = min(limit, min(self._ongoing.values()))
+            high = min(limit, split + self.compact_slice)
+            n = high - split
+            if n <= 0:
+                return 0, 0, False
+            p1, p2, xs, ys, ts, ends = (column[first:first + n] for column in _columns(table))
+
+        # Rows [split, high) do not change meanwhile, so the survivors are worked out off the lock.
+        # A row can merge into the pair's latest encounter on the same cell, in the slice or already in the front
+        kept = EncounterTable()
+        kept_end = kept.end
+        tails = self._merge_tails  # Pair and cell -> (row, start, end) of its latest mergeable front encounter
+        last_of_pair: Dict[Tuple[int, int, int, int], int] = {}  # Pair and cell -> kept row of the same in this slice
+        extended: Dict[int, Tuple[Tuple[int, int, int, int], int, int]] = {}  # Front row -> (pair and cell, start, new end)
+        dropped = merged = 0
+        for i in range(n):
+            if drop_before is not None and ends[i] < drop_before:
+                dropped += 1
+                continue
+            if merge_before is not None and ts[i] < merge_before:
+                key = (p1[i], p2[i], xs[i], ys[i]) if p1[i] < p2[i] else (p2[i], p1[i], xs[i], ys[i])
+                last = last_of_pair.get(key)
+                if last is not None:
+                    if ts[i] - kept_end[last] <= self.merge_gap:
+                        if ends[i] > kept_end[last]:
+                            kept_end[last] = ends[i]
+                        merged += 1
+                        continue
+                else:
+                    tail = tails.get(key)
+                    if tail is not None and ts[i] - tail[2] <= self.merge_gap:
+                        if ends[i] > tail[2]:
+                            tails[key] = (tail[0], tail[1], ends[i])
+                            extended[tail[0]] = (key, tail[1], ends[i])
+                        merged += 1
+                        continue
+                last_of_pair[key] = len(kept)
+            kept.append(p1[i], p2[i], xs[i], ys[i], ts[i])
+            kept_end[-1] = ends[i]
+
+        # The kept rows are numbered on from the front, the row numbers up to high are left unused
+        for key, i in last_of_pair.items():
+            tails[key] = (front_end + i, kept.ts[i], kept_end[i])
+        horizon = ts[-1] - self.merge_gap # Later rows start after this, so older tails can no longer merge
+        self._merge_tails = {key: tail for key, tail in tails.items() if tail[2] >= horizon}
+        if not dropped and not merged and front_end == split:
+            with self._lock: # Nothing to renumber, the slice simply joins the front
+                table.split = high
+            return 0, 0, high < limit
+
+        person_rows, cell_rows = _index_rows(kept, front_end, p1, p2, zip(xs, ys))
+        person_spans: Dict[int, int] = {}
+        cell_spans: Dict[Tuple[int, int], int] = {}
+        widened = [(kept.person1[i], kept.person2[i], kept.x[i], kept.y[i], kept_end[i] - kept.ts[i]) for i in range(len(kept))]
+        widened += [(*key, end - start) for key, start, end in extended.values()]
+        for person1, person2, x, y, span in widened:
+            for person in (person1, person2):
+                if span > person_spans.get(person, 0):
+                    person_spans[person] = span
+            if span > cell_spans.get((x, y), 0):
+                cell_spans[(x, y)] = span
+
+        with self._lock:
+            for column, kept_column in zip(_columns(table), _columns(kept)):
+                column[first:first + n] = kept_column
+            for row, (_, _, end) in extended.items():
+                table.end[row - table.base] = end
+            table.split, table.gap = high, high - front_end - len(kept)
+            _swap_rows(self.graph.rows, person_rows, split, high)
+            _swap_rows(self.cells, cell_rows, split, high)
+            for spans, widest in ((self.graph.spans, person_spans), (self.cell_spans, cell_spans)):
+                for key, span in widest.items():
+                    if span > spans.get(key, 0):
+                        spans[key] = span
+            self._bytes -= (dropped + merged) * ROW_BYTES
+            self.compaction_stats['runs'] += 1  # Counted with the swap so readers can tell which table they saw
+        return dropped, merged, high < limit
+
+    @property
+    def compaction_pending(self) -> bool:
+        """True while the last compaction stopped at its slice size with more rows to look at"""
+        return self._compaction_pending
+
+    @property
+    def compaction_enabled(self) -> bool:
+        return bool(self.compact_interval and (self.retention or self.compact_age))
+
+    def _run_compactor(self):
+        # Compacts an in-memory store, a persistent store compacts on its writer thread instead
+        while not self._stop_compactor.wait(self.compact_interval):
+            try:
+                self.compact()
+                while self.compaction_pending and not self._stop_compactor.is_set():
+                    self.compact() # One slice at a time, the lock is free in between
+            except Exception as e:
+                logger.error(f"Contact store compaction failed: {e}")
+
+    # Persistence
+
+    def open(self):
+        """Recover any persisted state and start the background writer"""
+        if not self.directory:
+            if self.compaction_enabled: # In-memory store, only needs a thread for compaction
+                self._compactor = threading.Thread(target=self._run_compactor, name='contact-store-compactor', daemon=True)
+                self._compactor.start()
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        start = time.perf_counter()
+        gc_enabled = gc.isenabled()
+        gc.disable() # Recovery only allocates, so cyclic GC passes over millions of new objects are wasted work
+        try:
+            replayed = self._recover()
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if self.seq:
+            logger.info(f"Recovered {len(self)} contacts ({replayed} records replayed from log) in {time.perf_counter() - start:.2f}s")
+
+        # The recovered sequence number is passed in, records made before the thread first runs must still be logged
+        self._writer = threading.Thread(target=self._run_writer, args=(self.seq,), name='contact-store-writer', daemon=True)
+        self._writer.start()
+
+    def _recover(self) -> int:
+        """Load the snapshot then replay the log tail, returns the number of records replayed"""
+        if os.path.exists(self.names_path):
+            with open(self.names_path, encoding='utf-8') as names_file:
+                self._names = [json.loads(line) for line in names_file if line.strip()]
+            self._name_ids = {name: name_id for name_id, name in enumerate(self._names)}
+        self._written_names = len(self._names)
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+            self.table = snapshot['table']
+            self.graph = ContactGraph(self.table)
+            self.graph.rows = snapshot['person_rows']
+            self.cells = snapshot['cells']
+            if 'person_spans' in snapshot:
+                self.graph.spans, self.cell_spans = snapshot['person_spans'], snapshot['cell_spans']
+            else: # Snapshot from before encounters were selected by overlap
+                for row in self.table.row_numbers():
+                    self.graph.widen(row)
+                    _widen_cell(self.cell_spans, self.table, row)
+            self._seq = snapshot['seq']
+            self._last_ts = self.table.ts[-1] if len(self.table) else 0
+            self._bytes = self._memory_usage()
+
+        if not os.path.exists(self.log_path):
+            self._start_log(self.seq)
+            return 0
+
+        with open(self.log_path, 'rb') as log_file:
+            data = log_file.read()
+        magic, base_seq = LOG_HEADER.unpack_from(data)
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{self.log_path} is not a contact log")
+        if base_seq > self.seq:
+            raise ValueError(f"{self.log_path} starts at contact {base_seq} but the snapshot ends at {self.seq}")
+
+        # Skip records already covered by the snapshot and drop any torn record at the end
+        body_start = min(len(data), LOG_HEADER.size + (self.seq - base_seq) * LOG_RECORD.size)
+        body_end = body_start + (len(data) - body_start) // LOG_RECORD.size * LOG_RECORD.size
+        replayed = 0
+        for p1, p2, x, y, ts in LOG_RECORD.iter_unpack(data[body_start:body_end]):
+            self._apply(p1, p2, x, y, ts)
+            replayed += 1
+        log_seq = base_seq + (body_end - LOG_HEADER.size) // LOG_RECORD.size
+
+        if log_seq < self.seq:
+            # Stopped after a snapshot but before its log was rotated, the whole log is in the snapshot
+            self._start_log(self.seq)
+        else:
+            if body_end != len(data): # Truncate a torn trailing record so appends stay aligned
+                with open(self.log_path, 'r+b') as log_file:
+                    log_file.truncate(body_end)
+        return replayed
+
+    def _start_log(self, base_seq: int):
+        """Atomically replace the log with an empty one starting at base_seq"""
+        temp_path = self.log_path + '.tmp'
+        with open(temp_path, 'wb') as log_file:
+            log_file.write(LOG_HEADER.pack(LOG_MAGIC, base_seq))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        os.replace(temp_path, self.log_path)
+
+    def request_snapshot(self):
+        """Ask the writer thread to take a snapshot as soon as possible"""
+        self._snapshot_requested.set()
+        self._queue.put(None)
+
+    def _run_writer(self, snapshot_seq: int):
+        log_file = open(self.log_path, 'ab')
+        names_file = open(self.names_path, 'a', encoding='utf-8')
+        last_snapshot = last_compaction = time.monotonic()
+        running = True
+
+        try:
+            while running:
+                try:
+                    items = [self._queue.get(timeout=0 if self._compaction_pending else 1.0)]
+                except queue.Empty:
+                    items = []
+                while len(items) < 10000:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                records = []
+                for item in items:
+                    if item is None:
+                        continue
+                    if item == 'stop':
+                        running = False
+                        continue
+                    if item[0] >= snapshot_seq: # Earlier records are already in the snapshot
+                        records.append(LOG_RECORD.pack(*item[1:]))
+
+                if records:
+                    self._write_names(names_file)
+                    log_file.write(b''.join(records))
+                    log_file.flush()
+
+                # One slice per pass, so records keep being logged while a large backlog is compacted.
+                # Row numbers do not change, so the log stays valid and no snapshot is needed
+                if running and self.compaction_enabled and (
+                        self._compaction_pending or time.monotonic() - last_compaction >= self.compact_interval):
+                    try:
+                        self.compact()
+                    except Exception as e:
+                        self._compaction_pending = False
+                        logger.error(f"Contact store compaction failed: {e}")
+                    if not self._compaction_pending:
+                        last_compaction = time.monotonic()
+
+                due = self.snapshot_interval and time.monotonic() - last_snapshot >= self.snapshot_interval
+                if due or self._snapshot_requested.is_set() or (not running and self._final_snapshot):
+                    self._snapshot_requested.clear()
+                    self._write_names(names_file)
+                    log_file.close()
+                    snapshot_seq = self._write_snapshot()
+                    log_file = open(self.log_path, 'ab')
+                    last_snapshot = time.monotonic()
+        except Exception as e:
+            logger.error(f"Contact store writer stopped: {e}")
+        finally:
+            log_file.close()
+            names_file.close()
+
+    def _write_names(self, names_file):
+        with self._lock:
+            new_names = self._names[self._written_names:]
+        if new_names:
+            names_file.write(''.join(json.dumps(name) + '\n' for name in new_names))
+            names_file.flush()
+            os.fsync(names_file.fileno()) # Names must be durable before records refer to them
+            self._written_names += len(new_names)
+
+    def _write_snapshot(self) -> int:
+        """Persist the in-memory state, start a fresh log and return the snapshot's sequence number.
+        The table columns and the per-person and per-cell row arrays are copied under the lock, which
+        only pauses record() for a memory copy; pickling and writing the copy happen outside it."""
+        with self._lock:
+            seq = self.seq
+            state = {'seq': seq, 'table': self.table.copy(),
+                     'person_rows': {person: rows[:] for person, rows in self.graph.rows.items()},
+                     'cells': {cell: rows[:] for cell, rows in self.cells.items()},
+                     'person_spans': dict(self.graph.spans), 'cell_spans': dict(self.cell_spans)}
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'wb') as snapshot_file:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        self._start_log(seq)
+        logger.info(f"Contact store snapshot written at {seq} records ({len(data)} bytes)")
+        return seq
+
+    def close(self, snapshot: bool = True):
+        """Flush pending records, optionally write a final snapshot and stop the writer"""
+        if self._compactor is not None:
+            self._stop_compactor.set()
+            self._compactor.join()
+            self._compactor = None
+        if self._writer is None:
+            return
+        self._final_snapshot = snapshot
+        self._queue.put('stop')
+        self._writer.join()
+        self._writer = None
+
+def _index_row(graph: ContactGraph, cells: Dict[Tuple[int, int], array], cell_spans: Dict[Tuple[int, int], int],
+               table: EncounterTable, row: int):
+    # Add one encounter row to the person and cell indexes
+    i = table.index(row)
+    graph.add(row, table.person1[i], table.person2[i])
+    position = (table.x[i], table.y[i])
+    cell = cells.get(position)
+    if cell is None:
+        cell = cells[position] = array('I')
+    cell.append(row)
+    _widen_cell(cell_spans, table, row)
+
+def _widen_cell(cell_spans: Dict[Tuple[int, int], int], table: EncounterTable, row: int):
+    i = table.index(row)
+    span = table.end[i] - table.ts[i]
+    if span:
+        position = (table.x[i], table.y[i])
+        if span > cell_spans.get(position, 0):
+            cell_spans[position] = span
+
+def _columns(table: EncounterTable) -> Tuple[array, ...]:
+    return table.person1, table.person2, table.x, table.y, table.ts, table.end
+
+def _index_rows(kept: EncounterTable, first: int, person1s, person2s, cells) -> Tuple[Dict[int, array], Dict[Tuple[int, int], array]]:
+    # Index entries of kept, numbered from first, for every person and cell of the rows it was made from
+    person_rows: Dict[int, array] = {person: array('I') for person in set(person1s) | set(person2s)}
+    cell_rows: Dict[Tuple[int, int], array] = {cell: array('I') for cell in cells}
+    for i in range(len(kept)):
+        row = first + i
+        person_rows[kept.person1[i]].append(row)
+        person_rows[kept.person2[i]].append(row)
+        cell_rows[(kept.x[i], kept.y[i])].append(row)
+    return person_rows, cell_rows
+
+def _swap_rows(index: Dict, replaced: Dict, low: int, high: int):
+    # Replace the entries for rows low..high-1 in each of index's arrays with the renumbered ones
+    for key, rows in replaced.items():
+        current = index[key]
+        first = bisect_left(current, low)
+        current[first:bisect_left(current, high, first)] = rows
+        if not current:
+            del index[key]
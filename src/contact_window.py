@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Time windows for contact detection.
+
+Two people who stay together are seen in contact on every position update, so
+the tracker folds those sightings into encounters:
+  - an encounter opens the first time a pair is seen together and stays open
+    while they keep being seen within merge_gap seconds of each other
+  - it is recorded (and both people notified) once it has lasted min_dwell seconds
+  - it ends merge_gap seconds after the pair was last seen together, and its end
+    time is the last sighting
+
+Open encounters and tracked positions expire through a TimerWheel, so stale
+state is dropped without ever scanning everything that is tracked.
+"""
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+class TimerWheel:
+    """
+    Hashed timer wheel keyed by arbitrary hashable keys.
+    Deadlines are bucketed into slots `resolution` seconds wide, so scheduling,
+    rescheduling and cancelling are O(1) and expire() only visits the slots that
+    time has passed. Keys expire at most one resolution after their deadline.
+    Deadlines further out than the wheel spans wait in their slot for later laps.
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.resolution = resolution
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self.deadlines: Dict[Hashable, float] = {}
+        self.slot_of: Dict[Hashable, int] = {}
+        self.current: Optional[int] = None  # First tick whose slot has not been expired yet
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.deadlines
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Set key's deadline, replacing any earlier one"""
+        tick = int(deadline // self.resolution)
+        if self.current is None or tick < self.current:
+            self.current = tick  # Already due or earlier than anything so far, expire() starts from this slot
+        slot = tick % len(self.slots)
+        old_slot = self.slot_of.get(key)
+        if old_slot != slot:
+            if old_slot is not None:
+                self.slots[old_slot].discard(key)
+            self.slots[slot].add(key)
+            self.slot_of[key] = slot
+        self.deadlines[key] = deadline
+
+    def cancel(self, key: Hashable):
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].discard(key)
+            del self.deadlines[key]
+
+    def expire(self, now: float) -> List[Hashable]:
+        """Remove and return every key whose deadline has passed"""
+        target = int(now // self.resolution)
+        if self.current is None or target <= self.current:
+            return []  # Nothing new is due, the common case on a hot path
+
+        expired = []
+        for tick in range(self.current, min(target, self.current + len(self.slots))):
+            slot = self.slots[tick % len(self.slots)]
+            for key in [key for key in slot if self.deadlines[key] <= now]:
+                slot.discard(key)
+                del self.slot_of[key]
+                del self.deadlines[key]
+                expired.append(key)
+        self.current = target
+        return expired
+
+class Encounter:
+    """Sightings of two people together with no gap longer than the merge gap"""
+    __slots__ = ('pair', 'start', 'last_seen', 'position', 'handle')
+
+    def __init__(self, pair: Tuple[str, str], start: float, position: Tuple[int, int]):
+        self.pair = pair
+        self.start = start
+        self.last_seen = start
+        self.position = position  # Where the pair was first seen together
+        self.handle: Optional[int] = None  # Contact store handle once recorded
+
+class EncounterWindow:
+    """Open encounters between pairs of people, see the module docstring"""
+
+    def __init__(self, min_dwell: float = 0.0, merge_gap: float = 5.0, resolution: float = 1.0):
+        self.min_dwell = min_dwell
+        self.merge_gap = merge_gap
+        self.open: Dict[Tuple[str, str], Encounter] = {}
+        self.pairs_of: Dict[str, Set[Tuple[str, str]]] = {}  # Person -> pairs with an open encounter
+        self.wheel = TimerWheel(resolution)
+
+    def __len__(self) -> int:
+        return len(self.open)
+
+    def observe(self, person1: str, person2: str, position: Tuple[int, int], now: float) -> Optional[Encounter]:
+        """Note that two people were seen in contact at now.
+        Returns their encounter when it has just lasted min_dwell and should be recorded."""
+        key = (person1, person2) if person1 < person2 else (person2, person1)
+        encounter = self.open.get(key)
+        if encounter is None:
+            encounter = self.open[key] = Encounter(key, now, position)
+            for person in key:
+                pairs = self.pairs_of.get(person)
+                if pairs is None:
+                    pairs = self.pairs_of[person] = set()
+                pairs.add(key)
+        elif now > encounter.last_seen:
+            encounter.last_seen = now
+        self.wheel.schedule(key, encounter.last_seen + self.merge_gap)
+        if encounter.handle is None and encounter.last_seen - encounter.start >= self.min_dwell:
+            return encounter
+        return None
+
+    def close(self, person1: str, person2: str) -> Optional[Encounter]:
+        """Close the pair's open encounter now, returns it if it was recorded"""
+        key = (person1, person2) if person1 < person2 else (person2, person1)
+        if key not in self.open:
+            return None
+        self.wheel.cancel(key)
+        encounter = self._pop(key)
+        return encounter if encounter.handle is not None else None
+
+    def close_person(self, person: str) -> List[Encounter]:
+        """Close every open encounter of person now, returns the ones that were recorded"""
+        ended = []
+        for key in list(self.pairs_of.get(person, ())):
+            self.wheel.cancel(key)
+            encounter = self._pop(key)
+            if encounter.handle is not None:
+                ended.append(encounter)
+        return ended
+
+    def _pop(self, key: Tuple[str, str]) -> Encounter:
+        for person in key:
+            pairs = self.pairs_of[person]
+            pairs.discard(key)
+            if not pairs:
+                del self.pairs_of[person]
+        return self.open.pop(key)
+
+    def expire(self, now: float) -> List[Encounter]:
+        """Close encounters not seen for merge_gap, returns the ones that were recorded"""
+        ended = []
+        for key in self.wheel.expire(now):
+            encounter = self._pop(key)
+            if encounter.handle is not None:
+                ended.append(encounter)
+        return ended
+
+    def close_all(self) -> List[Encounter]:
+        """Close every open encounter, returns the ones that were recorded"""
+        ended = [encounter for encounter in self.open.values() if encounter.handle is not None]
+        self.open.clear()
+        self.pairs_of.clear()
+        self.wheel = TimerWheel(self.wheel.resolution, len(self.wheel.slots))
+        return ended
@@ -1,10 +1,6 @@
 #!/usr/bin/env python
-import requests
-import random
-import time
-import json
-import sys
-from requests.auth import HTTPBasicAuth
+from sharding import shard_queue, shard_routing_key
+from transport import HttpTransport
 #
 # Configuration
 RABBITMQ_HOST = 'localhost'
@@ -14,61 +10,38 @@ EXCHANGE_NAME = 'contact_tracing'
 QUEUE_POSITION = 'position_queue'
 QUEUE_QUERY = 'query_queue'
 QUEUE_RESPONSE = 'query_response_queue'
-QUEUE_CONTACT_NOTIFICATIONS = 'contact_notifications_queue'
 ROUTING_KEY_POSITION = 'position'
 ROUTING_KEY_QUERY = 'query'
 ROUTING_KEY_QUERY_RESPONSE = 'query-response'
-ROUTING_KEY_CONTACT_NOTIFICATIONS = 'contact-notifications'  # Routing key for contact notifications
 USERNAME = 'guest'
 PASSWORD = 'guest'
 
-auth = HTTPBasicAuth(USERNAME, PASSWORD)
-
-def create_exchange_and_queues():
-    """Create exchange and queues via RabbitMQ HTTP API."""
-    headers = {'content-type': 'application/json'}
+def create_exchange_and_queues(transport=None, shards: int = 1):
+    """Create the exchange, queues and bindings.
+    Uses the given transport, or the RabbitMQ HTTP API when none is supplied.
+    With more than one shard each shard gets its own position and query queue instead."""
+    if transport is None:
+        transport = HttpTransport(RABBITMQ_API_URL, USERNAME, PASSWORD, EXCHANGE_NAME)
 
     # Create the exchange
-    exchange_data = {
-        'type': 'topic',
-        'durable': True
-    }
-    exchange_url = f'{RABBITMQ_API_URL}/exchanges/%2F/{EXCHANGE_NAME}'
-    requests.put(exchange_url, auth=auth, headers=headers, data=json.dumps(exchange_data))
-
-    # Create position queue
-    position_queue_data = {'durable': True}
-    position_queue_url = f'{RABBITMQ_API_URL}/queues/%2F/{QUEUE_POSITION}'
-    requests.put(position_queue_url, auth=auth, headers=headers, data=json.dumps(position_queue_data))
-
-    # Create query queue
-    query_queue_data = {'durable': True}
-    query_queue_url = f'{RABBITMQ_API_URL}/queues/%2F/{QUEUE_QUERY}'
-    requests.put(query_queue_url, auth=auth, headers=headers, data=json.dumps(query_queue_data))
-
-    # Create query response queue
-    response_queue_data = {'durable': True}
-    response_queue_url = f'{RABBITMQ_API_URL}/queues/%2F/{QUEUE_RESPONSE}'
-    requests.put(response_queue_url, auth=auth, headers=headers, data=json.dumps(response_queue_data))
-
-    # Create contact notifications queue
-    contact_notifications_queue_data = {'durable': True}
-    contact_notifications_queue_url = f'{RABBITMQ_API_URL}/queues/%2F/{QUEUE_CONTACT_NOTIFICATIONS}'
-    requests.put(contact_notifications_queue_url, auth=auth, headers=headers, data=json.dumps(contact_notifications_queue_data))
+    transport.declare_exchange(EXCHANGE_NAME, 'topic', durable=True)
+
+    # Create the durable queues
+    # Contact notification queues are per person and created by each person (see Person.setup_notification_queue)
+    transport.declare_queue(QUEUE_RESPONSE, durable=True)
+    transport.bind_queue(QUEUE_RESPONSE, ROUTING_KEY_QUERY_RESPONSE, EXCHANGE_NAME)
+
+    if shards > 1:
+        # Positions are routed to their region's shard, every shard receives every query (see sharding.py)
+        for shard in range(shards):
+            transport.declare_queue(shard_queue(QUEUE_POSITION, shard), durable=True)
+            transport.bind_queue(shard_queue(QUEUE_POSITION, shard), shard_routing_key(ROUTING_KEY_POSITION, shard), EXCHANGE_NAME)
+            transport.declare_queue(shard_queue(QUEUE_QUERY, shard), durable=True)
+            transport.bind_queue(shard_queue(QUEUE_QUERY, shard), ROUTING_KEY_QUERY, EXCHANGE_NAME)
+        return
 
     # Bind the queues to the exchange with the appropriate routing keys
-    bind_data = {'routing_key': 'position'}
-    bind_url = f'{RABBITMQ_API_URL}/bindings/%2F/e/{EXCHANGE_NAME}/q/{QUEUE_POSITION}'
-    requests.post(bind_url, auth=auth, headers=headers, data=json.dumps(bind_data))
-
-    bind_data = {'routing_key': 'query'}
-    bind_url = f'{RABBITMQ_API_URL}/bindings/%2F/e/{EXCHANGE_NAME}/q/{QUEUE_QUERY}'
-    requests.post(bind_url, auth=auth, headers=headers, data=json.dumps(bind_data))
-
-    bind_data = {'routing_key': 'query-response'}
-    bind_url = f'{RABBITMQ_API_URL}/bindings/%2F/e/{EXCHANGE_NAME}/q/{QUEUE_RESPONSE}'
-    requests.post(bind_url, auth=auth, headers=headers, data=json.dumps(bind_data))
-
-    bind_data = {'routing_key': 'contact-notifications'}
-    bind_url = f'{RABBITMQ_API_URL}/bindings/%2F/e/{EXCHANGE_NAME}/q/{QUEUE_CONTACT_NOTIFICATIONS}'
-    requests.post(bind_url, auth=auth, headers=headers, data=json.dumps(bind_data))
\ No newline at end of file
+    for queue_name in [QUEUE_POSITION, QUEUE_QUERY]:
+        transport.declare_queue(queue_name, durable=True)
+    transport.bind_queue(QUEUE_POSITION, ROUTING_KEY_POSITION, EXCHANGE_NAME)
+    transport.bind_queue(QUEUE_QUERY, ROUTING_KEY_QUERY, EXCHANGE_NAME)
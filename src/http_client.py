@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Shared client for the RabbitMQ management HTTP API.
+
+Holds one pooled requests.Session per API endpoint and credentials, so calls
+reuse keep-alive connections instead of opening a new TCP connection and
+redoing basic auth every time. Every request has a timeout. Connection failures
+are retried with a short backoff; requests that reached the broker are not, so a
+publish or /get is never repeated.
+"""
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+class RabbitMQClient:
+    """Keep-alive, pooled session for one management API endpoint"""
+
+    def __init__(self, api_url: str, username: str, password: str,
+                 timeout: float = 10.0, retries: int = 3, pool_size: int = 10):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = (min(timeout, 3.05), timeout)  # (connect, read) seconds
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, password)
+        self.session.headers.update({'content-type': 'application/json'})
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0, # The broker may already have acted on the request
+            status=retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'PUT', 'DELETE'}), # Status retries only for idempotent calls
+            backoff_factor=0.1,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method: str, path: str, payload: Optional[dict] = None) -> requests.Response:
+        """Send a request to path (relative to the API url) and raise for error statuses"""
+        response = self.session.request(
+            method,
+            f'{self.api_url}/{path.lstrip("/")}',
+            data=json.dumps(payload) if payload is not None else None,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response
+
+    def post(self, path: str, payload: Optional[dict] = None) -> requests.Response:
+        return self.request('POST', path, payload)
+
+    def close(self):
+        self.session.close()
+
+_clients: Dict[Tuple[str, str, str], RabbitMQClient] = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_url: str, username: str, password: str, **options) -> RabbitMQClient:
+    """Return the process-wide client for this endpoint and user, creating it on first use"""
+    key = (api_url, username, password)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = RabbitMQClient(api_url, username, password, **options)
+        return client
+
+def close_clients():
+    """Close every shared client, e.g. on shutdown"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Non-blocking logging shared by the tracker, person and simulation applications.
+
+Records are put on a bounded in-memory queue by the thread that logs them and a
+background QueueListener writes them to the log file and console, so a message
+handler never waits on disk. If the writer falls behind and the queue fills,
+new records are dropped and counted rather than blocking the caller.
+
+Per-message log lines go through a LogSampler, which lets a fixed number of
+them through each second and reports how many similar lines were suppressed on
+the next one that passes.
+
+LOG_FORMAT=json writes one JSON object per line, including any `extra` fields.
+"""
+import atexit
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has, anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with time, level, logger, message and any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogSampler:
+    """
+    Rate limit for one per-message log line: at most `rate` records per second pass.
+    sample() returns None for a record to skip, otherwise a suffix for the message
+    that reports how many were skipped since the last one. Counts may be slightly
+    off when several threads share a sampler, which is fine for logging.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate  # Records per second, 0 lets every record through
+        self.window = 0
+        self.passed = 0
+        self.suppressed = 0
+
+    def sample(self) -> Optional[str]:
+        if not self.rate:
+            return ''
+        now = int(time.monotonic())
+        if now != self.window:
+            self.window = now
+            self.passed = 0
+        if self.passed >= self.rate:
+            self.suppressed += 1
+            return None
+        self.passed += 1
+        if not self.suppressed:
+            return ''
+        suffix = f" (+{self.suppressed} similar messages suppressed)"
+        self.suppressed = 0
+        return suffix
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[DroppingQueueHandler] = None
+
+def setup_logging(log_file: str, log_format: str = 'text', level: int = logging.INFO, queue_size: int = 10000):
+    """
+    Configure the root logger to write log_file and the console through a background writer.
+    Like logging.basicConfig, does nothing if the root logger already has handlers.
+    """
+    global _listener, _handler
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(queue_size)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    _handler = DroppingQueueHandler(log_queue)
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+def dropped_records() -> int:
+    """Records dropped because the log writer fell behind"""
+    return _handler.dropped if _handler is not None else 0
+
+def stop_logging():
+    """Write out every queued record and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
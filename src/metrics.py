@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Lightweight metrics used by the tracker.
+Histograms use fixed buckets so observing a value is a short bisect under a lock.
+Counters are a locked add, and gauges and counters kept elsewhere are read only
+when scraped, so the hot path pays well under a microsecond per metric.
+
+A MetricsRegistry renders its metrics in the Prometheus text format and
+serve_metrics exposes them at http://<host>:<port>/metrics.
+"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Exponential latency buckets from 0.5ms to ~65s (upper bounds, in seconds)
+DEFAULT_LATENCY_BUCKETS = tuple(0.0005 * 2 ** i for i in range(18))
+
+# Exponential buckets from 10us to ~1.3s, for per-message processing and broker calls
+FAST_LATENCY_BUCKETS = tuple(0.00001 * 2 ** i for i in range(18))
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in seconds"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot counts values above the largest bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        if value < 0:
+            value = 0.0  # Clock skew between publisher and tracker
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Estimate the q-th percentile (0-100) by interpolating inside the matching bucket"""
+        with self._lock:
+            counts, total, largest = list(self.counts), self.count, self.max
+        if not total:
+            return None
+
+        rank = q / 100 * total
+        cumulative = 0
+        for slot, bucket_count in enumerate(counts):
+            if not bucket_count or cumulative + bucket_count < rank:
+                cumulative += bucket_count
+                continue
+            lower = self.buckets[slot - 1] if slot > 0 else 0.0
+            upper = self.buckets[slot] if slot < len(self.buckets) else largest
+            upper = min(upper, largest)
+            fraction = (rank - cumulative) / bucket_count
+            return lower + (upper - lower) * max(0.0, min(fraction, 1.0))
+        return largest
+
+    def snapshot(self) -> Dict:
+        """Return count, mean and the usual percentiles as a plain dict"""
+        with self._lock:
+            count, total, largest = self.count, self.sum, self.max
+        return {
+            'count': count,
+            'mean': total / count if count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': largest if count else None
+        }
+
+    def cumulative(self) -> Tuple[List[int], float, int]:
+        """Return (cumulative count per bucket including the overflow slot, sum, count)"""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        running = 0
+        for slot, bucket_count in enumerate(counts):
+            running += bucket_count
+            counts[slot] = running
+        return counts, total, count
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+def format_latency(snapshot: Dict) -> str:
+    """Render a histogram snapshot as a single log line in milliseconds"""
+    if not snapshot['count']:
+        return "no samples"
+    parts: List[str] = [f"n={snapshot['count']}"]
+    for key in ('mean', 'p50', 'p95', 'p99', 'max'):
+        parts.append(f"{key}={snapshot[key] * 1000:.1f}ms")
+    return ' '.join(parts)
+
+class Counter:
+    """Monotonically increasing count, either incremented directly or read from a function when scraped"""
+
+    def __init__(self, function: Optional[Callable[[], float]] = None):
+        self.function = function
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+class Gauge:
+    """Value that can go up and down, either set directly or read from a function when scraped"""
+
+    def __init__(self, function: Optional[Callable[[], float]] = None):
+        self.function = function
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+class MetricsRegistry:
+    """Named metrics, optionally labelled, rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Tuple[str, str, Dict[Tuple, object]]] = {}  # name -> (type, help, labels -> metric)
+        self._lock = threading.Lock()
+
+    def _register(self, kind: str, name: str, help_text: str, labels: Optional[Dict[str, str]], metric):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            registered_kind, _, series = self._metrics.setdefault(name, (kind, help_text, {}))
+            if registered_kind != kind:
+                raise ValueError(f"Metric {name} is already registered as a {registered_kind}")
+            return series.setdefault(key, metric)
+
+    def counter(self, name: str, help_text: str, function: Optional[Callable[[], float]] = None,
+                labels: Optional[Dict[str, str]] = None) -> Counter:
+        return self._register('counter', name, help_text, labels, Counter(function))
+
+    def gauge(self, name: str, help_text: str, function: Optional[Callable[[], float]] = None,
+              labels: Optional[Dict[str, str]] = None) -> Gauge:
+        return self._register('gauge', name, help_text, labels, Gauge(function))
+
+    def histogram(self, name: str, help_text: str, labels: Optional[Dict[str, str]] = None,
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+                  histogram: Optional[LatencyHistogram] = None) -> LatencyHistogram:
+        """Register a histogram, or an existing LatencyHistogram under this name"""
+        return self._register('histogram', name, help_text, labels, histogram or LatencyHistogram(buckets))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = [(name, kind, help_text, dict(series)) for name, (kind, help_text, series) in self._metrics.items()]
+        lines: List[str] = []
+        for name, kind, help_text, series in sorted(metrics):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series.items():
+                if kind == 'histogram':
+                    counts, total, count = metric.cumulative()
+                    bounds = [_format_value(bound) for bound in metric.buckets] + ['+Inf']
+                    for bound, bucket_count in zip(bounds, counts):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(metric.get())}")
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def serve_metrics(registry: MetricsRegistry, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve registry at http://host:port/metrics on a daemon thread, stop it with server.shutdown()"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass # Scrapes are not worth a log line each
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
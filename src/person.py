@@ -1,18 +1,23 @@
 #!/usr/bin/env python
-import requests
 import random
+import threading
 import time
-import json
 import sys
 import os
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from dotenv import load_dotenv
 import logging
-from requests.auth import HTTPBasicAuth
 from requests.exceptions import RequestException
 from contextlib import contextmanager
 from create import create_exchange_and_queues
+from http_client import close_clients
+from log_setup import LogSampler, setup_logging
+from publisher import FixedRateTicker, Position, PositionBuffer, check_policy
+from sharding import GridPartition, position_messages
+from topology import Topology
+from wire import check_format, decode_notification, encode_position
+from transport import TransportError, create_transport
 
 @dataclass
 class Config:
@@ -38,13 +43,28 @@ class Config:
         # Configuration
         self.RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
         self.RABBITMQ_API_PORT = os.getenv('RABBITMQ_API_PORT', '15672')  # Default port for RabbitMQ API
+        self.RABBITMQ_AMQP_PORT = int(os.getenv('RABBITMQ_AMQP_PORT', '5672'))  # Default port for AMQP clients
+        self.TRANSPORT = os.getenv('TRANSPORT', 'amqp')  # amqp, http or local
         self.EXCHANGE_NAME = os.getenv('EXCHANGE_NAME', 'contact_tracing')
         self.QUEUE_POSITION = os.getenv('QUEUE_POSITION', 'position_queue')
         self.QUEUE_QUERY = 'query_queue'
         self.QUEUE_RESPONSE = 'query_response_queue'
-        self.QUEUE_CONTACT_NOTIFICATIONS = os.getenv('QUEUE_CONTACT_NOTIFICATIONS', 'contact_notifications_queue')
+        self.QUEUE_CONTACT_NOTIFICATIONS = os.getenv('QUEUE_CONTACT_NOTIFICATIONS', 'contact_notifications_queue')  # Prefix of each person's own queue
+        self.ROUTING_KEY_CONTACT_NOTIFICATIONS = os.getenv('ROUTING_KEY_CONTACT_NOTIFICATIONS', 'contact-notifications')
+        self.NOTIFICATION_QUEUE_EXPIRY = int(os.getenv('NOTIFICATION_QUEUE_EXPIRY', '600'))  # Seconds an unused notification queue is kept
         self.ROUTING_KEY_POSITION = os.getenv('ROUTING_KEY_POSITION', 'position')
         self.GRID_SIZE = int(os.getenv('GRID_SIZE', '10'))
+        self.GRID_TOPOLOGY = os.getenv('GRID_TOPOLOGY', 'bounded')  # bounded or toroidal, see topology.py
+        self.GRID_OBSTACLES = os.getenv('GRID_OBSTACLES', '')  # File of cells nobody can enter, empty for none
+        self.SHARD_COLUMNS = int(os.getenv('SHARD_COLUMNS', '1'))  # Must match the tracker shards, see sharding.py
+        self.SHARD_ROWS = int(os.getenv('SHARD_ROWS', '1'))
+        self.CONTACT_RADIUS = int(os.getenv('CONTACT_RADIUS', '0'))  # Positions this close to another region are also sent there
+        self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text or json
+        self.WIRE_FORMAT = check_format(os.getenv('WIRE_FORMAT', 'json'))  # json or binary position messages, see wire.py
+        self.LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '10'))  # Max "Moved to" lines per second, 0 logs every move
+        self.PUBLISH_BATCH_SIZE = int(os.getenv('PUBLISH_BATCH_SIZE', '100'))  # Max positions sent in one publish
+        self.PUBLISH_BUFFER_SIZE = int(os.getenv('PUBLISH_BUFFER_SIZE', '1000'))  # Positions kept waiting before the oldest are dropped
+        self.POSITION_COALESCE = check_policy(os.getenv('POSITION_COALESCE', 'cell'))  # none, cell or latest, see publisher.py
 
         #timestamp format configuration
         self.TIMESTAMP_FORMAT = os.getenv('TIMESTAMP_FORMAT', '%d-%m-%Y %H:%M:%S')
@@ -58,50 +78,102 @@ class Person:
         self.config = config
         self.person_identifier = person_identifier.lower()
         self.move_speed = move_speed
-        self.auth = HTTPBasicAuth(config.USERNAME, config.PASSWORD)
+        self.transport = create_transport(config)
+        # Each person has their own notification queue so the tracker can route notifications directly to them
+        self.notification_queue = f'{config.QUEUE_CONTACT_NOTIFICATIONS}.{self.person_identifier}'
+        self.notification_routing_key = f'{config.ROUTING_KEY_CONTACT_NOTIFICATIONS}.{self.person_identifier}'
+        self.topology = Topology.from_config(config) # Grid edges and obstacles
+        self.partition = GridPartition.from_config(config)
+        self.regions = set() # Shard regions that currently hold this person's position
+        self.seq = int(time.time() * 1000) # Position sequence number, starts from the clock so it keeps growing across restarts
+        self.buffer = PositionBuffer(config.PUBLISH_BUFFER_SIZE, config.POSITION_COALESCE)
+        self.sender = threading.Thread(target=self.send_positions, name='position-sender', daemon=True)
+        self.sent = 0
         self.setup_logging()
         
     def setup_logging(self):
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f'person_{self.person_identifier}.log'),
-                logging.StreamHandler()
-            ]
-        )
+        setup_logging(f'person_{self.person_identifier}.log', self.config.LOG_FORMAT)
         self.logger = logging.getLogger(__name__)
+        self.move_log = LogSampler(self.config.LOG_SAMPLE_RATE)
 
     @contextmanager
     def error_handling(self, operation: str):
         """Context manager for consistent error handling"""
         try:
             yield
+        except TransportError as e:
+            self.logger.error(f"Transport error during {operation}: {e}")
         except RequestException as e:
             self.logger.error(f"Request error during {operation}: {e}")
         except Exception as e:
             self.logger.error(f"Unexpected error during {operation}: {e}")
 
-    def publish_position(self, x: int, y: int):
-        """Publish the person's position to RabbitMQ via the HTTP API."""
-        message = {
-            'properties': {},
-            'routing_key': self.config.ROUTING_KEY_POSITION,
-            'payload': json.dumps({'person': self.person_identifier, 'x': x, 'y': y}),
-            'payload_encoding': 'string'
-        }
-        
-        publish_url = f'{self.config.api_url}/exchanges/%2F/{self.config.EXCHANGE_NAME}/publish'
-        
+    def next_seq(self) -> int:
+        # Every update gets a higher sequence number so the tracker can drop duplicates and stale redeliveries
+        self.seq += 1
+        return self.seq
+
+    def publish_positions(self, positions: List[Position]):
+        """Publish a batch of the person's positions to RabbitMQ."""
+        if self.partition.regions > 1:
+            self.publish_sharded_positions(positions)
+            return
+        messages = []
+        for position in positions:
+            payload, properties = encode_position(self.config.WIRE_FORMAT, self.person_identifier,
+                                                  position.x, position.y, position.ts, position.seq)
+            messages.append((self.config.ROUTING_KEY_POSITION, payload, properties))
+
         with self.error_handling("publishing position"):
-            response = requests.post(
-                publish_url,
-                auth=self.auth,
-                headers={'content-type': 'application/json'},
-                json=message
-            )
-            response.raise_for_status()
-            self.logger.info(f"Moved to ({x}, {y})")
+            if len(messages) == 1:
+                self.transport.publish(*messages[0])  # No transaction needed for a single message
+            else:
+                self.transport.publish_batch(messages)
+            self.log_sent(positions, "")
+
+    def publish_sharded_positions(self, positions: List[Position]):
+        """Publish each position to the shard that owns it and as a ghost to nearby shards.
+        Shards that held the person but are now out of reach get a leave message."""
+        messages, regions = [], self.regions
+        for position in positions:
+            shard_messages, regions = position_messages(self.partition, self.config.ROUTING_KEY_POSITION,
+                                                        self.person_identifier, (position.x, position.y), position.ts,
+                                                        regions, position.seq, self.config.WIRE_FORMAT)
+            messages.extend(shard_messages)
+
+        with self.error_handling("publishing position"):
+            self.transport.publish_batch(messages)
+            self.regions = regions
+            last = positions[-1]
+            self.log_sent(positions, f" in region {self.partition.region_of((last.x, last.y))}")
+
+    def log_sent(self, positions: List[Position], where: str):
+        self.sent += len(positions)
+        suffix = self.move_log.sample()
+        if suffix is not None:
+            last = positions[-1]
+            batch = f" ({len(positions)} positions sent together)" if len(positions) > 1 else ""
+            self.logger.info(f"Moved to ({last.x}, {last.y}){where}{batch}{suffix}",
+                             extra={'person': self.person_identifier, 'position': (last.x, last.y)})
+
+    def send_positions(self):
+        """Sender thread: publish buffered positions in batches and check for contact notifications.
+        All broker calls happen here, so a slow broker never holds up the walk."""
+        poll_interval = max(self.move_speed, 0.1)
+        next_poll = time.monotonic()
+        dropped = 0
+        while True:
+            positions = self.buffer.take(self.config.PUBLISH_BATCH_SIZE, timeout=poll_interval)
+            if positions:
+                self.publish_positions(positions)
+            elif self.buffer.closed:
+                break
+            if self.buffer.dropped > dropped:
+                self.logger.warning(f"Position buffer full, dropped {self.buffer.dropped - dropped} of the oldest positions")
+                dropped = self.buffer.dropped
+            if time.monotonic() >= next_poll:
+                self.consume_contact_notifications()
+                next_poll = time.monotonic() + poll_interval
 
     def print_contact_notification(self, payload: dict):
         """Format and print the contact notification message."""
@@ -110,78 +182,61 @@ class Person:
         elif payload['contact_person'] == self.person_identifier:
             print(f"You made contact with {payload['person']} at {payload['timestamp']} @ {tuple(payload['location'])}")
 
+    def setup_notification_queue(self):
+        """Declare this person's notification queue and bind it to their routing key.
+        The broker deletes the queue once it has been unused for NOTIFICATION_QUEUE_EXPIRY
+        seconds, so it survives reconnects but not an abandoned person."""
+        self.transport.declare_queue(
+            self.notification_queue,
+            durable=False,
+            arguments={'x-expires': self.config.NOTIFICATION_QUEUE_EXPIRY * 1000}
+        )
+        self.transport.bind_queue(self.notification_queue, self.notification_routing_key)
+
     def consume_contact_notifications(self):
-        """Consume contact notifications from the contact_notifications queue."""
-        consume_url = f'{self.config.api_url}/queues/%2F/{self.config.QUEUE_CONTACT_NOTIFICATIONS}/get'
-        
+        """Consume all pending contact notifications from this person's queue."""
         with self.error_handling("consuming notifications"):
-            response = requests.post(
-                consume_url,
-                auth=self.auth,
-                json={
-                    'count': 1,
-                    'ackmode': 'ack_requeue_false',
-                    'encoding': 'auto'
-                }
-            )
-            response.raise_for_status()
+            deliveries = self.transport.get(self.notification_queue, count=10)
             
-            if response.status_code == 200 and response.json():
-                message = response.json()[0]
-                payload = json.loads(message['payload'])
-                
-                # Check if this message is relevant for this person
-                if payload['person'] == self.person_identifier or payload['contact_person'] == self.person_identifier:
-                    self.print_contact_notification(payload)
-                else:
-                    # If message isn't for this person, requeue it
-                    self.requeue_notification(message['payload'])
-
-    def requeue_notification(self, payload: str):
-        """Requeue a notification that wasn't meant for this person."""
-        publish_url = f'{self.config.api_url}/exchanges/%2F/{self.config.EXCHANGE_NAME}/publish'
-        
-        message = {
-            'properties': {},
-            'routing_key': 'contact-notifications',
-            'payload': payload,
-            'payload_encoding': 'string'
-        }
-        
-        with self.error_handling("requeuing notification"):
-            response = requests.post(
-                publish_url,
-                auth=self.auth,
-                headers={'content-type': 'application/json'},
-                json=message
-            )
-            response.raise_for_status()
+            for message in deliveries:
+                self.print_contact_notification(decode_notification(message.body))
 
     def move(self):
         """Simulate the movement of a person on the grid."""
-        x, y = random.randint(0, self.config.GRID_SIZE - 1), random.randint(0, self.config.GRID_SIZE - 1)
+        x, y = self.topology.random_cell()
         self.logger.info(f"Starting at position ({x}, {y})")
+        self.sender.start()
+        ticker = FixedRateTicker(self.move_speed)
 
         try:
             while True:
-                # Random movement in any direction
+                # Random movement in any direction, stopped by the grid edge or an obstacle (wrapping round on a torus)
                 dx, dy = random.choice([-1, 0, 1]), random.choice([-1, 0, 1])
-                x = max(0, min(x + dx, self.config.GRID_SIZE - 1))
-                y = max(0, min(y + dy, self.config.GRID_SIZE - 1))
+                x, y = self.topology.step(x, y, dx, dy)
 
-                # Publish the new position
-                self.publish_position(x, y)
-                
-                # Check for contact notifications
-                self.consume_contact_notifications()
+                # Queue the new position, the sender thread publishes it and checks for notifications
+                self.buffer.put(Position(x, y, time.time(), self.next_seq()))
 
-                # Wait before next move
-                time.sleep(self.move_speed)
+                # Wait for the next move, on a fixed schedule
+                missed = ticker.wait()
+                if missed:
+                    self.logger.warning(f"Walk fell {missed} moves behind schedule, skipping them")
                 
         except KeyboardInterrupt:
             self.logger.info("Movement stopped by user")
+            self.stop()
             sys.exit(0)
 
+    def stop(self, timeout: float = 5.0):
+        """Send the positions still waiting, then close the transport"""
+        self.buffer.close()
+        if self.sender.is_alive():
+            self.sender.join(timeout)
+        self.logger.info(f"Sent {self.sent} positions, {self.buffer.coalesced} coalesced, "
+                         f"{self.buffer.dropped} dropped from a full buffer, {len(self.buffer)} unsent")
+        self.transport.close()
+        close_clients() # Keep-alive sessions of the HTTP transport
+
 def main():
     if len(sys.argv) != 3:
         print("Usage: python person.py <person_identifier> <move_speed>")
@@ -192,11 +247,10 @@ def main():
         person_identifier = sys.argv[1]
         move_speed = float(sys.argv[2])
         
-        # Initialize queues
-        create_exchange_and_queues()
-        
-        # Create and run person
+        # Create person and initialize queues over its transport
         person = Person(config, person_identifier, move_speed)
+        create_exchange_and_queues(person.transport, person.partition.regions)
+        person.setup_notification_queue()
         person.move()
         
     except ValueError as e:
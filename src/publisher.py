@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Client-side position buffering for the person application.
+
+The walk only works out the next cell and puts it in a PositionBuffer. A
+background sender takes whatever is waiting and publishes it as one batch, so a
+slow broker delays sending but never the walk itself. When the sender falls
+behind, the waiting positions are coalesced under a policy:
+  - none:   send every position in order
+  - cell:   of consecutive positions on the same cell only the newest is sent,
+            so every cell the person passed through still reaches the tracker
+  - latest: only the newest position is sent
+If more than the buffer size are waiting the oldest are dropped.
+
+FixedRateTicker paces the walk on a fixed schedule, so time spent elsewhere in a
+step does not slow the movement rate down.
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, List, NamedTuple
+
+COALESCE_POLICIES = ('none', 'cell', 'latest')
+
+class Position(NamedTuple):
+    x: int
+    y: int
+    ts: float  # When the person moved there
+    seq: int
+
+def check_policy(policy: str) -> str:
+    if policy not in COALESCE_POLICIES:
+        raise ValueError(f"Unknown coalesce policy '{policy}', expected one of {', '.join(COALESCE_POLICIES)}")
+    return policy
+
+def coalesce_cells(positions: List[Position]) -> List[Position]:
+    """Keep only the newest of each run of positions on the same cell"""
+    kept: List[Position] = []
+    for position in positions:
+        if kept and kept[-1].x == position.x and kept[-1].y == position.y:
+            kept[-1] = position
+        else:
+            kept.append(position)
+    return kept
+
+class PositionBuffer:
+    """Bounded queue of positions waiting to be published, see the module docstring"""
+
+    def __init__(self, size: int = 1000, policy: str = 'cell'):
+        self.policy = check_policy(policy)
+        self.pending = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0  # Oldest positions pushed out of a full buffer
+        self.coalesced = 0  # Positions merged into a newer one and never sent
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def put(self, position: Position):
+        with self.condition:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(position)
+            self.condition.notify()
+
+    def take(self, limit: int, timeout: float) -> List[Position]:
+        """Wait up to timeout for positions, then remove and return up to limit of them after coalescing.
+        Returns an empty list on timeout or once the buffer is closed and empty."""
+        with self.condition:
+            if not self.pending and not self.closed:
+                self.condition.wait(timeout)
+            if not self.pending:
+                return []
+            if self.policy == 'latest':
+                positions = [self.pending[-1]]
+                self.coalesced += len(self.pending) - 1
+                self.pending.clear()
+                return positions
+            positions = [self.pending.popleft() for _ in range(min(limit, len(self.pending)))]
+        if self.policy == 'cell':
+            kept = coalesce_cells(positions)
+            with self.condition:
+                self.coalesced += len(positions) - len(kept)
+            return kept
+        return positions
+
+    def close(self):
+        """Wake the sender so it can send what is left and stop"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class FixedRateTicker:
+    """
+    Wakes every period seconds on a fixed schedule measured from the first wait.
+    Time spent between waits is taken out of the next sleep rather than added to
+    it, so the rate does not drift. Ticks that were missed entirely (a step took
+    longer than a period) are skipped rather than run back to back.
+    """
+
+    def __init__(self, period: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.next_tick = None
+
+    def wait(self) -> int:
+        """Sleep until the next tick, returns how many ticks were skipped"""
+        now = self.clock()
+        if self.next_tick is None:
+            self.next_tick = now
+        self.next_tick += self.period
+        if now < self.next_tick:
+            self.sleep(self.next_tick - now)
+            return 0
+        missed = int((now - self.next_tick) // self.period) if self.period > 0 else 0
+        self.next_tick += missed * self.period
+        return missed
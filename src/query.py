@@ -1,14 +1,20 @@
 #!/usr/bin/env python
-import requests # Importing librarys
-import sys
+import sys # Importing librarys
+import csv
+import io
 import json
-from requests.auth import HTTPBasicAuth
 import time
+import argparse
+from datetime import datetime
 from dotenv import load_dotenv
 import uuid
 import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, List, Optional
+from http_client import close_clients
+from transport import Delivery, Transport, TransportError, create_transport
 
 @dataclass
 class Config:
@@ -30,78 +36,294 @@ class Config:
         # RabbitMQ connection settings
         self.RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost') # Host where RabbitMQ server is running
         self.RABBITMQ_API_PORT = os.getenv('RABBITMQ_API_PORT', '15672') # Default RabbitMQ management API port
+        self.RABBITMQ_AMQP_PORT = int(os.getenv('RABBITMQ_AMQP_PORT', '5672')) # Default AMQP port
+        self.TRANSPORT = os.getenv('TRANSPORT', 'amqp') # amqp, http or local
 
         # Exchange and routing configuration
         self.EXCHANGE_NAME = os.getenv('EXCHANGE_NAME', 'contact_tracing') # Exchange for all contact tracing messages
         self.ROUTING_KEY_QUERY = os.getenv('ROUTING_KEY_QUERY', 'query') # Routing key for query requests
         self.ROUTING_KEY_RESPONSE = os.getenv('ROUTING_KEY_RESPONSE', 'query-response') # Routing key for query responses
-        self.QUEUE_RESPONSE = os.getenv('QUEUE_RESPONSE', 'query_response_queue') # Queue name for receiving responses
+        self.QUEUE_RESPONSE = os.getenv('QUEUE_RESPONSE', 'query_response_queue') # Prefix of each client's own reply queue
+        self.TIMESTAMP_FORMAT = os.getenv('TIMESTAMP_FORMAT', '%d-%m-%Y %H:%M:%S') # Format of --start/--end and printed times
+        self.QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', '30')) # Seconds to wait for a complete response
+        self.QUERY_REPLY_EXPIRY = float(os.getenv('QUERY_REPLY_EXPIRY', '60')) # Seconds an unused reply queue is kept by the broker
+        self.QUERY_PREFETCH = int(os.getenv('QUERY_PREFETCH', '100')) # Response chunks the broker pushes ahead of the client
+        self.QUERY_BULK_SIZE = int(os.getenv('QUERY_BULK_SIZE', '1000')) # Most people per bulk request, longer lists are split and sent together
+        self.OUTPUT_FORMAT = os.getenv('QUERY_OUTPUT_FORMAT', 'text') # text, json or csv, --format overrides it
+
+        # Sharded trackers each answer for their own region and the answers are merged here
+        self.SHARD_COLUMNS = int(os.getenv('SHARD_COLUMNS', '1'))
+        self.SHARD_ROWS = int(os.getenv('SHARD_ROWS', '1'))
     
     @property
     def api_url(self) -> str: # returns the base URL for the RabbitMQ HTTP API
         return f'http://{self.RABBITMQ_HOST}:{self.RABBITMQ_API_PORT}/api'
 
-def publish_query(config: Config, person: str) -> str:
-    """Send the query to RabbitMQ."""
-    headers = {'content-type': 'application/json'}
-    auth = HTTPBasicAuth(config.USERNAME, config.PASSWORD)
-    query_id = str(uuid.uuid4())  # Generate unique ID to match response with request
-    
-    message = { # Message payload
-        'properties': {},
-        'routing_key': config.ROUTING_KEY_QUERY,
-        'payload': json.dumps({
-            'query_id': query_id,
-            'query_person': person
-        }),
-        'payload_encoding': 'string'
-    }
-    
-    publish_url = f'{config.api_url}/exchanges/%2F/{config.EXCHANGE_NAME}/publish'
-    # Send request to RabbitMQ HTTP API
-    response = requests.post(publish_url, auth=auth, headers=headers, data=json.dumps(message))
-    
-    if response.status_code != 200:
-        print(f"Failed to send query for {person}: {response.text}")
-        sys.exit(1)
-        
-    return query_id
+    @property
+    def shards(self) -> int: # Number of tracker shards that answer each query
+        return self.SHARD_COLUMNS * self.SHARD_ROWS
 
-def get_response(config: Config, expected_query_id: str):
-    """Retrieve response for the specified query ID."""
-    url = f'{config.api_url}/queues/%2F/{config.QUEUE_RESPONSE}/get'
-    headers = {'content-type': 'application/json'}
-    auth = HTTPBasicAuth(config.USERNAME, config.PASSWORD)
-    
-    while True:
-        response = requests.post(
-            url,
-            auth=auth,
-            headers=headers,
-            data=json.dumps({
-                "count": 1,
-                "ackmode": "ack_requeue_false", # Remove message from queue after receiving
-                "encoding": "auto"
+class PendingQuery:
+    """The chunks received so far for one outstanding query, see QueryClient"""
+
+    def __init__(self, client: 'QueryClient', query_id: str, timeout: float):
+        self.client = client
+        self.query_id = query_id
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.shards: Dict[int, Dict[int, dict]] = {}  # Shard -> chunk number -> chunk
+        self.future: Future = Future()
+
+    def add(self, chunk: dict) -> bool:
+        """Add a response chunk, returns True once every shard's answer is complete"""
+        self.shards.setdefault(chunk.get('shard', 0), {})[chunk.get('chunk', 0)] = chunk
+        return len(self.shards) >= self.client.config.shards and all(_complete(chunks) for chunks in self.shards.values())
+
+    def body(self) -> dict:
+        return merge_shard_responses([assemble_response(list(chunks.values())) for chunks in self.shards.values()])
+
+    def result(self, timeout: Optional[float] = None) -> dict:
+        """Wait for the complete response, by default until QUERY_TIMEOUT after the query was sent.
+        Returns an error body if it does not arrive in time."""
+        if timeout is None:
+            timeout = max(0.0, self.deadline - time.monotonic())
+        try:
+            return self.future.result(timeout)
+        except FutureTimeout:
+            self.client.forget(self.query_id)
+            config = self.client.config
+            missing = config.shards - sum(1 for chunks in self.shards.values() if _complete(chunks))
+            return {'error': f"Timed out after {self.timeout:g}s waiting for {missing} of {config.shards} tracker shard(s)"}
+
+class QueryClient:
+    """
+    Request/reply client for the tracker's queries.
+    Each client has its own reply queue, bound to ROUTING_KEY_RESPONSE.<client id>. Queries are published
+    with reply_to set to that routing key and correlation_id set to their query_id, and a background
+    consumer hands every response chunk to the query it belongs to. Any number of queries can be
+    outstanding at once and no client ever takes another's responses.
+    """
+
+    def __init__(self, config: Config, transport: Optional[Transport] = None):
+        self.config = config
+        self.transport = transport or create_transport(config)
+        client_id = uuid.uuid4().hex[:12]
+        self.reply_queue = f'{config.QUEUE_RESPONSE}.{client_id}'
+        self.reply_to = f'{config.ROUTING_KEY_RESPONSE}.{client_id}'
+        self.pending: Dict[str, PendingQuery] = {}
+        self.lock = threading.Lock()  # pending is shared with the receiver thread
+        self.stop_event = threading.Event()
+        self.receiver: Optional[threading.Thread] = None
+        self.unmatched = 0  # Responses that arrived after their query timed out
+        self.malformed = 0  # Responses that were not valid JSON objects, dropped
+
+    def __enter__(self) -> 'QueryClient':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def setup_reply_queue(self):
+        """Declare the reply queue, which the broker removes once it is unused for QUERY_REPLY_EXPIRY seconds"""
+        self.transport.declare_queue(self.reply_queue, durable=False, auto_delete=True,
+                                     arguments={'x-expires': int(self.config.QUERY_REPLY_EXPIRY * 1000)})
+        self.transport.bind_queue(self.reply_queue, self.reply_to)
+
+    def start(self):
+        self.setup_reply_queue()
+        self.receiver = threading.Thread(target=self.receive, name='query-replies', daemon=True)
+        self.receiver.start()
+
+    def receive(self):
+        """Receiver thread: consume the reply queue until closed, reconnecting after transport errors"""
+        while not self.stop_event.is_set():
+            try:
+                self.transport.consume(self.reply_queue, self.on_reply, self.stop_event, self.config.QUERY_PREFETCH)
+            except TransportError as e:
+                if self.stop_event.is_set():
+                    return
+                print(f"Reply consumer failed, reconnecting: {e}")
+                self.stop_event.wait(timeout=1)
+                try:
+                    self.setup_reply_queue() # The queue expires if the client stayed disconnected for long
+                except TransportError:
+                    pass
+
+    def on_reply(self, delivery: Delivery):
+        try:
+            chunk = json.loads(delivery.body)
+            if not isinstance(chunk, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e: # Includes JSONDecodeError and UnicodeDecodeError
+            self.malformed += 1
+            print(f"Dropped malformed response: {e}")
+            return
+        query_id = delivery.properties.get('correlation_id') or chunk.get('query_id')
+        with self.lock:
+            pending = self.pending.get(query_id)
+            if pending is None:
+                self.unmatched += 1
+                return
+            if not pending.add(chunk):
+                return
+            del self.pending[query_id]
+        pending.future.set_result(pending.body())
+
+    def send(self, person: str, options: Optional[dict] = None, timeout: Optional[float] = None) -> PendingQuery:
+        """Publish a query and return its PendingQuery without waiting for the answer.
+        options holds the query type and its parameters, e.g. {'type': 'top', 'k': 5}"""
+        query_id = str(uuid.uuid4())
+        payload = json.dumps({
+            'query_id': query_id,
+            'query_person': person,
+            **(options or {})
+        })
+        pending = PendingQuery(self, query_id, self.config.QUERY_TIMEOUT if timeout is None else timeout)
+        with self.lock:
+            self.pending[query_id] = pending
+        try:
+            self.transport.publish(self.config.ROUTING_KEY_QUERY, payload, {
+                'content_type': 'application/json',
+                'reply_to': self.reply_to,
+                'correlation_id': query_id
             })
-        )
-        
-        if response.status_code == 200:
-            if response.json(): # If a message is returned
-                message = response.json()[0]
-                body = json.loads(message['payload'])
-                
-                # Check if this response matches the expected query ID
-                if body.get('query_id') == expected_query_id:
-                    formatted_response = format_response(body)
-                    print(formatted_response)
-                    sys.exit(0) # Exit successfully after printing response
-            time.sleep(1) # Wait before next attempt
-        else:
-            print(f"Failed to get message from queue: {response.text}")
+        except TransportError as e:
+            self.forget(query_id)
+            pending.future.set_result({'error': f"Failed to send query for {person}: {e}"})
+        return pending
+
+    def request(self, person: str, options: Optional[dict] = None, timeout: Optional[float] = None) -> dict:
+        """Send a query and wait for its response body"""
+        return self.send(person, options, timeout).result()
+
+    def forget(self, query_id: str):
+        with self.lock:
+            self.pending.pop(query_id, None)
+
+    def close(self):
+        self.stop_event.set()
+        if self.receiver is not None:
+            self.receiver.join(timeout=5)
+        self.transport.close()
+
+def _complete(chunks: Dict[int, dict]) -> bool:
+    return len(chunks) >= next(iter(chunks.values())).get('chunks', 1)
+
+def assemble_response(chunks: List[dict]) -> dict:
+    """Merge the chunks of a paginated response back into a single response body"""
+    chunks = sorted(chunks, key=lambda chunk: chunk.get('chunk', 0))
+    body = {key: value for key, value in chunks[0].items() if key not in ('chunk', 'chunks')}
+
+    for key in ('top', 'encounters', 'exposures'):
+        if key in body:
+            body[key] = [item for chunk in chunks for item in chunk.get(key, [])]
+
+    if isinstance(body.get('contacts'), dict):
+        contacts: Dict[str, dict] = {}
+        for chunk in chunks:
+            _add_contacts(contacts, chunk['contacts'], False)
+        body['contacts'] = contacts
+
+    if 'results' in body: # Bulk: one contact history per person, a person's contacts may continue in the next chunk
+        results: Dict[str, Dict[str, dict]] = {}
+        for chunk in chunks:
+            for person, contacts in chunk['results'].items():
+                _add_contacts(results.setdefault(person, {}), contacts, False)
+        body['results'] = results
+    return body
+
+def _add_contacts(merged: Dict[str, dict], contacts: Dict[str, dict], add_counts: bool):
+    """Merge a contacts dict into merged. A contact continued from the previous chunk only adds
+    locations, while the same contact from another shard also adds its count (add_counts)."""
+    for name, details in contacts.items():
+        entry = merged.get(name)
+        if entry is None:
+            merged[name] = {'count': details['count'], 'locations': list(details['locations'])}
+            continue
+        if add_counts:
+            entry['count'] += details['count']
+        entry['locations'].extend(details['locations'])
+
+def merge_shard_responses(bodies: List[dict]) -> dict:
+    """Merge the assembled answers of several tracker shards into one response body.
+    Each shard only holds the encounters of the pairs it owns, see sharding.py."""
+    if len(bodies) == 1:
+        return bodies[0]
+    for body in bodies:
+        if 'error' in body:
+            return body
+
+    merged = {key: value for key, value in bodies[0].items() if key != 'shard'}
+    if 'top' in merged:
+        counts: Dict[str, int] = {}
+        for body in bodies:
+            for entry in body['top']:
+                counts[entry['contact']] = counts.get(entry['contact'], 0) + entry['count']
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        merged['top'] = [{'contact': name, 'count': count} for name, count in ranked]
+
+    for key in ('encounters', 'exposures'):
+        if key in merged:
+            merged[key] = [item for body in bodies for item in body.get(key, [])]
+
+    if 'contacts' in merged:
+        contacts: Dict[str, dict] = {}
+        for body in bodies:
+            if not isinstance(body.get('contacts'), dict):
+                continue # 'no contact' from this shard
+            _add_contacts(contacts, body['contacts'], True)
+        merged['contacts'] = contacts or 'no contact'
+
+    if 'results' in merged:
+        results: Dict[str, Dict[str, dict]] = {}
+        for body in bodies:
+            for person, contacts in body['results'].items():
+                _add_contacts(results.setdefault(person, {}), contacts, True)
+        merged['results'] = results
+    return merged
+
+def sharded_exposure(client: QueryClient, person: str, options: dict) -> dict:
+    """Transitive exposure across tracker shards.
+    Each shard only holds part of the contact graph, so the hops are run here: every round
+    asks all shards for one hop from the people whose exposure time improved in the last
+    round, from each person's own exposure time (see ContactGraph.exposure)."""
+    since = options.get('start') or 0
+    reached: Dict[str, dict] = {person: {'person': person, 'time': since}}
+    frontier = {person: since}
+    for hop in range(1, options['hops'] + 1):
+        body = client.request(person, dict(options, sources=frontier))
+        if 'error' in body:
+            return body
+
+        improved: Dict[str, dict] = {}
+        for exposure in body['exposures']:
+            current = improved.get(exposure['person']) or reached.get(exposure['person'])
+            if current is None or exposure['time'] < current['time']:
+                improved[exposure['person']] = dict(exposure, hops=hop)
+        improved.pop(person, None)
+        if not improved:
             break
+        reached.update(improved)
+        frontier = {name: exposure['time'] for name, exposure in improved.items()}
+
+    del reached[person]
+    exposures = sorted(reached.values(), key=lambda exposure: (exposure['time'], exposure['hops'], exposure['person']))
+    return {'type': 'exposure', 'exposures': exposures}
 
 def format_response(body: dict) -> str:
     # Formats the contact tracing response into a easily human-readable string.
+    if 'error' in body:
+        return f"Query failed: {body['error']}"
+    if body.get('type') == 'bulk':
+        return format_bulk(body)
+    if body.get('type') == 'top':
+        return format_top_contacts(body)
+    if body.get('type') == 'location':
+        return format_location_contacts(body)
+    if body.get('type') == 'exposure':
+        return format_exposures(body)
+
     contacts = body.get('contacts')
     output = ""
     
@@ -117,24 +339,196 @@ def format_response(body: dict) -> str:
                 if isinstance(location, (list, tuple)) and len(location) == 3:
                     x, y, timestamp = location
                     output += f"    - Position: ({x}, {y}) at {timestamp}\n"
+                elif isinstance(location, (list, tuple)) and len(location) == 4:
+                    x, y, timestamp, end = location
+                    output += f"    - Position: ({x}, {y}) at {format_period(timestamp, end)}\n"
     
     return output.strip()
 
-def query_person(config: Config, person: str):
-    """Query contact history of a person via RabbitMQ HTTP API."""
-    expected_query_id = publish_query(config, person)
-    get_response(config, expected_query_id)
+def format_bulk(body: dict) -> str:
+    # Formats a bulk response as one contact history per person
+    sections = [f"== {person} ==\n{format_response({'contacts': contacts or 'no contact'})}"
+                for person, contacts in body.get('results', {}).items()]
+    return "\n\n".join(sections) or "No people queried."
+
+def format_csv(body: dict) -> str:
+    """Formats a response as CSV with a header row, one row per location, contact or exposure"""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    query_type = body.get('type', 'contacts')
+    if 'error' in body:
+        writer.writerows([['error'], [body['error']]])
+    elif query_type == 'top':
+        writer.writerow(['rank', 'contact', 'count'])
+        writer.writerows([rank, entry['contact'], entry['count']] for rank, entry in enumerate(body.get('top', []), start=1))
+    elif query_type == 'location':
+        x, y = body.get('location', ('', ''))
+        writer.writerow(['x', 'y', 'person', 'contact', 'start', 'end'])
+        writer.writerows([x, y, encounter['person'], encounter['contact_person'], encounter['timestamp'],
+                          encounter.get('end') or encounter['timestamp']] for encounter in body.get('encounters', []))
+    elif query_type == 'exposure':
+        writer.writerow(['person', 'hops', 'via', 'timestamp'])
+        writer.writerows([exposure['person'], exposure['hops'], exposure['via'], exposure['timestamp']]
+                         for exposure in body.get('exposures', []))
+    else:
+        # Contacts of one person, or of every person in a bulk query
+        results = body.get('results') if query_type == 'bulk' else {body.get('query_person', ''): body.get('contacts')}
+        writer.writerow(['person', 'contact', 'x', 'y', 'start', 'end'])
+        for person, contacts in (results or {}).items():
+            if not isinstance(contacts, dict):
+                continue # 'no contact'
+            for contact, details in contacts.items():
+                for location in details['locations']:
+                    x, y, start = location[:3]
+                    writer.writerow([person, contact, x, y, start, location[3] if len(location) > 3 else start])
+    return output.getvalue().rstrip('\n')
+
+def format_output(body: dict, output_format: str) -> str:
+    """Formats a response as text for people, or JSON or CSV for other tools"""
+    if output_format == 'json':
+        return json.dumps({key: value for key, value in body.items() if key != 'query_id'}, indent=2)
+    if output_format == 'csv':
+        return format_csv(body)
+    return format_response(body)
+
+def format_top_contacts(body: dict) -> str:
+    # Formats a top-K response as a ranked list
+    if not body.get('top'):
+        return "No contacts found."
+    output = "Top contacts:\n"
+    for rank, entry in enumerate(body['top'], start=1):
+        output += f"{rank}. {entry['contact']} - {entry['count']} encounters\n"
+    return output.strip()
+
+def format_location_contacts(body: dict) -> str:
+    # Formats every contact recorded at a location
+    x, y = body.get('location', ('?', '?'))
+    if not body.get('encounters'):
+        return f"No contacts found at ({x}, {y})."
+    output = f"Contacts at ({x}, {y}):\n"
+    for encounter in body['encounters']:
+        output += f"- {encounter['person']} with {encounter['contact_person']} at {format_period(encounter['timestamp'], encounter.get('end'))}\n"
+    return output.strip()
+
+def format_exposures(body: dict) -> str:
+    # Formats a transitive exposure response, earliest exposure first
+    if not body.get('exposures'):
+        return "No exposures found."
+    output = "Possible exposures:\n"
+    for exposure in body['exposures']:
+        output += f"- {exposure['person']}: {exposure['hops']} hop(s) via {exposure['via']} at {exposure['timestamp']}\n"
+    return output.strip()
+
+def format_period(start: str, end: Optional[str]) -> str:
+    # An encounter that lasted shows its start and end, a single sighting just its time
+    return f"{start} until {end}" if end and end != start else start
+
+def parse_time(value: str, timestamp_format: str) -> int:
+    """Parse epoch seconds or a TIMESTAMP_FORMAT string into epoch seconds"""
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.strptime(value, timestamp_format).timestamp())
+
+def run_query(client: QueryClient, person: str, options: Optional[dict] = None) -> dict:
+    """Send one query and return its response body, merging the answers of sharded trackers"""
+    options = options or {}
+    config = client.config
+    if options.get('type') == 'bulk':
+        return bulk_query(client, options)
+    if config.shards > 1 and options.get('type') == 'exposure':
+        return sharded_exposure(client, person, options)
+    top_k = None
+    if config.shards > 1 and options.get('type') == 'top':
+        top_k, options = options['k'], dict(options, k=0) # Every shard sends all its counts, summed before ranking
+    body = client.request(person, options)
+    if top_k and 'top' in body:
+        body['top'] = body['top'][:top_k]
+    return body
+
+def bulk_query(client: QueryClient, options: dict) -> dict:
+    """Contact histories of options['people'], in one bulk request per QUERY_BULK_SIZE people.
+    The requests are all outstanding at once and their results merged."""
+    people, size = options['people'], max(1, client.config.QUERY_BULK_SIZE)
+    pending = [client.send('', dict(options, people=people[i:i + size])) for i in range(0, len(people), size)]
+    body = {'type': 'bulk', 'results': {}}
+    for request in pending:
+        answer = request.result()
+        if 'error' in answer:
+            return answer
+        body['results'].update(answer['results'])
+    return body
+
+def read_people(path: str) -> List[str]:
+    """Read person IDs from a file, or stdin for '-': one per line, blank lines and # comments skipped"""
+    with (open(path, encoding='utf-8') if path != '-' else sys.stdin) as source:
+        lines = [line.split('#', 1)[0].strip() for line in source]
+    return [line for line in lines if line]
+
+def query_person(config: Config, person: str, options: Optional[dict] = None):
+    """Query contact history of a person via RabbitMQ, then print the response and exit."""
+    with QueryClient(config) as client:
+        body = run_query(client, person, options)
+        if person:
+            body.setdefault('query_person', person) # Names the person column of CSV output
+        print(format_output(body, config.OUTPUT_FORMAT))
+    close_clients() # Keep-alive sessions of the HTTP transport
+    sys.exit(0) # Exit successfully after printing response
+
+def parse_args(config: Config, argv: Optional[List[str]] = None):
+    """Parse the command line into (person, query options)"""
+    parser = argparse.ArgumentParser(description="Query the contact history recorded by the tracker")
+    parser.add_argument('person', nargs='?', help="Person to query (not needed with --location or --people)")
+    parser.add_argument('--start', help=f"Only contacts at or after this time ('{config.TIMESTAMP_FORMAT}' or epoch seconds)")
+    parser.add_argument('--end', help="Only contacts at or before this time")
+    parser.add_argument('--top', type=int, metavar='K', help="Show the K most frequent contacts")
+    parser.add_argument('--location', type=int, nargs=2, metavar=('X', 'Y'), help="Show every contact at this position")
+    parser.add_argument('--exposure', type=int, metavar='HOPS',
+                        help="Show everyone exposed through the person within HOPS contacts (after --start)")
+    parser.add_argument('--people', nargs='+', metavar='PERSON', help="Contact histories of several people in one bulk query")
+    parser.add_argument('--people-file', metavar='PATH', help="Bulk query the person IDs in a file, one per line ('-' reads stdin)")
+    parser.add_argument('--page-size', type=int, help="Max locations per response chunk")
+    parser.add_argument('--format', choices=('text', 'json', 'csv'), help="Output format (default QUERY_OUTPUT_FORMAT or text)")
+    args = parser.parse_args(argv)
+    if args.format:
+        config.OUTPUT_FORMAT = args.format
+
+    people = list(args.people or [])
+    if args.people_file:
+        people.extend(read_people(args.people_file))
+    if args.people or args.people_file:
+        if args.person:
+            people.insert(0, args.person)
+        if args.location or args.exposure or args.top:
+            parser.error("bulk queries return contact histories, --location, --exposure and --top cannot be used with them")
+        if not people:
+            parser.error("no people to query")
+    elif not args.person and not args.location:
+        parser.error("a person is required unless --location or --people is given")
+
+    options = {}
+    if people:
+        options.update({'type': 'bulk', 'people': [person.lower() for person in people]})
+    elif args.location:
+        options.update({'type': 'location', 'x': args.location[0], 'y': args.location[1]})
+    elif args.exposure:
+        options.update({'type': 'exposure', 'hops': args.exposure})
+    elif args.top:
+        options.update({'type': 'top', 'k': args.top})
+    for name in ('start', 'end'):
+        value = getattr(args, name)
+        if value:
+            options[name] = parse_time(value, config.TIMESTAMP_FORMAT)
+    if args.page_size:
+        options['page_size'] = args.page_size
+    return ('' if people else args.person or '').lower(), options  # Convert to lowercase for consistency
 
 def main():
     #  Entry point of the script
-    if len(sys.argv) != 2:
-        print("Usage: python query.py <person_identifier>")
-        sys.exit(1)
-
     try:
         config = Config() # Load configuration from environment
-        person_identifier = sys.argv[1].lower()  # Convert to lowercase for consistency
-        query_person(config, person_identifier)
+        person_identifier, options = parse_args(config)
+        query_person(config, person_identifier, options)
     except KeyboardInterrupt:
         print("\nQuery interrupted by user")
         sys.exit(0)
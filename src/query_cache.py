@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Cache of serialized query responses.
+
+Entries are keyed by the query's parameters (everything but its query_id) and
+hold the response chunks as JSON text, so a repeated query is answered without
+walking the contact store or serializing anything. Each entry lists what it
+depends on, a person or a cell, and is dropped as soon as a contact touching
+one of them is recorded or ended. Compaction rewrites the whole store, so
+a change of store version clears the cache.
+
+Memory is bounded by the total size of the cached bodies; the least recently
+used entries are evicted first.
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+MAX_CHANGED = 65536  # Invalidations remembered for responses still being computed
+
+class QueryCache:
+    """LRU of serialized query responses with per-dependency invalidation, see the module docstring"""
+
+    def __init__(self, max_bytes: int, version: Callable[[], int] = lambda: 0):
+        self.max_bytes = max_bytes
+        self.version = version  # Store version, a change means every entry is stale
+        self.entries: OrderedDict = OrderedDict()  # key -> (bodies, size, dependencies), least recently used first
+        self.dependents: Dict[Hashable, Set[Hashable]] = {}  # dependency -> keys of the entries that use it
+        self.changed: Dict[Hashable, int] = {}  # dependency -> clock value when it was last invalidated
+        self.clock = 0  # Bumped on every invalidation
+        self.floor = 0  # Responses stamped before this are not cached, invalidations before it were forgotten
+        self.seen_version = version()
+        self.bytes = 0
+        self.lock = threading.Lock()  # Queries are answered on one thread, contacts are recorded on another
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Tuple[Optional[List[str]], Tuple[int, int]]:
+        """Return (bodies, stamp), bodies is None on a miss.
+        Pass the stamp to put() so a response computed while its data changed is not cached."""
+        version = self.version()
+        with self.lock:
+            if version != self.seen_version:
+                self._clear()
+                self.seen_version = version
+            stamp = (self.clock, version)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, stamp
+            self.entries.move_to_end(key)
+            return entry[0], stamp
+
+    def put(self, key: Hashable, dependencies: Tuple[Hashable, ...], bodies: List[str], stamp: Tuple[int, int]):
+        """Cache bodies unless a dependency or the store version changed since the stamp was taken"""
+        clock, version = stamp
+        size = sum(len(body) for body in bodies)
+        if size > self.max_bytes or self.version() != version:
+            return
+        with self.lock:
+            if version != self.seen_version or clock < self.floor or any(self.changed.get(dependency, -1) >= clock for dependency in dependencies):
+                return
+            self._remove(key)
+            self.entries[key] = (bodies, size, dependencies)
+            self.bytes += size
+            for dependency in dependencies:
+                self.dependents.setdefault(dependency, set()).add(key)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, *dependencies: Hashable) -> int:
+        """Drop every entry that depends on any of dependencies, returns how many were dropped"""
+        dropped = 0
+        with self.lock:
+            for dependency in dependencies:
+                self.changed[dependency] = self.clock
+                for key in self.dependents.pop(dependency, ()):
+                    dropped += self._remove(key)
+            self.clock += 1
+            if len(self.changed) > MAX_CHANGED:
+                self.changed.clear()
+                self.floor = self.clock
+        return dropped
+
+    def _remove(self, key: Hashable) -> int:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return 0
+        self.bytes -= entry[1]
+        for dependency in entry[2]:
+            keys = self.dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[dependency]
+        return 1
+
+    def _clear(self):
+        self.entries.clear()
+        self.dependents.clear()
+        self.changed.clear()
+        self.bytes = 0
+
+def with_query_id(body: str, query_id: str) -> str:
+    """Add the query_id to a serialized chunk without parsing it again"""
+    return f'{body[:-1]}, "query_id": {json.dumps(query_id)}}}'
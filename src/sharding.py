@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Grid partitioning for sharded trackers.
+
+With SHARD_COLUMNS x SHARD_ROWS greater than one the grid is split into
+rectangular regions, numbered row by row, and one tracker shard runs per region
+(`python tracker.py <shard>`). Each shard consumes only its own position queue:
+  - a person publishes their position to `position.<region>` for the region they
+    stand in, marked primary, and to every other region within CONTACT_RADIUS of
+    them, marked as a ghost
+  - a shard keeps ghosts in its index so people near its edges still see
+    neighbours across the boundary. A pair is owned by the lower of the two
+    people's home regions: only that shard opens, extends and records their
+    encounter, whichever of them moved. The shard above the boundary skips the
+    pair, and the owner sees the sightings it would miss through the mover's
+    ghost update. Every sighting is therefore counted once, by one shard. When
+    the pair's owner changes (one of them crosses a boundary) or a person leaves
+    a shard's reach, that shard ends its open encounter, so the next sighting
+    starts a new one and no two shards hold the pair at the same time
+  - when a person moves out of a region's reach they send that region a leave
+    message so its shard drops them (handoff)
+On a toroidal grid (see topology.py) the reach wraps around the edges, so regions
+on opposite edges are neighbours.
+
+Queries go to every shard's query queue and query.py merges the answers.
+"""
+from typing import List, Optional, Set, Tuple
+from wire import encode_position
+
+class GridPartition:
+    """Splits a grid_size x grid_size grid into columns x rows regions"""
+
+    def __init__(self, grid_size: int, columns: int = 1, rows: int = 1, radius: int = 0, wrap: bool = False):
+        if not 1 <= columns <= grid_size or not 1 <= rows <= grid_size:
+            raise ValueError(f"Shard columns and rows must be between 1 and the grid size ({grid_size})")
+        self.grid_size = grid_size
+        self.columns = columns
+        self.rows = rows
+        self.radius = max(0, radius)
+        self.wrap = wrap  # Toroidal grid, the reach of a position wraps around the edges
+
+    @classmethod
+    def from_config(cls, config, grid_size: Optional[int] = None) -> 'GridPartition':
+        return cls(grid_size or config.GRID_SIZE, config.SHARD_COLUMNS, config.SHARD_ROWS, config.CONTACT_RADIUS,
+                   config.GRID_TOPOLOGY == 'toroidal')
+
+    @property
+    def regions(self) -> int:
+        return self.columns * self.rows
+
+    def _column(self, x: int) -> int:
+        return min(max(x, 0), self.grid_size - 1) * self.columns // self.grid_size
+
+    def _row(self, y: int) -> int:
+        return min(max(y, 0), self.grid_size - 1) * self.rows // self.grid_size
+
+    def region_of(self, position: Tuple[int, int]) -> int:
+        """Region that owns position"""
+        x, y = position
+        return self._row(y) * self.columns + self._column(x)
+
+    def owner(self, position1: Tuple[int, int], position2: Tuple[int, int]) -> int:
+        """Region whose shard tracks the encounter between people at these two positions"""
+        return min(self.region_of(position1), self.region_of(position2))
+
+    def regions_near(self, position: Tuple[int, int]) -> Set[int]:
+        """Every region with a cell within radius of position (on either axis), including its own"""
+        x, y = position
+        r = self.radius
+        return {
+            row * self.columns + column
+            for row in self._span(y - r, y + r, self._row, self.rows)
+            for column in self._span(x - r, x + r, self._column, self.columns)
+        }
+
+    def _span(self, low: int, high: int, index, count: int) -> Set[int]:
+        """Columns or rows covering low..high on one axis"""
+        size = self.grid_size
+        if not self.wrap or (0 <= low and high < size):
+            return set(range(index(low), index(high) + 1))
+        if high - low + 1 >= size:
+            return set(range(count))
+        # The span crosses an edge and continues on the opposite side
+        return set(range(index(low % size), count)) | set(range(0, index(high % size) + 1))
+
+def shard_routing_key(routing_key: str, region: int) -> str:
+    """Position routing key of one region, e.g. position.3"""
+    return f'{routing_key}.{region}'
+
+def shard_queue(queue_name: str, region: int) -> str:
+    """Queue consumed by one region's shard, e.g. position_queue.3"""
+    return f'{queue_name}.{region}'
+
+def position_messages(partition: GridPartition, routing_key: str, person: str, position: Tuple[int, int],
+                      ts: float, regions: Set[int], seq: int,
+                      wire_format: str = 'json') -> Tuple[List[Tuple[str, str, Optional[dict]]], Set[int]]:
+    """Build the (routing_key, body, properties) messages for one sharded position update.
+    regions are the regions that held the person before, the regions holding them now are returned.
+    Every message carries the update's sequence number, each shard sees at most one of them."""
+    x, y = position
+    home = partition.region_of(position)
+    near = partition.regions_near(position)
+    messages = [
+        (shard_routing_key(routing_key, region), *encode_position(wire_format, person, x, y, ts, seq, ghost=region != home))
+        for region in sorted(near)
+    ]
+    messages += [
+        (shard_routing_key(routing_key, region), *encode_position(wire_format, person, seq=seq, leave=True))
+        for region in sorted(regions - near)
+    ]
+    return messages, near
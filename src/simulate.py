@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Simulation driver: runs thousands of simulated people in one process.
+
+Each agent follows the same random walk as person.py (a step of -1, 0 or 1 on
+each axis, stopped by the grid edge or an obstacle, or wrapping round on a
+toroidal grid, see topology.py), but every agent is stepped together once per
+tick and the positions are published in bulk over one transport connection.
+Memory grows with the population only, not with the grid area.
+Walks are computed with numpy when it is installed and with the standard library
+otherwise; a seed makes a run reproducible with the same backend.
+
+Agents do not read contact notifications, use person.py for that.
+
+Usage: python simulate.py [--population 1000] [--tick-rate 1] [--grid-size 10] [--seed 205]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from create import create_exchange_and_queues
+from http_client import close_clients
+from log_setup import setup_logging
+from sharding import GridPartition, position_messages
+from topology import Topology
+from transport import TransportError, create_transport
+from wire import check_format, encode_position
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the pure Python walk is used instead
+    np = None
+
+@dataclass
+class Config:
+    """
+    Configuration class that loads and stores all necessary RabbitMQ connection and queue settings.
+    Uses environment variables for security so username & password is not in code file
+    """
+    def __init__(self, env_path: Optional[str] = None):
+        # Load environment variables from specified path or default to .env
+        if env_path:
+            load_dotenv(env_path)
+        else:
+            load_dotenv()
+
+        # Required credentials
+        self.USERNAME = os.getenv('RABBITMQ_USERNAME')
+        self.PASSWORD = os.getenv('RABBITMQ_PASSWORD')
+
+        # Validate required credentials
+        if not self.USERNAME or not self.PASSWORD:
+            raise ValueError("Missing required credentials. Please check your .env file.")
+
+        # Configuration
+        self.RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
+        self.RABBITMQ_API_PORT = os.getenv('RABBITMQ_API_PORT', '15672')
+        self.RABBITMQ_AMQP_PORT = int(os.getenv('RABBITMQ_AMQP_PORT', '5672'))
+        self.TRANSPORT = os.getenv('TRANSPORT', 'amqp')  # amqp, http or local
+        self.EXCHANGE_NAME = os.getenv('EXCHANGE_NAME', 'contact_tracing')
+        self.ROUTING_KEY_POSITION = os.getenv('ROUTING_KEY_POSITION', 'position')
+        self.GRID_SIZE = int(os.getenv('GRID_SIZE', '10'))
+        self.GRID_TOPOLOGY = os.getenv('GRID_TOPOLOGY', 'bounded')  # bounded or toroidal, see topology.py
+        self.GRID_OBSTACLES = os.getenv('GRID_OBSTACLES', '')  # File of cells nobody can enter, empty for none
+        self.SHARD_COLUMNS = int(os.getenv('SHARD_COLUMNS', '1'))  # Must match the tracker shards, see sharding.py
+        self.SHARD_ROWS = int(os.getenv('SHARD_ROWS', '1'))
+        self.CONTACT_RADIUS = int(os.getenv('CONTACT_RADIUS', '0'))
+        self.SIMULATION_BATCH_SIZE = int(os.getenv('SIMULATION_BATCH_SIZE', '500'))  # Positions per bulk publish
+        self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text or json
+        self.WIRE_FORMAT = check_format(os.getenv('WIRE_FORMAT', 'json'))  # json or binary position messages, see wire.py
+
+    @property
+    def api_url(self) -> str:
+        return f'http://{self.RABBITMQ_HOST}:{self.RABBITMQ_API_PORT}/api'
+
+class RandomWalk:
+    """Positions of every agent, all stepped together once per tick"""
+
+    def __init__(self, population: int, topology: Topology, seed: Optional[int] = None):
+        self.population = population
+        self.topology = topology
+        self.grid_size = grid_size = topology.size
+        if np is not None:
+            self.rng = np.random.default_rng(seed)
+            self.xs = self.rng.integers(0, grid_size, population)
+            self.ys = self.rng.integers(0, grid_size, population)
+            if topology.has_obstacles: # Agents placed on an obstacle are placed again
+                for _ in range(1000):
+                    blocked = np.flatnonzero(topology.blocked_mask(self.xs, self.ys))
+                    if not len(blocked):
+                        break
+                    self.xs[blocked] = self.rng.integers(0, grid_size, len(blocked))
+                    self.ys[blocked] = self.rng.integers(0, grid_size, len(blocked))
+                else:
+                    raise ValueError("No free cells found for every agent, the grid is (almost) entirely obstacles")
+        else:
+            self.rng = random.Random(seed)
+            cells = [topology.random_cell(self.rng) for _ in range(population)]
+            self.xs = [x for x, _ in cells]
+            self.ys = [y for _, y in cells]
+
+    def step(self):
+        """Move every agent one random step in any direction, staying on the grid and off obstacles"""
+        topology, top = self.topology, self.grid_size - 1
+        if np is not None:
+            xs = self.xs + self.rng.integers(-1, 2, self.population)
+            ys = self.ys + self.rng.integers(-1, 2, self.population)
+            if topology.wraps:
+                xs %= self.grid_size
+                ys %= self.grid_size
+            else:
+                xs = np.clip(xs, 0, top)
+                ys = np.clip(ys, 0, top)
+            if topology.has_obstacles: # Agents whose step would enter an obstacle stay where they are
+                blocked = topology.blocked_mask(xs, ys)
+                xs = np.where(blocked, self.xs, xs)
+                ys = np.where(blocked, self.ys, ys)
+            self.xs, self.ys = xs, ys
+            return
+        steps = self.rng.choices((-1, 0, 1), k=2 * self.population)
+        if topology.wraps or topology.has_obstacles:
+            cells = [topology.step(x, y, dx, dy) for x, y, dx, dy in
+                     zip(self.xs, self.ys, steps[:self.population], steps[self.population:])]
+            self.xs = [x for x, _ in cells]
+            self.ys = [y for _, y in cells]
+            return
+        self.xs = [min(max(x + dx, 0), top) for x, dx in zip(self.xs, steps[:self.population])]
+        self.ys = [min(max(y + dy, 0), top) for y, dy in zip(self.ys, steps[self.population:])]
+
+    def positions(self) -> List[Tuple[int, int]]:
+        if np is not None:
+            return list(zip(self.xs.tolist(), self.ys.tolist()))
+        return list(zip(self.xs, self.ys))
+
+class Simulation:
+    def __init__(self, config: Config, population: int, tick_rate: float, grid_size: int,
+                 seed: Optional[int] = None, prefix: str = 'agent'):
+        self.config = config
+        self.tick_rate = tick_rate
+        self.names = [f'{prefix}{i}' for i in range(population)]
+        self.walk = RandomWalk(population, Topology.from_config(config, grid_size), seed)
+        self.partition = GridPartition.from_config(config, grid_size)
+        # Shard regions holding each agent, only kept when sharded
+        self.regions = [set() for _ in range(population)] if self.partition.regions > 1 else []
+        self.seq = int(time.time() * 1000)  # Sequence number of the current tick, shared by every agent's update
+        self.transport = create_transport(config)
+        self.setup_logging()
+
+    def setup_logging(self):
+        setup_logging('simulation.log', self.config.LOG_FORMAT)
+        self.logger = logging.getLogger(__name__)
+
+    def tick_messages(self) -> List[Tuple[str, str, Optional[dict]]]:
+        """Position messages for every agent's current position"""
+        now = time.time()
+        self.seq += 1
+        seq = self.seq
+        positions = self.walk.positions()
+        if self.partition.regions == 1:
+            routing_key, wire_format = self.config.ROUTING_KEY_POSITION, self.config.WIRE_FORMAT
+            return [
+                (routing_key, *encode_position(wire_format, name, x, y, now, seq))
+                for name, (x, y) in zip(self.names, positions)
+            ]
+
+        messages = []
+        for i, (name, position) in enumerate(zip(self.names, positions)):
+            agent_messages, self.regions[i] = position_messages(self.partition, self.config.ROUTING_KEY_POSITION,
+                                                                name, position, now, self.regions[i], seq,
+                                                                self.config.WIRE_FORMAT)
+            messages.extend(agent_messages)
+        return messages
+
+    def publish(self, messages: List[Tuple[str, str, Optional[dict]]]):
+        batch_size = max(1, self.config.SIMULATION_BATCH_SIZE)
+        for start in range(0, len(messages), batch_size):
+            self.transport.publish_batch(messages[start:start + batch_size])
+
+    def run(self, ticks: int = 0):
+        """Step and publish every agent once per tick, for a number of ticks or until interrupted (0)"""
+        self.logger.info(f"Simulating {len(self.names)} people on a {self.walk.grid_size}x{self.walk.grid_size} "
+                         f"{self.walk.topology.kind} grid "
+                         f"at {self.tick_rate:g} ticks/s ({'numpy' if np is not None else 'pure Python'} walk)")
+        interval = 1 / self.tick_rate if self.tick_rate > 0 else 0
+        start = next_tick = last_report = time.monotonic()
+        published = tick = late = 0
+        try:
+            while not ticks or tick < ticks:
+                self.walk.step()
+                messages = self.tick_messages()
+                try:
+                    self.publish(messages)
+                    published += len(messages)
+                except TransportError as e:
+                    self.logger.error(f"Transport error during tick {tick}: {e}")
+                tick += 1
+
+                next_tick += interval
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif interval:
+                    late += 1
+                    next_tick = time.monotonic() # Run late ticks straight away rather than bursting to catch up
+                if time.monotonic() - last_report >= 10:
+                    last_report = time.monotonic()
+                    self.logger.info(f"Tick {tick}: {published / (time.monotonic() - start):,.0f} positions/s published, "
+                                     f"{late} ticks late")
+        except KeyboardInterrupt:
+            self.logger.info("Simulation stopped by user")
+        finally:
+            self.logger.info(f"Published {published} positions in {tick} ticks")
+            self.transport.close()
+            close_clients() # Keep-alive sessions of the HTTP transport
+
+def parse_args(config: Config, argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Simulate many people moving on the grid in one process")
+    parser.add_argument('--population', type=int, default=1000, help="Number of simulated people")
+    parser.add_argument('--tick-rate', type=float, default=1.0, help="Moves per person per second (0 runs flat out)")
+    parser.add_argument('--grid-size', type=int, default=config.GRID_SIZE, help="Width and height of the grid")
+    parser.add_argument('--seed', type=int, help="Seed for a reproducible walk")
+    parser.add_argument('--ticks', type=int, default=0, help="Stop after this many ticks (0 runs until interrupted)")
+    parser.add_argument('--prefix', default='agent', help="Name prefix of the simulated people")
+    return parser.parse_args(argv)
+
+def main():
+    try:
+        config = Config()
+        args = parse_args(config)
+        simulation = Simulation(config, args.population, args.tick_rate, args.grid_size, args.seed, args.prefix)
+        create_exchange_and_queues(simulation.transport, simulation.partition.regions)
+        simulation.run(args.ticks)
+    except ValueError as e:
+        print(f"Configuration error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Grid topology shared by the person, simulation and tracker applications.
+
+The grid is GRID_SIZE x GRID_SIZE cells. Nothing is stored per cell, so the grid
+can be 10^5 x 10^5 cells or larger without using more memory. GRID_TOPOLOGY
+decides what happens at the edges:
+  - bounded:  a step off an edge stops at the edge (default)
+  - toroidal: a step off an edge comes back on the opposite edge, and contact
+              neighbourhoods wrap around the edges too
+GRID_OBSTACLES names a file of cells nobody can enter. A step onto an obstacle is
+not taken. The file has one obstacle per line: a cell `x y`, or a rectangle
+`x1 y1 x2 y2` (corners included), so a wall costs one line rather than one entry
+per cell. Blank lines and # comments are skipped.
+"""
+import random
+from typing import Iterable, List, Optional, Set, Tuple
+
+Cell = Tuple[int, int]
+Rectangle = Tuple[int, int, int, int]
+
+TOPOLOGIES = ('bounded', 'toroidal')
+
+def load_obstacles(path: str) -> Tuple[Set[Cell], List[Rectangle]]:
+    """Read an obstacle file, returns (cells, rectangles)"""
+    cells: Set[Cell] = set()
+    rectangles: List[Rectangle] = []
+    with open(path, encoding='utf-8') as source:
+        for number, line in enumerate(source, start=1):
+            fields = line.split('#', 1)[0].replace(',', ' ').split()
+            if not fields:
+                continue
+            try:
+                values = [int(field) for field in fields]
+            except ValueError:
+                raise ValueError(f"{path}:{number}: obstacle coordinates must be integers") from None
+            if len(values) == 2:
+                cells.add((values[0], values[1]))
+            elif len(values) == 4:
+                x1, y1, x2, y2 = values
+                rectangles.append((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)))
+            else:
+                raise ValueError(f"{path}:{number}: expected 'x y' or 'x1 y1 x2 y2'")
+    return cells, rectangles
+
+class Topology:
+    """Edges and obstacles of the grid, see the module docstring"""
+
+    def __init__(self, size: int, kind: str = 'bounded', cells: Iterable[Cell] = (),
+                 rectangles: Iterable[Rectangle] = ()):
+        if size < 1:
+            raise ValueError("Grid size must be at least 1")
+        if kind not in TOPOLOGIES:
+            raise ValueError(f"Unknown grid topology '{kind}', expected one of {', '.join(TOPOLOGIES)}")
+        self.size = size
+        self.kind = kind
+        self.cells = set(cells)  # Single obstacle cells
+        self.rectangles = list(rectangles)  # Obstacle rectangles, (x1, y1, x2, y2) inclusive
+
+    @classmethod
+    def from_config(cls, config, size: Optional[int] = None) -> 'Topology':
+        cells, rectangles = load_obstacles(config.GRID_OBSTACLES) if config.GRID_OBSTACLES else ((), ())
+        return cls(size or config.GRID_SIZE, config.GRID_TOPOLOGY, cells, rectangles)
+
+    @property
+    def wraps(self) -> bool:
+        return self.kind == 'toroidal'
+
+    @property
+    def has_obstacles(self) -> bool:
+        return bool(self.cells or self.rectangles)
+
+    def blocked(self, x: int, y: int) -> bool:
+        if (x, y) in self.cells:
+            return True
+        return any(x1 <= x <= x2 and y1 <= y <= y2 for x1, y1, x2, y2 in self.rectangles)
+
+    def step(self, x: int, y: int, dx: int, dy: int) -> Cell:
+        """Cell reached by moving (dx, dy) from (x, y), which is (x, y) itself if the way is blocked"""
+        top = self.size - 1
+        if self.wraps:
+            nx, ny = (x + dx) % self.size, (y + dy) % self.size
+        else:
+            nx, ny = min(max(x + dx, 0), top), min(max(y + dy, 0), top)
+        if (self.cells or self.rectangles) and self.blocked(nx, ny):
+            return x, y
+        return nx, ny
+
+    def random_cell(self, rng=random, attempts: int = 1000) -> Cell:
+        """A random cell that is not an obstacle"""
+        for _ in range(attempts):
+            x, y = rng.randrange(self.size), rng.randrange(self.size)
+            if not self.blocked(x, y):
+                return x, y
+        raise ValueError(f"No free cell found in {attempts} attempts, the grid is (almost) entirely obstacles")
+
+    def offset(self, a: int, b: int) -> int:
+        """Distance between two coordinates on one axis, the short way round on a torus"""
+        distance = abs(a - b)
+        return min(distance, self.size - distance) if self.wraps else distance
+
+    def blocked_mask(self, xs, ys):
+        """numpy version of blocked() for arrays of coordinates"""
+        import numpy as np
+        mask = np.zeros(len(xs), dtype=bool)
+        if self.cells:
+            ids = np.fromiter((y * self.size + x for x, y in self.cells), dtype=np.int64, count=len(self.cells))
+            mask |= np.isin(ys.astype(np.int64) * self.size + xs, ids)
+        for x1, y1, x2, y2 in self.rectangles:
+            mask |= (xs >= x1) & (xs <= x2) & (ys >= y1) & (ys <= y2)
+        return mask
@@ -1,9 +1,7 @@
 #!/usr/bin/env python
-import requests
+import asyncio
 import json
 import time
-from datetime import datetime
-from requests.auth import HTTPBasicAuth
 from requests.exceptions import ConnectionError, HTTPError, RequestException
 import threading
 import signal
@@ -13,8 +11,22 @@ from dataclasses import dataclass
 from dotenv import load_dotenv
 from typing import Dict, List, Tuple, Optional
 import logging
+from collections import OrderedDict
 from contextlib import contextmanager
+from async_runtime import AsyncTrackerRuntime
 from create import create_exchange_and_queues
+from http_client import close_clients
+from contact_index import SpatialIndex
+from contact_query import ContactQueryEngine
+from contact_store import ContactStore
+from contact_window import EncounterWindow, TimerWheel
+from log_setup import LogSampler, dropped_records, setup_logging
+from sharding import GridPartition, shard_queue
+from topology import Topology
+from metrics import FAST_LATENCY_BUCKETS, LatencyHistogram, MetricsRegistry, format_latency, serve_metrics
+from query_cache import QueryCache, with_query_id
+from transport import Delivery, PollDelay, TransportError, create_transport
+from wire import check_format, decode_position, encode_notification
 
 # Configuration
 @dataclass
@@ -42,16 +54,87 @@ class Config:
         # Configuration
         self.RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
         self.RABBITMQ_API_PORT = os.getenv('RABBITMQ_API_PORT', '15672')
+        self.RABBITMQ_AMQP_PORT = int(os.getenv('RABBITMQ_AMQP_PORT', '5672'))
+        self.TRANSPORT = os.getenv('TRANSPORT', 'amqp') # amqp, http or local
+        self.RUNTIME = os.getenv('RUNTIME', 'threads') # threads or asyncio
+        self.ASYNC_QUEUE_SIZE = int(os.getenv('ASYNC_QUEUE_SIZE', '100')) # Batches buffered between asyncio runtime stages
+        self.PREFETCH_COUNT = int(os.getenv('PREFETCH_COUNT', '50')) # Unacknowledged messages per push consumer
+        self.HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '10')) # Seconds before an HTTP API call is abandoned
+        self.HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3')) # Retries for HTTP API calls that failed to connect
         self.EXCHANGE_NAME = os.getenv('EXCHANGE_NAME', 'contact_tracing')
         self.QUEUE_POSITION = os.getenv('QUEUE_POSITION', 'position_queue')
         self.QUEUE_QUERY = os.getenv('QUEUE_QUERY', 'query_queue')
         self.QUEUE_RESPONSE = os.getenv('QUEUE_RESPONSE', 'query_response_queue')
+        self.ROUTING_KEY_RESPONSE = os.getenv('ROUTING_KEY_RESPONSE', 'query-response') # Responses go to reply_to when it is under this key, e.g. query-response.<client>
         self.ROUTING_KEY_CONTACT_NOTIFICATIONS = os.getenv('ROUTING_KEY_CONTACT_NOTIFICATIONS', 'contact-notifications')
-        self.QUEUE_CONTACT_NOTIFICATIONS = os.getenv('QUEUE_CONTACT_NOTIFICATIONS', 'contact_notifications_queue')
+
+        # Contact detection: radius 0 means people must share the exact cell
+        self.CONTACT_RADIUS = int(os.getenv('CONTACT_RADIUS', '0'))
+        self.CONTACT_METRIC = os.getenv('CONTACT_METRIC', 'chebyshev') # chebyshev or euclidean
+        self.CONTACT_MIN_DWELL = float(os.getenv('CONTACT_MIN_DWELL', '0')) # Seconds two people must stay in contact before it counts
+        self.CONTACT_MERGE_GAP = float(os.getenv('CONTACT_MERGE_GAP', '5')) # Sightings this close together are one encounter
+        self.POSITION_TTL = float(os.getenv('POSITION_TTL', '300')) # Seconds without an update before a person is dropped, 0 keeps them
+
+        # Batch mode: drain up to POSITION_BATCH_SIZE positions per fetch (1 disables batching)
+        self.POSITION_BATCH_SIZE = int(os.getenv('POSITION_BATCH_SIZE', '1'))
+        self.POSITION_BATCH_LINGER = float(os.getenv('POSITION_BATCH_LINGER', '0.05')) # Max seconds to wait for a batch to fill
+
+        # Polling consumers wait nothing while messages flow and back off to POLL_MAX_DELAY when idle
+        self.POLL_MIN_DELAY = float(os.getenv('POLL_MIN_DELAY', '0.01'))
+        self.POLL_MAX_DELAY = float(os.getenv('POLL_MAX_DELAY', '0.5'))
+        self.LATENCY_REPORT_INTERVAL = float(os.getenv('LATENCY_REPORT_INTERVAL', '60')) # Seconds between latency log lines, 0 disables
+        self.METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1') # Prometheus metrics endpoint, /metrics
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', '9108')) # 0 disables the endpoint
+        self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'text') # text or json (one object per line)
+        self.WIRE_FORMAT = check_format(os.getenv('WIRE_FORMAT', 'json')) # json or binary contact notifications, positions are accepted in either
+        self.LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '10')) # Max per-message log lines per second of each kind, 0 logs all
+        self.LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000')) # Records waiting for the log writer before new ones are dropped
+
+        # Contact history persistence, an empty directory keeps contacts in memory only
+        self.CONTACT_STORE_DIR = os.getenv('CONTACT_STORE_DIR', 'contact_store')
+        self.CONTACT_SNAPSHOT_INTERVAL = float(os.getenv('CONTACT_SNAPSHOT_INTERVAL', '300')) # Seconds between snapshots
+        self.CONTACT_RETENTION = float(os.getenv('CONTACT_RETENTION', str(14 * 24 * 3600))) # Seconds encounters are kept after they end, 0 keeps them forever
+        self.CONTACT_COMPACT_AGE = float(os.getenv('CONTACT_COMPACT_AGE', str(24 * 3600))) # Encounters older than this are merged per pair, 0 never merges
+        self.CONTACT_COMPACT_INTERVAL = float(os.getenv('CONTACT_COMPACT_INTERVAL', '3600')) # Seconds between compaction runs, 0 disables compaction
+        self.CONTACT_COMPACT_SLICE = int(os.getenv('CONTACT_COMPACT_SLICE', '50000')) # New encounters looked at per compaction slice
+        self.TIMESTAMP_FORMAT = os.getenv('TIMESTAMP_FORMAT', '%d-%m-%Y %H:%M:%S')
+        self.QUERY_PAGE_SIZE = int(os.getenv('QUERY_PAGE_SIZE', '500')) # Max location entries per query response chunk
+        self.EXPOSURE_MAX_HOPS = int(os.getenv('EXPOSURE_MAX_HOPS', '3')) # Deepest transitive exposure query allowed
+        self.BULK_QUERY_MAX_PEOPLE = int(os.getenv('BULK_QUERY_MAX_PEOPLE', '5000')) # Most people in one bulk query
+        self.POSITION_SEQ_SIZE = int(os.getenv('POSITION_SEQ_SIZE', '1000000')) # Most people whose last sequence number is remembered, least recently updated forgotten first
+        self.QUERY_DEDUP_SIZE = int(os.getenv('QUERY_DEDUP_SIZE', '1024')) # Recent query ids remembered so a redelivered query is answered once
+        self.QUERY_CACHE_BYTES = int(os.getenv('QUERY_CACHE_BYTES', str(16 * 1024 * 1024))) # Serialized query responses kept for repeated queries, 0 disables the cache
+
+        # Sharding: the grid is split into SHARD_COLUMNS x SHARD_ROWS regions with one tracker per region
+        self.GRID_SIZE = int(os.getenv('GRID_SIZE', '10'))
+        self.GRID_TOPOLOGY = os.getenv('GRID_TOPOLOGY', 'bounded') # bounded or toroidal, see topology.py
+        self.GRID_OBSTACLES = os.getenv('GRID_OBSTACLES', '') # File of cells nobody can enter, empty for none
+        self.SHARD_COLUMNS = int(os.getenv('SHARD_COLUMNS', '1'))
+        self.SHARD_ROWS = int(os.getenv('SHARD_ROWS', '1'))
+        self.TRACKER_SHARD = None # Region owned by this tracker, set with use_shard
+        if os.getenv('TRACKER_SHARD'):
+            self.use_shard(int(os.getenv('TRACKER_SHARD')))
     
     @property
     def api_url(self) -> str: # Constructs and returns the RabbitMQ API URL
         return f'http://{self.RABBITMQ_HOST}:{self.RABBITMQ_API_PORT}/api'
+
+    @property
+    def shards(self) -> int: # Number of tracker shards, 1 when not sharded
+        return self.SHARD_COLUMNS * self.SHARD_ROWS
+
+    def use_shard(self, shard: int):
+        """Run as the shard that owns one region of the grid, with its own queues and contact store"""
+        if not 0 <= shard < self.shards:
+            raise ValueError(f"Shard must be between 0 and {self.shards - 1}")
+        if self.TRACKER_SHARD is None:
+            self._unsharded = (self.QUEUE_POSITION, self.QUEUE_QUERY, self.CONTACT_STORE_DIR)
+        # Named from the unsharded values, so a shard given on the command line replaces TRACKER_SHARD
+        position_queue, query_queue, store_dir = self._unsharded
+        self.TRACKER_SHARD = shard
+        self.QUEUE_POSITION = shard_queue(position_queue, shard)
+        self.QUEUE_QUERY = shard_queue(query_queue, shard)
+        self.CONTACT_STORE_DIR = os.path.join(store_dir, f'shard-{shard}') if store_dir else store_dir
     
     def validate(self) -> bool:
         """Validate the configuration and return True if valid"""
@@ -67,172 +150,431 @@ class Config:
 
 class ContactTracker:
     def __init__(self, config: Config):
+        if config.shards > 1 and config.TRACKER_SHARD is None:
+            raise ValueError(f"The grid is split into {config.shards} shards, start one tracker per shard with: tracker.py <shard>")
         self.config = config
-        self.auth = HTTPBasicAuth(config.USERNAME, config.PASSWORD)
         self.shutdown_event = threading.Event() # Event for coordinating shutdown
-        self.positions: Dict[str, Tuple[int, int]] = {}  # Stores current positions of all people
-        self.contacts: Dict[str, Dict[str, Dict[str, List]]] = {} # Stores contact history
+        self.topology = Topology.from_config(config) # Grid edges and obstacles, a toroidal grid wraps contact neighbourhoods
+        self.index = SpatialIndex(config.CONTACT_RADIUS, config.CONTACT_METRIC, self.topology) # Cell -> occupants index for contact detection
+        self.positions: Dict[str, Tuple[int, int]] = self.index.positions  # Stores current positions of all people
+        # Sharded: decides which shard owns the encounter of a pair that straddles a region boundary
+        self.partition = GridPartition.from_config(config) if config.shards > 1 else None
+        self.encounters = EncounterWindow(config.CONTACT_MIN_DWELL, config.CONTACT_MERGE_GAP) # Open encounters between pairs
+        self.position_expiry = TimerWheel() # Drops people who stop publishing after POSITION_TTL
+        self.last_seq: OrderedDict = OrderedDict() # Highest position sequence number processed per person, least recently updated first
+        self.answered_queries: OrderedDict = OrderedDict() # Most recently answered query ids, oldest first
+        self.detection_latency = LatencyHistogram() # Seconds from a position being published to its contacts being detected
         self.setup_logging()
+        self.store = ContactStore(config.CONTACT_STORE_DIR or None, config.CONTACT_SNAPSHOT_INTERVAL, config.TIMESTAMP_FORMAT,
+                                  config.CONTACT_RETENTION, config.CONTACT_COMPACT_AGE, config.CONTACT_COMPACT_INTERVAL,
+                                  config.CONTACT_MERGE_GAP, config.CONTACT_COMPACT_SLICE)
+        self.store.open() # Recovers contact history from the last run
+        # Serialized responses of repeated queries, dropped when a contact touches their person or cell and cleared by compaction
+        self.query_cache = QueryCache(config.QUERY_CACHE_BYTES, lambda: self.store.compaction_stats['runs'])
+        self.setup_metrics()
+        self.metrics_server = None
+        self.query_engine = ContactQueryEngine(self.store, config.QUERY_PAGE_SIZE, config.EXPOSURE_MAX_HOPS,
+                                               config.BULK_QUERY_MAX_PEOPLE)
+        self.transport = create_transport(config)
         try:
-            create_exchange_and_queues() # Creates exchange & queues if they do not exist
+            create_exchange_and_queues(self.transport, config.shards) # Creates exchange & queues if they do not exist
         except Exception as e:
             self.logger.error(f"Failed to initialise queues: {e}")
         
-    def setup_logging(self): # Configure logging to both file and console
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('contact_tracker.log'),
-                logging.StreamHandler()
-            ]
-        )
+    def setup_logging(self): # Configure logging to both file and console, written by a background thread
+        setup_logging('contact_tracker.log', self.config.LOG_FORMAT, queue_size=self.config.LOG_QUEUE_SIZE)
         self.logger = logging.getLogger(__name__)
+        # Per-message lines are rate limited so logging keeps up at high message rates
+        rate = self.config.LOG_SAMPLE_RATE
+        self.position_log, self.contact_log, self.notification_log = LogSampler(rate), LogSampler(rate), LogSampler(rate)
+
+    def setup_metrics(self):
+        # Metrics served in the Prometheus format, hot-path updates are a locked add or bisect
+        metrics = self.metrics = MetricsRegistry()
+        self.positions_total = metrics.counter('tracker_positions_total', 'Position updates processed')
+        self.contacts_total = metrics.counter('tracker_contacts_total', 'Contacts recorded')
+        self.expired_total = metrics.counter('tracker_positions_expired_total', 'People dropped after POSITION_TTL without an update')
+        self.stale_positions_total = metrics.counter('tracker_stale_positions_total', 'Duplicate or out-of-order position updates dropped')
+        self.duplicate_queries_total = metrics.counter('tracker_duplicate_queries_total', 'Redelivered queries that were not answered again')
+        self.queries_total = metrics.counter('tracker_queries_total', 'Queries answered')
+        self.query_cache_hits_total = metrics.counter('tracker_query_cache_hits_total', 'Queries answered from the query cache')
+        self.query_cache_misses_total = metrics.counter('tracker_query_cache_misses_total', 'Cacheable queries answered from the contact store')
+        self.query_errors_total = metrics.counter('tracker_query_errors_total', 'Queries rejected as malformed')
+        self.publish_errors_total = metrics.counter('tracker_publish_errors_total', 'Publishes that failed')
+        self.consume_errors_total = metrics.counter('tracker_consume_errors_total', 'Message fetches that failed')
+        metrics.gauge('tracker_tracked_people', 'People with a known position', lambda: len(self.positions))
+        metrics.gauge('tracker_open_encounters', 'Pairs currently in contact', lambda: len(self.encounters))
+        metrics.gauge('tracker_contact_store_encounters', 'Encounters held in the contact store', lambda: len(self.store))
+        metrics.gauge('tracker_contact_store_bytes', 'Approximate memory used by the contact store', self.store.memory_usage)
+        compaction = self.store.compaction_stats
+        metrics.counter('tracker_contact_store_reclaimed_bytes_total', 'Contact store memory reclaimed by compaction',
+                        lambda: compaction['bytes_reclaimed'])
+        for reason, key in (('expired', 'dropped'), ('merged', 'merged')):
+            metrics.counter('tracker_contact_store_compacted_encounters_total', 'Encounters removed by compaction',
+                            lambda key=key: compaction[key], {'reason': reason})
+        metrics.gauge('tracker_query_cache_entries', 'Query responses held in the query cache', lambda: len(self.query_cache))
+        metrics.gauge('tracker_query_cache_bytes', 'Size of the serialized query responses in the query cache',
+                      lambda: self.query_cache.bytes)
+        metrics.gauge('tracker_log_records_dropped', 'Log records dropped because the log writer fell behind', dropped_records)
+        self.consume_latency = metrics.histogram('tracker_consume_seconds', 'Time to fetch a message from the broker',
+                                                 buckets=FAST_LATENCY_BUCKETS)
+        self.publish_latency = metrics.histogram('tracker_publish_seconds', 'Time to publish a message or batch',
+                                                 buckets=FAST_LATENCY_BUCKETS)
+        self.position_stage = metrics.histogram('tracker_stage_seconds', 'Processing time per stage',
+                                                {'stage': 'position'}, FAST_LATENCY_BUCKETS)
+        self.query_stage = metrics.histogram('tracker_stage_seconds', 'Processing time per stage',
+                                             {'stage': 'query'}, FAST_LATENCY_BUCKETS)
+        metrics.histogram('tracker_detection_latency_seconds', 'Time from a position being published to its contacts being detected',
+                          histogram=self.detection_latency)
+
+    def start_metrics_server(self):
+        if not self.config.METRICS_PORT:
+            return
+        try:
+            self.metrics_server = serve_metrics(self.metrics, self.config.METRICS_PORT, self.config.METRICS_HOST)
+            self.logger.info(f"Serving metrics at http://{self.config.METRICS_HOST}:{self.config.METRICS_PORT}/metrics")
+        except OSError as e:
+            self.logger.error(f"Failed to start metrics endpoint on port {self.config.METRICS_PORT}: {e}")
+
+    def stop_metrics_server(self):
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
 
     @contextmanager
-    def error_handling(self, operation: str):
-        """Context manager for consistent error handling"""
+    def error_handling(self, operation: str, errors=None):
+        """Context manager for consistent error handling
+           errors is an optional counter incremented for every error caught"""
         try:
             yield
-        except ConnectionError as e:
-            if not self.shutdown_event.is_set():
+        except Exception as e:
+            if errors is not None:
+                errors.inc()
+            if self.shutdown_event.is_set():
+                return
+            if isinstance(e, TransportError):
+                self.logger.error(f"Transport error during {operation}: {e}")
+            elif isinstance(e, ConnectionError):
                 self.logger.error(f"Connection error during {operation}: {e}")
-        except HTTPError as e:
-            if not self.shutdown_event.is_set():
+            elif isinstance(e, HTTPError):
                 self.logger.error(f"HTTP error during {operation}: {e.response.text}")
-        except Exception as e:
-            if not self.shutdown_event.is_set():
+            else:
                 self.logger.error(f"Unexpected error during {operation}: {e}")
 
-    def consume_message(self, queue_name: str) -> Optional[dict]:
-        """Consume a message with exponential backoff retry
+    def consume_message(self, queue_name: str) -> Optional[Delivery]:
+        """Consume a single message without waiting
            Returns None if no message is available or on shutdown"""
         if self.shutdown_event.is_set():
             return None
 
-        consume_url = f'{self.config.api_url}/queues/%2F/{queue_name}/get'
-        
-        for attempt in range(5): # Retry up to 5 times with exponential backoff
-            if self.shutdown_event.is_set():
-                return None
-
-            with self.error_handling(f"consuming message from {queue_name}"):
-                response = requests.post(
-                    consume_url,
-                    auth=self.auth,
-                    json={'count': 1, 'ackmode': 'ack_requeue_false', 'encoding': 'auto'}
-                )
-                response.raise_for_status()
-                
-                if response.status_code == 200 and response.json():
-                    return response.json()[0]['payload']
-                
-                if attempt < 4:  # Don't sleep on last attempt
-                    time.sleep(min(2 ** attempt, 30))  # Cap maximum delay at 30 seconds
+        with self.error_handling(f"consuming message from {queue_name}", self.consume_errors_total):
+            start = time.perf_counter()
+            deliveries = self.transport.get(queue_name, count=1)
+            self.consume_latency.observe(time.perf_counter() - start)
+            if deliveries:
+                return deliveries[0]
                 
         return None
 
+    def encode_message(self, routing_key: str, message, extra_properties: Optional[dict] = None) -> Tuple[object, dict]:
+        """Return the (body, properties) of a message, notifications use WIRE_FORMAT and everything else JSON.
+           A str message is already serialized JSON, such as a cached query response"""
+        if isinstance(message, str):
+            body, properties = message, {'content_type': 'application/json'}
+        elif routing_key.startswith(self.notification_prefix):
+            body, properties = encode_notification(self.config.WIRE_FORMAT, message)
+        else:
+            body, properties = json.dumps(message), {'content_type': 'application/json'}
+        properties['delivery_mode'] = 2
+        if extra_properties:
+            properties.update(extra_properties)
+        return body, properties
+
     def publish_message(self, routing_key: str, message: dict):
         """Publish a message to RabbitMQ"""
-        publish_url = f'{self.config.api_url}/exchanges/%2F/{self.config.EXCHANGE_NAME}/publish'
-        
-        payload = {
-            'properties': {
-                'delivery_mode': 2,
-                'content_type': 'application/json'
-            },
-            'routing_key': routing_key,
-            'payload': json.dumps(message),
-            'payload_encoding': 'string'
-        }
-
-        with self.error_handling("publishing message"):
-            response = requests.post(
-                publish_url,
-                auth=self.auth,
-                headers={'content-type': 'application/json'},
-                json=payload
-            )
-            response.raise_for_status()
+        with self.error_handling("publishing message", self.publish_errors_total):
+            start = time.perf_counter()
+            self.transport.publish(routing_key, *self.encode_message(routing_key, message))
+            self.publish_latency.observe(time.perf_counter() - start)
             self.logger.debug(f"Published message: {message}")
 
-    def record_contact(self, person1: str, person2: str, position: Tuple[int, int]):
-        """Record a contact between two people and ensure both receive a notification"""
-        timestamp = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
-        
-        for p1, p2 in [(person1, person2), (person2, person1)]: # Record contact for both people (bidirectional)
-            if p1 not in self.contacts:
-                self.contacts[p1] = {}
-            if p2 not in self.contacts[p1]:
-                self.contacts[p1][p2] = {'count': 0, 'locations': []}
-                
-            self.contacts[p1][p2]['count'] += 1
-            self.contacts[p1][p2]['locations'].append((position[0], position[1], timestamp))
+    def publish_messages(self, messages: List[Tuple]):
+        """Publish several (routing_key, message) pairs in one bulk publish
+           A third element holds extra properties for that message, e.g. a query response's correlation_id"""
+        if not messages:
+            return
+
+        with self.error_handling("publishing messages", self.publish_errors_total):
+            start = time.perf_counter()
+            self.transport.publish_batch([(message[0], *self.encode_message(*message)) for message in messages])
+            self.publish_latency.observe(time.perf_counter() - start)
+            self.logger.debug(f"Published {len(messages)} messages")
+
+    @property
+    def notification_prefix(self) -> str:
+        return f'{self.config.ROUTING_KEY_CONTACT_NOTIFICATIONS}.'
+
+    def notification_routing_key(self, person: str) -> str:
+        """Routing key of the person's own notification queue, e.g. contact-notifications.james"""
+        return f'{self.config.ROUTING_KEY_CONTACT_NOTIFICATIONS}.{person}'
+
+    def record_contact(self, person1: str, person2: str, position: Tuple[int, int],
+                       notifications: Optional[List[Tuple[str, dict]]] = None, start: Optional[float] = None) -> int:
+        """Record a contact between two people that started at start (default now) and ensure both receive
+           a notification. When a notifications list is given they are appended to it for a later bulk publish.
+           Returns the contact store handle of the encounter"""
+        start = time.time() if start is None else start
+        handle = self.store.record(person1, person2, position, start, ongoing=True) # Recorded for both people, persisted in the background
+        self.query_cache.invalidate(person1, person2, tuple(position))
+        timestamp = self.store.format_timestamp(int(start))
+        self.contacts_total.inc()
 
         # Publish notifications for both contacts in a single function call to avoid missing notifications
         for person, contact_person in [(person1, person2), (person2, person1)]:
-            self.publish_message(
-                self.config.ROUTING_KEY_CONTACT_NOTIFICATIONS,
-                {
-                    'person': person,
-                    'contact_person': contact_person,
-                    'location': position,
-                    'timestamp': timestamp
-                }
-            )
-            self.logger.info(f"Contact Notification sent to: {person}")
-
-    def track_position(self):
+            notification = {
+                'person': person,
+                'contact_person': contact_person,
+                'location': position,
+                'timestamp': timestamp
+            }
+            routing_key = self.notification_routing_key(person)
+            if notifications is not None:
+                notifications.append((routing_key, notification))
+                continue
+            self.publish_message(routing_key, notification)
+            suffix = self.notification_log.sample()
+            if suffix is not None:
+                self.logger.info(f"Contact Notification sent to: {person}{suffix}", extra={'person': person})
+        return handle
+
+    def track_position(self) -> bool:
+        """Fetch and process a single position update, returns False if the queue was empty"""
+        delivery = self.consume_message(self.config.QUEUE_POSITION)
+        if delivery is None:
+            return False
+        self.process_position(delivery.body)
+        return True
+
+    def process_positions(self, messages: List):
+        """Process a batch of position updates in arrival order
+           All contact notifications from the batch are sent in one bulk publish"""
+        notifications: List[Tuple[str, dict]] = []
+        for message in messages:
+            with self.error_handling("processing position"):
+                self.process_position(message, notifications)
+
+        self.publish_messages(notifications)
+        suffix = self.notification_log.sample() if notifications else None
+        if suffix is not None:
+            self.logger.info(f"Sent {len(notifications)} contact notifications for {len(messages)} positions{suffix}")
+
+    def process_position(self, message, notifications: Optional[List[Tuple[str, dict]]] = None):
         """Process a position update
-           Updates position and checks for contacts at the same location"""
-        message = self.consume_message(self.config.QUEUE_POSITION)
-        if not message:
-            return
+           Updates position and checks for contacts within the contact radius"""
+        start = time.perf_counter()
+        try:
+            self.apply_position(message, notifications)
+        finally:
+            self.position_stage.observe(time.perf_counter() - start)
 
-        data = json.loads(message)
+    def apply_position(self, message, notifications: Optional[List[Tuple[str, dict]]] = None):
+        # Update the index from a position message and record any encounters it completes
+        now = time.time()
+        self.expire_stale(now)
+        data = decode_position(message) # JSON or the binary layout, see wire.py
         person = data['person'].lower()
+        seq = data.get('seq')
+        if seq is not None: # Sequence numbers only grow, so a redelivered or overtaken update is dropped here
+            if seq <= self.last_seq.get(person, -1):
+                self.stale_positions_total.inc()
+                return
+            self.last_seq[person] = seq
+            self.last_seq.move_to_end(person)
+            if len(self.last_seq) > self.config.POSITION_SEQ_SIZE: # Bounded even when POSITION_TTL is 0
+                self.last_seq.popitem(last=False)
+        if self.config.POSITION_TTL:
+            self.position_expiry.schedule(person, now + self.config.POSITION_TTL)
+        if data.get('leave'): # Sharded: the person moved out of this shard's reach, their sequence number is kept until they expire
+            self.index.remove(person)
+            for encounter in self.encounters.close_person(person): # Any encounter they come back to is a new one
+                self.end_encounter(encounter)
+            return
         new_position = (data['x'], data['y'])
         
-        self.logger.info(f"Tracking {person} at {new_position}")
-        self.positions[person] = new_position
-
-        # Check for contacts at the same position
-        for other_person, other_position in self.positions.items():
-            if other_person != person and other_position == new_position:
-                self.logger.info(f"Contact detected: {person} with {other_person} @ {new_position}")
-                self.record_contact(person, other_person, new_position)
-
-    def handle_query(self):
-        # Handle a single query request for contact information
-        message = self.consume_message(self.config.QUEUE_QUERY)
-        if not message:
+        self.index.move(person, new_position)
+        ghost = data.get('ghost') # Sharded: a neighbouring shard's person near our edge
+        if not ghost:
+            suffix = self.position_log.sample()
+            if suffix is not None:
+                self.logger.info(f"Tracking {person} at {new_position}{suffix}", extra={'person': person, 'position': new_position})
+
+        # Check for contacts in the neighbourhood of the new position, each encounter is recorded once it has lasted CONTACT_MIN_DWELL
+        partition, positions = self.partition, self.positions
+        for other_person in self.index.nearby(person, new_position):
+            if partition is not None and partition.owner(new_position, positions[other_person]) != self.config.TRACKER_SHARD:
+                # Another shard owns this pair now, see sharding.py. An encounter opened here ends, so it never overlaps theirs
+                ended = self.encounters.close(person, other_person)
+                if ended is not None:
+                    self.end_encounter(ended)
+                continue
+            encounter = self.encounters.observe(person, other_person, new_position, now)
+            if encounter is None:
+                continue
+            suffix = self.contact_log.sample()
+            if suffix is not None:
+                self.logger.info(f"Contact detected: {person} with {other_person} @ {encounter.position}{suffix}",
+                                 extra={'person': person, 'contact_person': other_person, 'position': encounter.position})
+            encounter.handle = self.record_contact(person, other_person, encounter.position, notifications, encounter.start)
+
+        if ghost: # Counted by the person's home shard
             return
+        self.positions_total.inc()
+        if 'ts' in data: # Publish time stamped by Person
+            self.detection_latency.observe(time.time() - data['ts'])
+
+    def expire_stale(self, now: float):
+        """Drop people whose position is older than POSITION_TTL and end encounters not seen for CONTACT_MERGE_GAP"""
+        for person in self.position_expiry.expire(now):
+            self.last_seq.pop(person, None)
+            if person in self.index:
+                self.index.remove(person)
+                self.expired_total.inc()
+        for encounter in self.encounters.expire(now):
+            self.end_encounter(encounter)
+
+    def close_encounters(self):
+        # Store the end time of every encounter still open at shutdown
+        for encounter in self.encounters.close_all():
+            self.end_encounter(encounter)
 
+    def end_encounter(self, encounter):
+        # Store the encounter's end time, which changes the query answers for both people and the cell
+        self.store.end(encounter.handle, encounter.last_seen)
+        self.query_cache.invalidate(*encounter.pair, encounter.position)
+
+    def handle_query(self) -> bool:
+        # Handle a single query request for contact information, returns False if the queue was empty
+        delivery = self.consume_message(self.config.QUEUE_QUERY)
+        if delivery is None:
+            return False
+        self.process_query(delivery.body, delivery.properties)
+        return True
+
+    def process_query_delivery(self, delivery: Delivery):
+        self.process_query(delivery.body, delivery.properties)
+
+    def process_query(self, message, properties: Optional[dict] = None):
+        # Answer a query request for contact information and publish the response
+        responses = self.answer_query(message, properties)
+        if not responses:
+            return
+        self.publish_messages(responses)
+        self.logger.info(f"Query {json.loads(message)['query_id']} processed and response sent in {len(responses)} chunks")
+
+    def reply_routing_key(self, properties: Optional[dict]) -> str:
+        """Routing key for a query's response: the client's own reply_to, or the shared response queue's
+           key for clients that do not send one. reply_to must be under ROUTING_KEY_RESPONSE so a query
+           cannot make the tracker publish anywhere else"""
+        reply_to = (properties or {}).get('reply_to')
+        if reply_to and reply_to.startswith(f'{self.config.ROUTING_KEY_RESPONSE}.'):
+            return reply_to
+        return self.config.ROUTING_KEY_RESPONSE
+
+    def answer_query(self, message, properties: Optional[dict] = None) -> List[Tuple[str, object, dict]]:
+        # Build the (routing_key, chunk, properties) responses for a query request and the properties it arrived with
+        # The answer is sent as one or more chunks that query.py reassembles, a query already answered gets none
         data = json.loads(message)
         query_id = data['query_id']
-        query_person = data['query_person'].strip().lower()
-        
-        self.logger.info(f"Processing query {query_id} for {query_person}")
-        
-        contact_info = self.contacts.get(query_person, {}) # Get contact information for the queried person
-        response = {
-            'query_id': query_id,
-            'contacts': contact_info if contact_info else 'no contact'
-        }
+        query_type = data.get('type', 'contacts')
+        reply = (self.reply_routing_key(properties), {'correlation_id': query_id})
+        if query_id in self.answered_queries:
+            self.logger.info(f"Skipped query {query_id}, it was already answered")
+            self.duplicate_queries_total.inc()
+            return []
+        self.answered_queries[query_id] = True
+        if len(self.answered_queries) > self.config.QUERY_DEDUP_SIZE:
+            self.answered_queries.popitem(last=False)
         
-        self.publish_message('query-response', response)
-        self.logger.info(f"Query {query_id} processed and response sent")
+        start = time.perf_counter()
+        cache_key = self.query_engine.cache_key(data) if self.config.QUERY_CACHE_BYTES else None
+        if cache_key is not None:
+            key, dependencies = cache_key
+            bodies, stamp = self.query_cache.get(key)
+            if bodies is not None: # Answered before and nothing it depends on has changed
+                self.logger.info(f"Answering {query_type} query {query_id} for {data.get('query_person', '')} from the cache")
+                self.query_cache_hits_total.inc()
+                self.query_stage.observe(time.perf_counter() - start)
+                self.queries_total.inc()
+                return [(reply[0], with_query_id(body, query_id), reply[1]) for body in bodies]
+            self.query_cache_misses_total.inc()
+
+        subject = f"{len(data['people'])} people" if isinstance(data.get('people'), list) else data.get('query_person', '')
+        self.logger.info(f"Processing {query_type} query {query_id} for {subject}")
+        try:
+            chunks = self.query_engine.execute(data)
+        except ValueError as e:
+            self.logger.warning(f"Rejected query {query_id}: {e}")
+            self.query_errors_total.inc()
+            chunks = [{'type': query_type, 'error': str(e), 'chunk': 0, 'chunks': 1}]
+            cache_key = None
+        for chunk in chunks:
+            if self.config.TRACKER_SHARD is not None: # query.py gathers one answer per shard
+                chunk['shard'] = self.config.TRACKER_SHARD
+        if cache_key is not None: # Serialized without the query_id, which is added to each copy sent
+            bodies = [json.dumps(chunk) for chunk in chunks]
+            self.query_cache.put(key, dependencies, bodies, stamp)
+            responses = [(reply[0], with_query_id(body, query_id), reply[1]) for body in bodies]
+        else:
+            for chunk in chunks:
+                chunk['query_id'] = query_id
+            responses = [(reply[0], chunk, reply[1]) for chunk in chunks]
+        self.query_stage.observe(time.perf_counter() - start)
+        self.queries_total.inc()
+        return responses
 
     def run_thread(self, target, name):
-        # Run a thread with proper exception handling and shutdown coordination
+        # Run a polling thread with proper exception handling and shutdown coordination
+        # Polls back to back while messages are flowing and backs off while the queue is empty
+        poll_delay = PollDelay(self.config.POLL_MIN_DELAY, self.config.POLL_MAX_DELAY)
         try:
             while not self.shutdown_event.is_set():
-                target()
-                self.shutdown_event.wait(timeout=0.5)
+                delay = poll_delay.next(target())
+                if delay:
+                    self.shutdown_event.wait(timeout=delay)
         except Exception as e:
             if not self.shutdown_event.is_set():
                 self.logger.error(f"Error in {name} thread: {e}")
+
+    def run_consumer(self, queue_name: str, handler, name: str):
+        """Run a push consumer that hands each Delivery to handler
+           Reconnects after transport errors until shutdown"""
+        def on_message(delivery: Delivery):
+            with self.error_handling(f"processing {name} message"):
+                handler(delivery)
+
+        while not self.shutdown_event.is_set():
+            with self.error_handling(f"{name} consumer"):
+                self.transport.consume(queue_name, on_message, self.shutdown_event, self.config.PREFETCH_COUNT)
+            self.shutdown_event.wait(timeout=1)
+
+    def run_batch_consumer(self, queue_name: str, handler, name: str):
+        """Run a consumer that hands lists of up to POSITION_BATCH_SIZE message bodies to handler"""
+        def on_batch(deliveries: List[Delivery]):
+            with self.error_handling(f"processing {name} batch"):
+                handler([delivery.body for delivery in deliveries])
+
+        while not self.shutdown_event.is_set():
+            with self.error_handling(f"{name} consumer"):
+                self.transport.consume_batch(queue_name, on_batch, self.shutdown_event,
+                                             self.config.POSITION_BATCH_SIZE, self.config.POSITION_BATCH_LINGER,
+                                             self.config.PREFETCH_COUNT)
+            self.shutdown_event.wait(timeout=1)
                 
+    def report_latency(self):
+        # Log the publish-to-detection latency distribution
+        self.logger.info(f"Detection latency: {format_latency(self.detection_latency.snapshot())}")
+
     def shutdown(self):
         # Gracefully shutdown the tracker
         self.logger.info("Initiating shutdown sequence...")
@@ -244,24 +586,37 @@ class ContactTracker:
         Starts position tracking and query handling threads
         Handles graceful shutdown on interrupt
         """
+        self.start_metrics_server()
+        if self.config.RUNTIME == 'asyncio':
+            return self.run_async()
         self.logger.info("Starting contact tracking system...")
         
-        # Create threads
-        position_thread = threading.Thread(
-            target=lambda: self.run_thread(self.track_position, "position"),
-            daemon=True
-        )
-        query_thread = threading.Thread(
-            target=lambda: self.run_thread(self.handle_query, "query"),
-            daemon=True
-        )
+        # Create threads, using push consumers when the transport supports them
+        if self.config.POSITION_BATCH_SIZE > 1:
+            position_target = lambda: self.run_batch_consumer(self.config.QUEUE_POSITION, self.process_positions, "position")
+            query_target = lambda: self.run_consumer(self.config.QUEUE_QUERY, self.process_query_delivery, "query")
+        elif self.transport.supports_push:
+            position_target = lambda: self.run_consumer(self.config.QUEUE_POSITION,
+                                                        lambda delivery: self.process_position(delivery.body), "position")
+            query_target = lambda: self.run_consumer(self.config.QUEUE_QUERY, self.process_query_delivery, "query")
+        else:
+            position_target = lambda: self.run_thread(self.track_position, "position")
+            query_target = lambda: self.run_thread(self.handle_query, "query")
+
+        position_thread = threading.Thread(target=position_target, daemon=True)
+        query_thread = threading.Thread(target=query_target, daemon=True)
         
         try:
             position_thread.start()
             query_thread.start()
 
+            last_report = time.monotonic()
             while not self.shutdown_event.is_set():
                 time.sleep(0.1)
+                interval = self.config.LATENCY_REPORT_INTERVAL
+                if interval and time.monotonic() - last_report >= interval:
+                    self.report_latency()
+                    last_report = time.monotonic()
                 
         except KeyboardInterrupt:
             self.logger.info("Keyboard interrupt received")
@@ -275,9 +630,34 @@ class ContactTracker:
                     self.logger.warning(f"{name} thread did not shutdown gracefully")
                 else:
                     self.logger.info(f"{name} thread closed successfully")
+            self.stop_metrics_server()
+            self.transport.close()
+            close_clients() # Keep-alive sessions of the HTTP transport
+            self.close_encounters()
+            self.store.close()
+
+    def run_async(self):
+        """
+        Run the asyncio runtime on the calling thread
+        Returns once shutdown has been requested and in-flight work has drained
+        """
+        self.logger.info("Starting contact tracking system (asyncio runtime)...")
+        try:
+            asyncio.run(AsyncTrackerRuntime(self, self.config.ASYNC_QUEUE_SIZE).run())
+        except KeyboardInterrupt:
+            self.logger.info("Keyboard interrupt received")
+        finally:
+            self.shutdown()
+            self.stop_metrics_server()
+            self.transport.close()
+            close_clients() # Keep-alive sessions of the HTTP transport
+            self.close_encounters()
+            self.store.close()
 
 def main():
     config = Config()
+    if len(sys.argv) > 1: # Optional shard number when the grid is sharded
+        config.use_shard(int(sys.argv[1]))
     tracker = ContactTracker(config)
     
     def signal_handler(signum, frame): # Setup signal handlers for graceful shutdown
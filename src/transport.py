@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+"""
+Pluggable message transport used by the tracker, person and query applications.
+
+Three backends are available and selected with the TRANSPORT environment variable:
+  - amqp:  persistent AMQP 0-9-1 connection through pika (default)
+  - http:  the RabbitMQ management HTTP API (fallback when port 5672 is unavailable)
+  - local: an in-process broker stand-in, used for tests and benchmarks
+"""
+import base64
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import requests
+from requests.exceptions import RequestException
+
+from http_client import get_client
+
+try:
+    import pika
+    from pika.exceptions import AMQPError
+except ImportError:  # pika is optional when only the HTTP or local transport is used
+    pika = None
+    AMQPError = Exception
+
+logger = logging.getLogger(__name__)
+
+Body = Union[str, bytes]
+
+class TransportError(Exception):
+    """Raised when a transport fails to publish, fetch or declare"""
+
+@dataclass
+class Delivery:
+    """A single message received from a queue"""
+    body: Body
+    routing_key: str = ''
+    properties: Dict = field(default_factory=dict)
+
+class PollDelay:
+    """Adaptive polling delay: zero while messages are flowing, doubling up to max_delay while idle"""
+
+    def __init__(self, min_delay: float = 0.01, max_delay: float = 0.5):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = 0.0
+
+    def next(self, received: bool) -> float:
+        """Return how long to wait before the next poll"""
+        if received:
+            self.delay = 0.0
+        else:
+            self.delay = min(max(self.delay * 2, self.min_delay), self.max_delay)
+        return self.delay
+
+class Transport:
+    """
+    Base class for all transports.
+    Subclasses implement publish, get and the declare methods; push consumption
+    falls back to polling when the backend has no native consumer support.
+    """
+    supports_push = False
+
+    def __init__(self, exchange_name: str):
+        self.exchange_name = exchange_name
+        self.poll_min_delay = 0.01  # Idle polling delays used by the polling consumers
+        self.poll_max_delay = 0.5
+
+    def publish(self, routing_key: str, body: Body, properties: Optional[dict] = None, exchange: Optional[str] = None):
+        raise NotImplementedError
+
+    def publish_batch(self, messages: List[Tuple[str, Body, Optional[dict]]]):
+        """Publish several (routing_key, body, properties) messages"""
+        for routing_key, body, properties in messages:
+            self.publish(routing_key, body, properties)
+
+    def get(self, queue_name: str, count: int = 1) -> List[Delivery]:
+        raise NotImplementedError
+
+    def consume(self, queue_name: str, on_message: Callable[[Delivery], None],
+                stop_event: threading.Event, prefetch: int = 1):
+        """Deliver messages to on_message until stop_event is set"""
+        poll_delay = PollDelay(self.poll_min_delay, self.poll_max_delay)
+        while not stop_event.is_set():
+            deliveries = self.get(queue_name, prefetch)
+            for delivery in deliveries:
+                on_message(delivery)
+            delay = poll_delay.next(bool(deliveries))
+            if delay:
+                stop_event.wait(timeout=delay)
+
+    def consume_batch(self, queue_name: str, on_batch: Callable[[List[Delivery]], None],
+                      stop_event: threading.Event, batch_size: int, linger: float, prefetch: int = 1):
+        """Deliver lists of up to batch_size messages to on_batch until stop_event is set.
+           A partial batch is delivered once its first message has waited linger seconds."""
+        poll_delay = PollDelay(self.poll_min_delay, self.poll_max_delay)
+        while not stop_event.is_set():
+            batch = self.get(queue_name, batch_size)
+            delay = poll_delay.next(bool(batch))
+            if not batch:
+                stop_event.wait(timeout=delay)
+                continue
+            deadline = time.monotonic() + linger
+            while len(batch) < batch_size and not stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                more = self.get(queue_name, batch_size - len(batch))
+                if more:
+                    batch.extend(more)
+                else:
+                    stop_event.wait(timeout=min(remaining, self.poll_min_delay))
+            on_batch(batch)
+
+    def declare_exchange(self, name: str, exchange_type: str = 'topic', durable: bool = True):
+        raise NotImplementedError
+
+    def declare_queue(self, name: str, durable: bool = True, auto_delete: bool = False, exclusive: bool = False,
+                      arguments: Optional[dict] = None):
+        raise NotImplementedError
+
+    def bind_queue(self, queue_name: str, routing_key: str, exchange: Optional[str] = None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class HttpTransport(Transport):
+    """Transport using the RabbitMQ management HTTP API (one request per operation)
+    Requests go through the shared keep-alive client from http_client."""
+
+    def __init__(self, api_url: str, username: str, password: str, exchange_name: str, **client_options):
+        super().__init__(exchange_name)
+        self.api_url = api_url
+        self.client = get_client(api_url, username, password, **client_options)
+
+    def _request(self, method: str, path: str, payload: dict) -> requests.Response:
+        try:
+            return self.client.request(method, path, payload)
+        except RequestException as e:
+            raise TransportError(f"{method} {path} failed: {e}") from e
+
+    def publish(self, routing_key: str, body: Body, properties: Optional[dict] = None, exchange: Optional[str] = None):
+        if isinstance(body, bytes):
+            payload, encoding = base64.b64encode(body).decode('ascii'), 'base64'
+        else:
+            payload, encoding = body, 'string'
+
+        exchange = self.exchange_name if exchange is None else exchange
+        exchange_path = exchange or 'amq.default'
+        response = self._request('POST', f'exchanges/%2F/{exchange_path}/publish', {
+            'properties': properties or {},
+            'routing_key': routing_key,
+            'payload': payload,
+            'payload_encoding': encoding
+        })
+        if not response.json().get('routed', True):
+            logger.debug(f"Message with routing key {routing_key} was not routed to any queue")
+
+    def get(self, queue_name: str, count: int = 1) -> List[Delivery]:
+        response = self._request('POST', f'queues/%2F/{queue_name}/get', {
+            'count': count,
+            'ackmode': 'ack_requeue_false',
+            'encoding': 'base64' # 'auto' hands back binary bodies that happen to be valid UTF-8 as text
+        })
+        deliveries = []
+        for message in response.json() or []:
+            body = base64.b64decode(message['payload']) # Bytes, as the amqp transport delivers them
+            deliveries.append(Delivery(body, message.get('routing_key', ''), message.get('properties') or {}))
+        return deliveries
+
+    def declare_exchange(self, name: str, exchange_type: str = 'topic', durable: bool = True):
+        self._request('PUT', f'exchanges/%2F/{name}', {'type': exchange_type, 'durable': durable})
+
+    def declare_queue(self, name: str, durable: bool = True, auto_delete: bool = False, exclusive: bool = False,
+                      arguments: Optional[dict] = None):
+        # The management API cannot own an exclusive queue, so exclusive falls back to auto-delete
+        self._request('PUT', f'queues/%2F/{name}',
+                      {'durable': durable, 'auto_delete': auto_delete or exclusive, 'arguments': arguments or {}})
+
+    def bind_queue(self, queue_name: str, routing_key: str, exchange: Optional[str] = None):
+        exchange = exchange or self.exchange_name
+        self._request('POST', f'bindings/%2F/e/{exchange}/q/{queue_name}', {'routing_key': routing_key})
+
+class AmqpTransport(Transport):
+    """
+    Transport using a persistent AMQP 0-9-1 connection.
+    pika's BlockingConnection is not thread safe, so each thread gets its own
+    connection and channel. Channels run in confirm mode so every publish is
+    acknowledged by the broker before returning. Bulk publishes go through a
+    second, transactional channel so a whole batch costs one round trip.
+    """
+    supports_push = True
+
+    def __init__(self, host: str, port: int, username: str, password: str, exchange_name: str,
+                 heartbeat: int = 60):
+        if pika is None:
+            raise TransportError("The amqp transport requires pika. Install it or set TRANSPORT=http")
+        super().__init__(exchange_name)
+        self.parameters = pika.ConnectionParameters(
+            host=host,
+            port=int(port),
+            credentials=pika.PlainCredentials(username, password),
+            heartbeat=heartbeat
+        )
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def _channel(self):
+        """Return this thread's channel, opening a connection if required"""
+        channel = getattr(self._local, 'channel', None)
+        if channel is not None and channel.is_open:
+            return channel
+
+        try:
+            connection = pika.BlockingConnection(self.parameters)
+            channel = connection.channel()
+            channel.confirm_delivery()
+        except AMQPError as e:
+            raise TransportError(f"Failed to connect to {self.parameters.host}:{self.parameters.port}: {e}") from e
+
+        self._local.connection = connection
+        self._local.channel = channel
+        self._local.tx_channel = None
+        with self._connections_lock:
+            self._connections.append(connection)
+        return channel
+
+    def _reset(self):
+        """Drop this thread's connection so the next call reconnects"""
+        connection = getattr(self._local, 'connection', None)
+        self._local.channel = None
+        self._local.tx_channel = None
+        self._local.connection = None
+        if connection is not None:
+            with self._connections_lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+            try:
+                if connection.is_open:
+                    connection.close()
+            except AMQPError:
+                pass
+
+    def publish(self, routing_key: str, body: Body, properties: Optional[dict] = None, exchange: Optional[str] = None):
+        exchange = self.exchange_name if exchange is None else exchange
+        try:
+            self._channel().basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=pika.BasicProperties(**(properties or {}))
+            )
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Failed to publish to {routing_key}: {e}") from e
+
+    def _tx_channel(self):
+        """Return this thread's transactional channel, opened on the same connection"""
+        channel = getattr(self._local, 'tx_channel', None)
+        if channel is not None and channel.is_open:
+            return channel
+        channel = self._channel().connection.channel()
+        channel.tx_select()
+        self._local.tx_channel = channel
+        return channel
+
+    def publish_batch(self, messages: List[Tuple[str, Body, Optional[dict]]]):
+        """Publish every message in one transaction, the commit is the batch's only broker round trip"""
+        try:
+            channel = self._tx_channel()
+            for routing_key, body, properties in messages:
+                channel.basic_publish(
+                    exchange=self.exchange_name,
+                    routing_key=routing_key,
+                    body=body,
+                    properties=pika.BasicProperties(**(properties or {}))
+                )
+            channel.tx_commit()
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Failed to publish batch of {len(messages)} messages: {e}") from e
+
+    def get(self, queue_name: str, count: int = 1) -> List[Delivery]:
+        deliveries = []
+        try:
+            channel = self._channel()
+            for _ in range(count):
+                method, properties, body = channel.basic_get(queue_name, auto_ack=True)
+                if method is None:
+                    break
+                deliveries.append(Delivery(body, method.routing_key, _properties_to_dict(properties)))
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Failed to get from {queue_name}: {e}") from e
+        return deliveries
+
+    def consume(self, queue_name: str, on_message: Callable[[Delivery], None],
+                stop_event: threading.Event, prefetch: int = 1):
+        """Push consumer: the broker delivers up to prefetch unacknowledged messages at a time"""
+        def callback(channel, method, properties, body):
+            try:
+                on_message(Delivery(body, method.routing_key, _properties_to_dict(properties)))
+            except Exception as e:
+                logger.error(f"Error handling message from {queue_name}: {e}")
+            finally:
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        try:
+            channel = self._channel()
+            channel.basic_qos(prefetch_count=prefetch)
+            consumer_tag = channel.basic_consume(queue_name, callback)
+            while not stop_event.is_set():
+                channel.connection.process_data_events(time_limit=0.5)
+            channel.basic_cancel(consumer_tag)
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Consumer on {queue_name} failed: {e}") from e
+
+    def consume_batch(self, queue_name: str, on_batch: Callable[[List[Delivery]], None],
+                      stop_event: threading.Event, batch_size: int, linger: float, prefetch: int = 1):
+        """Push consumer that groups deliveries into batches.
+           Each batch is acknowledged with a single multiple-ack once on_batch returns."""
+        pending: List[Tuple[int, Delivery]] = []
+
+        def callback(channel, method, properties, body):
+            pending.append((method.delivery_tag, Delivery(body, method.routing_key, _properties_to_dict(properties))))
+
+        def flush(channel, count: int):
+            batch = pending[:count]
+            del pending[:count]
+            try:
+                on_batch([delivery for _, delivery in batch])
+            except Exception as e:
+                logger.error(f"Error handling batch from {queue_name}: {e}")
+            finally:
+                channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+
+        try:
+            channel = self._channel()
+            channel.basic_qos(prefetch_count=max(prefetch, batch_size)) # The broker must be allowed to fill a batch
+            consumer_tag = channel.basic_consume(queue_name, callback)
+            batch_started = None
+            while not stop_event.is_set():
+                time_limit = 0.5
+                if pending:
+                    if batch_started is None:
+                        batch_started = time.monotonic()
+                    while len(pending) >= batch_size:
+                        flush(channel, batch_size)
+                    time_limit = linger - (time.monotonic() - batch_started)
+                    if pending and time_limit <= 0:
+                        flush(channel, len(pending))
+                    if not pending:
+                        batch_started, time_limit = None, 0.5
+                channel.connection.process_data_events(time_limit=max(time_limit, 0))
+            channel.basic_cancel(consumer_tag)
+            if pending:
+                flush(channel, len(pending))
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Consumer on {queue_name} failed: {e}") from e
+
+    def declare_exchange(self, name: str, exchange_type: str = 'topic', durable: bool = True):
+        try:
+            self._channel().exchange_declare(name, exchange_type=exchange_type, durable=durable)
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Failed to declare exchange {name}: {e}") from e
+
+    def declare_queue(self, name: str, durable: bool = True, auto_delete: bool = False, exclusive: bool = False,
+                      arguments: Optional[dict] = None):
+        try:
+            self._channel().queue_declare(name, durable=durable, auto_delete=auto_delete, exclusive=exclusive,
+                                          arguments=arguments)
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Failed to declare queue {name}: {e}") from e
+
+    def bind_queue(self, queue_name: str, routing_key: str, exchange: Optional[str] = None):
+        try:
+            self._channel().queue_bind(queue_name, exchange or self.exchange_name, routing_key=routing_key)
+        except AMQPError as e:
+            self._reset()
+            raise TransportError(f"Failed to bind {queue_name} to {routing_key}: {e}") from e
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                if connection.is_open:
+                    connection.close()
+            except AMQPError:
+                pass
+
+def _properties_to_dict(properties) -> dict:
+    """Convert pika BasicProperties into the plain dict used by Delivery"""
+    if properties is None:
+        return {}
+    return {name: value for name, value in vars(properties).items() if value is not None}
+
+class LocalBroker:
+    """
+    Minimal in-memory stand-in for RabbitMQ.
+    Supports topic exchanges, the default exchange and durable/auto-delete queues,
+    which is everything the contact tracing applications rely on.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._exchanges: Dict[str, str] = {'': 'direct'}
+        self._queues: Dict[str, deque] = {}
+        self._bindings: List[Tuple[str, str, str, Tuple[str, ...]]] = []  # (exchange, routing_key, queue, words)
+
+    def declare_exchange(self, name: str, exchange_type: str = 'topic'):
+        with self._condition:
+            self._exchanges.setdefault(name, exchange_type)
+
+    def declare_queue(self, name: str):
+        with self._condition:
+            self._queues.setdefault(name, deque())
+
+    def bind_queue(self, exchange: str, queue_name: str, routing_key: str):
+        with self._condition:
+            self._queues.setdefault(queue_name, deque())
+            if not any(b[:3] == (exchange, routing_key, queue_name) for b in self._bindings):
+                self._bindings.append((exchange, routing_key, queue_name, tuple(routing_key.split('.'))))
+
+    def publish(self, exchange: str, delivery: Delivery) -> bool:
+        """Route a message to every bound queue, returns False if it was unroutable"""
+        with self._condition:
+            if exchange == '':
+                targets = [delivery.routing_key] if delivery.routing_key in self._queues else []
+            else:
+                if exchange not in self._exchanges:
+                    raise TransportError(f"Exchange {exchange} does not exist")
+                key_words = tuple(delivery.routing_key.split('.'))
+                targets = {queue for ex, _, queue, words in self._bindings
+                           if ex == exchange and _topic_matches(words, key_words)}
+            for queue_name in targets:
+                self._queues[queue_name].append(delivery)
+            if targets:
+                self._condition.notify_all()
+            return bool(targets)
+
+    def get(self, queue_name: str, count: int = 1) -> List[Delivery]:
+        with self._condition:
+            queue = self._queues.get(queue_name)
+            if queue is None:
+                raise TransportError(f"Queue {queue_name} does not exist")
+            return [queue.popleft() for _ in range(min(count, len(queue)))]
+
+    def wait(self, queue_name: str, timeout: float) -> bool:
+        """Block until the queue has a message or the timeout expires"""
+        with self._condition:
+            return self._condition.wait_for(lambda: bool(self._queues.get(queue_name)), timeout=timeout)
+
+    def depth(self, queue_name: str) -> int:
+        with self._condition:
+            return len(self._queues.get(queue_name, ()))
+
+def _topic_matches(binding_words: Tuple[str, ...], key_words: Tuple[str, ...]) -> bool:
+    """Topic exchange matching: '*' matches exactly one word, '#' matches zero or more words"""
+    if binding_words == key_words:
+        return True
+    if not binding_words:
+        return not key_words
+    head = binding_words[0]
+    if head == '#':
+        return any(_topic_matches(binding_words[1:], key_words[i:]) for i in range(len(key_words) + 1))
+    if key_words and (head == '*' or head == key_words[0]):
+        return _topic_matches(binding_words[1:], key_words[1:])
+    return False
+
+# Shared broker used when TRANSPORT=local so all components in one process see the same queues
+LOCAL_BROKER = LocalBroker()
+
+class LocalTransport(Transport):
+    """Transport backed by a LocalBroker, for tests and benchmarks"""
+    supports_push = True
+
+    def __init__(self, exchange_name: str, broker: Optional[LocalBroker] = None):
+        super().__init__(exchange_name)
+        self.broker = broker or LOCAL_BROKER
+
+    def publish(self, routing_key: str, body: Body, properties: Optional[dict] = None, exchange: Optional[str] = None):
+        exchange = self.exchange_name if exchange is None else exchange
+        self.broker.publish(exchange, Delivery(body, routing_key, dict(properties or {})))
+
+    def get(self, queue_name: str, count: int = 1) -> List[Delivery]:
+        return self.broker.get(queue_name, count)
+
+    def consume(self, queue_name: str, on_message: Callable[[Delivery], None],
+                stop_event: threading.Event, prefetch: int = 1):
+        while not stop_event.is_set():
+            deliveries = self.broker.get(queue_name, prefetch)
+            if not deliveries:
+                self.broker.wait(queue_name, timeout=0.1)
+            for delivery in deliveries:
+                on_message(delivery)
+
+    def consume_batch(self, queue_name: str, on_batch: Callable[[List[Delivery]], None],
+                      stop_event: threading.Event, batch_size: int, linger: float, prefetch: int = 1):
+        while not stop_event.is_set():
+            batch = self.broker.get(queue_name, batch_size)
+            if not batch:
+                self.broker.wait(queue_name, timeout=0.1)
+                continue
+            deadline = time.monotonic() + linger
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.broker.wait(queue_name, timeout=remaining):
+                    break
+                batch.extend(self.broker.get(queue_name, batch_size - len(batch)))
+            on_batch(batch)
+
+    def declare_exchange(self, name: str, exchange_type: str = 'topic', durable: bool = True):
+        self.broker.declare_exchange(name, exchange_type)
+
+    def declare_queue(self, name: str, durable: bool = True, auto_delete: bool = False, exclusive: bool = False,
+                      arguments: Optional[dict] = None):
+        self.broker.declare_queue(name)
+
+    def bind_queue(self, queue_name: str, routing_key: str, exchange: Optional[str] = None):
+        self.broker.bind_queue(exchange or self.exchange_name, queue_name, routing_key)
+
+def create_transport(config) -> Transport:
+    """Build the transport selected by config.TRANSPORT"""
+    kind = config.TRANSPORT.lower()
+    if kind == 'amqp':
+        transport = AmqpTransport(config.RABBITMQ_HOST, config.RABBITMQ_AMQP_PORT,
+                                  config.USERNAME, config.PASSWORD, config.EXCHANGE_NAME)
+    elif kind == 'http':
+        transport = HttpTransport(config.api_url, config.USERNAME, config.PASSWORD, config.EXCHANGE_NAME,
+                                  timeout=getattr(config, 'HTTP_TIMEOUT', 10.0),
+                                  retries=getattr(config, 'HTTP_RETRIES', 3))
+    elif kind == 'local':
+        transport = LocalTransport(config.EXCHANGE_NAME)
+    else:
+        raise ValueError(f"Unknown transport '{config.TRANSPORT}', expected amqp, http or local")
+
+    # Only the tracker configures polling delays, other applications keep the defaults
+    transport.poll_min_delay = getattr(config, 'POLL_MIN_DELAY', transport.poll_min_delay)
+    transport.poll_max_delay = getattr(config, 'POLL_MAX_DELAY', transport.poll_max_delay)
+    return transport
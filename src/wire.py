@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Wire formats for the hot message types: position updates and contact notifications.
+
+WIRE_FORMAT=json (default) sends them as JSON with content type application/json.
+WIRE_FORMAT=binary packs them into a fixed struct layout followed by the UTF-8 names:
+  - position:     tag, flags, x, y, seq, ts, then the person's name
+  - notification: tag, x, y, name lengths, then the person, contact and timestamp
+Binary messages are published with their own content type and start with a tag
+byte that JSON text never starts with, so consumers accept either format and
+publishers can switch one at a time. Queries and their responses stay JSON.
+
+decode_position and decode_notification return the same dict for both formats.
+"""
+import json
+import struct
+from typing import Optional, Tuple, Union
+
+Body = Union[str, bytes]
+
+WIRE_FORMATS = ('json', 'binary')
+
+JSON_CONTENT_TYPE = 'application/json'
+POSITION_CONTENT_TYPE = 'application/x-contact-position'
+NOTIFICATION_CONTENT_TYPE = 'application/x-contact-notification'
+
+POSITION_TAG = 0x01
+NOTIFICATION_TAG = 0x02
+
+POSITION = struct.Struct('<BBiiqd')  # tag, flags, x, y, seq, ts
+NOTIFICATION = struct.Struct('<BiiHH')  # tag, x, y, person length, contact person length
+
+# Position flags
+GHOST = 0x01
+LEAVE = 0x02
+HAS_SEQ = 0x04
+HAS_TS = 0x08
+
+def check_format(wire_format: str) -> str:
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"Unknown wire format '{wire_format}', expected one of {', '.join(WIRE_FORMATS)}")
+    return wire_format
+
+def encode_position(wire_format: str, person: str, x: int = 0, y: int = 0, ts: Optional[float] = None,
+                    seq: Optional[int] = None, ghost: bool = False, leave: bool = False) -> Tuple[Body, dict]:
+    """Return (body, properties) for a position update, or a leave message when leave is set"""
+    if wire_format == 'binary':
+        flags = (GHOST if ghost else 0) | (LEAVE if leave else 0)
+        flags |= (HAS_SEQ if seq is not None else 0) | (HAS_TS if ts is not None else 0)
+        body = POSITION.pack(POSITION_TAG, flags, x, y, seq or 0, ts or 0.0) + person.encode('utf-8')
+        return body, {'content_type': POSITION_CONTENT_TYPE}
+
+    if leave:
+        message = {'person': person, 'leave': True}
+    else:
+        message = {'person': person, 'x': x, 'y': y}
+        if ts is not None:
+            message['ts'] = ts
+    if seq is not None:
+        message['seq'] = seq
+    if ghost:
+        message['ghost'] = True
+    return json.dumps(message), {'content_type': JSON_CONTENT_TYPE}
+
+def decode_position(body: Body) -> dict:
+    """Decode a position update in either format into the JSON message's dict"""
+    body = _binary(body, b'\x01')
+    if body[:1] == b'\x01':
+        _, flags, x, y, seq, ts = POSITION.unpack_from(body)
+        person = body[POSITION.size:].decode('utf-8')
+        if flags & LEAVE:
+            data = {'person': person, 'leave': True}
+        else:
+            data = {'person': person, 'x': x, 'y': y}
+            if flags & HAS_TS:
+                data['ts'] = ts
+        if flags & HAS_SEQ:
+            data['seq'] = seq
+        if flags & GHOST:
+            data['ghost'] = True
+        return data
+    return json.loads(body)
+
+def _binary(body: Body, tag: bytes) -> Body:
+    # A binary body handed over as text (valid UTF-8 decoded by a broker client) is turned back into bytes
+    if isinstance(body, str) and body[:1] == tag.decode('ascii'):
+        return body.encode('utf-8')
+    return body
+
+def encode_notification(wire_format: str, notification: dict) -> Tuple[Body, dict]:
+    """Return (body, properties) for a contact notification dict"""
+    if wire_format == 'binary':
+        person = notification['person'].encode('utf-8')
+        contact_person = notification['contact_person'].encode('utf-8')
+        x, y = notification['location']
+        body = (NOTIFICATION.pack(NOTIFICATION_TAG, x, y, len(person), len(contact_person))
+                + person + contact_person + notification['timestamp'].encode('utf-8'))
+        return body, {'content_type': NOTIFICATION_CONTENT_TYPE}
+    return json.dumps(notification), {'content_type': JSON_CONTENT_TYPE}
+
+def decode_notification(body: Body) -> dict:
+    """Decode a contact notification in either format into the JSON message's dict"""
+    body = _binary(body, b'\x02')
+    if body[:1] == b'\x02':
+        _, x, y, person_length, contact_length = NOTIFICATION.unpack_from(body)
+        start = NOTIFICATION.size
+        middle = start + person_length
+        end = middle + contact_length
+        return {
+            'person': body[start:middle].decode('utf-8'),
+            'contact_person': body[middle:end].decode('utf-8'),
+            'location': [x, y],
+            'timestamp': body[end:].decode('utf-8')
+        }
+    return json.loads(body)